@@ -0,0 +1,136 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.db.models import prefetch_related_objects
+from django.urls import re_path
+
+# Методы, которые обслуживает асинхронное чтение;
+# остальные передаются синхронному вьюсету.
+ASYNC_METHODS = ('GET', 'HEAD')
+
+ASYNC_ACTIONS = ('list', 'retrieve')
+
+
+def run_in_thread(func, *args, **kwargs):
+    """
+    Выполняет синхронный код с запросами к базе в пуле потоков,
+    не занимая цикл событий. У каждого потока свое соединение,
+    поэтому такие вызовы можно выполнять параллельно; соединения
+    закрываются по тем же правилам CONN_MAX_AGE, что и после запроса.
+    """
+    def task():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(task, thread_sensitive=False)()
+
+
+async def prefetch_concurrently(instances, lookups):
+    """
+    Выполняет независимые подгрузки prefetch_related
+    одновременно, каждую в своем потоке.
+    """
+    if not instances:
+        return
+    for instance in instances:
+        # Кеш создается заранее: иначе потоки могут создать его
+        # одновременно и потерять результаты друг друга.
+        if not hasattr(instance, '_prefetched_objects_cache'):
+            instance._prefetched_objects_cache = {}
+    await asyncio.gather(*(
+        run_in_thread(prefetch_related_objects, instances, lookup)
+        for lookup in lookups))
+
+
+class AsyncReadMixin:
+    """
+    Асинхронный путь чтения (list и retrieve) для запуска под ASGI,
+    включается настройкой ASYNC_READ_VIEWS (по умолчанию выключен).
+    Проверка прав, ETag и загрузка данных выполняются в пуле потоков,
+    цикл событий не блокируется на запросах к базе. По умолчанию
+    действие целиком выполняется в потоке; вьюсет может
+    переопределить async_list и async_retrieve, чтобы
+    распараллелить запросы страницы.
+    """
+
+    async def async_list(self, request, *args, **kwargs):
+        return await run_in_thread(self.list, request, *args, **kwargs)
+
+    async def async_retrieve(self, request, *args, **kwargs):
+        return await run_in_thread(self.retrieve, request, *args, **kwargs)
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        """
+        Аналог APIView.dispatch для async_list и async_retrieve.
+        """
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await run_in_thread(self.initial, request, *args, **kwargs)
+            handler = getattr(self, f'async_{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = await run_in_thread(self.handle_exception, exc)
+        # finalize_response пишет в кеш статистику ETag: как и запросы
+        # к базе, это выполняется вне цикла событий.
+        self.response = await run_in_thread(
+            self.finalize_response, request, response, *args, **kwargs)
+        return self.response
+
+    @classmethod
+    def as_async_view(cls, actions, **initkwargs):
+        """
+        Асинхронное представление Django: GET и HEAD идут через
+        async_dispatch, остальные методы - в обычное представление
+        вьюсета, как при синхронном запуске.
+        """
+        sync_view = cls.as_view(actions, **initkwargs)
+
+        async def view(request, *args, **kwargs):
+            if request.method not in ASYNC_METHODS:
+                return await sync_to_async(sync_view)(
+                    request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = {**actions, 'head': actions['get']}
+            self.request = request
+            return await self.async_dispatch(request, *args, **kwargs)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.actions = actions
+        # Как и у представлений DRF: CSRF проверяется при
+        # аутентификации по сессии, а не в middleware.
+        view.csrf_exempt = True
+        return view
+
+
+def async_read_urls(router):
+    """
+    Маршруты list и retrieve вьюсетов с AsyncReadMixin, собранные
+    так же, как их строит роутер. Подключаются перед маршрутами
+    роутера и перекрывают их.
+    """
+    urls = []
+    for prefix, viewset, basename in router.registry:
+        if not issubclass(viewset, AsyncReadMixin):
+            continue
+        lookup = router.get_lookup_regex(viewset)
+        for route in router.get_routes(viewset):
+            mapping = router.get_method_map(viewset, route.mapping)
+            if mapping.get('get') not in ASYNC_ACTIONS:
+                continue
+            regex = route.url.format(prefix=prefix, lookup=lookup,
+                                     trailing_slash=router.trailing_slash)
+            initkwargs = {**route.initkwargs, 'basename': basename,
+                          'detail': route.detail}
+            urls.append(re_path(
+                regex, viewset.as_async_view(mapping, **initkwargs),
+                name=route.name.format(basename=basename)))
+    return urls
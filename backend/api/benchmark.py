@@ -0,0 +1,559 @@
+import base64
+import io
+import itertools
+import os
+import random
+import tempfile
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import urls
+from api.pagination import RecipePageNumberPagination
+from recipes.cache import ingredients_cache, recipes_version, tags_cache
+from recipes.images import wait_for_derivatives
+from recipes.models import (
+    Ingredient, Recipe, RecipeIngredientLink, ShoppingCartItem, Tag,
+    UserFavoriteRecipe, UserShoppingCart, tag_mask,
+)
+from recipes.search import update_recipe_documents
+from users.models import Subscribe, User
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+HTTP_METHODS = ('get', 'post', 'put', 'patch', 'delete')
+
+# Маршруты, которые нельзя замерить без письма со ссылкой
+# или с выключенными в проекте письмами djoser.
+SKIPPED_ROUTES = {
+    ('post', 'user-activation'): 'нужен токен из письма',
+    ('post', 'user-resend-activation'): 'активация выключена',
+    ('post', 'user-reset-password'): 'не задан PASSWORD_RESET_CONFIRM_URL',
+    ('post', 'user-reset-password-confirm'): 'нужен токен из письма',
+    ('post', 'user-reset-username'): 'смена e-mail по письму выключена',
+    ('post', 'user-reset-username-confirm'): 'нужен токен из письма',
+}
+
+# Замер одного маршрута. kwargs - аргументы маршрута в виде имен
+# значений контекста (context), data - тело запроса или функция
+# (benchmark, context), возвращающая его. setup(benchmark, context)
+# готовит отдельные объекты и возвращает дополнения контекста,
+# before - метод запроса к тому же адресу перед замером (например,
+# добавить в избранное перед замером удаления), after - метод
+# обратного запроса или функция (benchmark, context, response).
+Endpoint = namedtuple(
+    'Endpoint', 'method route kwargs query data anonymous setup before after',
+    defaults=({}, '', None, False, None, None, None))
+
+
+def endpoint_name(endpoint):
+    name = f'{endpoint.method.upper()} {endpoint.route}'
+    if endpoint.query:
+        name += f' ?{endpoint.query}'
+    if endpoint.anonymous:
+        name += ' (аноним)'
+    return name
+
+
+def registered_routes():
+    """
+    Пары (метод, имя маршрута) всех маршрутов api/urls.py.
+    """
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern):
+                yield pattern
+
+    routes = set()
+    for pattern in walk(urls.urlpatterns):
+        view = pattern.callback.cls
+        actions = getattr(pattern.callback, 'actions', None)
+        if actions is None:
+            methods = [method for method in HTTP_METHODS
+                       if hasattr(view, method)]
+        else:
+            methods = list(actions)
+        routes.update((method, pattern.name) for method in methods
+                      if method in view.http_method_names)
+    return routes
+
+
+def fresh_recipe(benchmark, context):
+    return {'recipe': benchmark.create_recipe(context['user']).pk}
+
+
+def fresh_user(benchmark, context):
+    return {'user': benchmark.create_user(), 'id': None}
+
+
+def fresh_token(benchmark, context):
+    Token.objects.get_or_create(user=context['user'])
+
+
+def delete_created(model, key='id'):
+    def after(benchmark, context, response):
+        model.objects.filter(pk=response.data[key]).delete()
+    return after
+
+
+def recipe_data(benchmark, context):
+    return {
+        'ingredients': [{'id': ingredient, 'amount': amount}
+                        for amount, ingredient in enumerate(
+                            context['recipe_ingredients'], start=1)],
+        'tags': [context['tag']],
+        'image': benchmark.image_uri,
+        'name': 'Замер производительности',
+        'text': 'Рецепт для замера.',
+        'cooking_time': 15,
+    }
+
+
+def user_data(benchmark, context):
+    number = benchmark.next_number()
+    return {
+        'email': f'new{number}@benchmark.local',
+        'username': f'new{number}',
+        'first_name': 'Новый',
+        'last_name': 'Пользователь',
+        'password': BENCHMARK_PASSWORD,
+    }
+
+
+def profile_data(benchmark, context):
+    user = context['user']
+    return {'email': user.email, 'username': user.username,
+            'first_name': 'Имя', 'last_name': 'Фамилия'}
+
+
+def new_email_data(benchmark, context):
+    return {'new_email': f'email{benchmark.next_number()}@benchmark.local',
+            'current_password': BENCHMARK_PASSWORD}
+
+
+def password_data(benchmark, context):
+    return {'current_password': BENCHMARK_PASSWORD}
+
+
+RECIPE = {'pk': 'recipe'}
+OWN_RECIPE = {'pk': 'own_recipe'}
+
+ENDPOINTS = (
+    Endpoint('get', 'api-root'),
+    Endpoint('get', 'recipes-list'),
+    Endpoint('get', 'recipes-list', anonymous=True),
+    Endpoint('get', 'recipes-list', query='limit=50'),
+    Endpoint('get', 'recipes-list', query='page=20'),
+    Endpoint('get', 'recipes-list', query='cursor='),
+    # Последняя страница: OFFSET по всей таблице против курсора
+    # с той же позиции.
+    Endpoint('get', 'recipes-list', query='page={deep_page}'),
+    Endpoint('get', 'recipes-list', query='cursor={deep_cursor}'),
+    Endpoint('get', 'recipes-list', query='cursor=&ordering=popular'),
+    Endpoint('get', 'recipes-list', query='tags={tag_slug}'),
+    Endpoint('get', 'recipes-list',
+             query='tags={tag_slug}&tags={other_tag_slug}'),
+    Endpoint('get', 'recipes-list',
+             query='tags_all={tag_slug}&tags_all={other_tag_slug}'),
+    Endpoint('get', 'recipes-list', query='is_favorited=1'),
+    Endpoint('get', 'recipes-list', query='is_in_shopping_cart=1'),
+    Endpoint('get', 'recipes-list', query='author={author}'),
+    Endpoint('get', 'recipes-list', query='ordering=popular'),
+    # Поиск по слову из всех рецептов и по редкому сочетанию слов.
+    Endpoint('get', 'recipes-list', query='search=ингредиент'),
+    Endpoint('get', 'recipes-list', query='search=ингредиент+42'),
+    Endpoint('get', 'recipes-list', query='search=ингредиент&cursor='),
+    Endpoint('post', 'recipes-list', data=recipe_data,
+             after=delete_created(Recipe)),
+    Endpoint('get', 'recipes-detail', RECIPE),
+    Endpoint('get', 'recipes-detail', RECIPE, anonymous=True),
+    Endpoint('patch', 'recipes-detail', OWN_RECIPE, data=recipe_data),
+    Endpoint('delete', 'recipes-detail', RECIPE, setup=fresh_recipe),
+    Endpoint('get', 'recipes-feed'),
+    Endpoint('get', 'recipes-pantry', query='ingredients={pantry}'),
+    Endpoint('get', 'recipes-similar', RECIPE),
+    Endpoint('get', 'recipes-recommended'),
+    Endpoint('post', 'recipes-favorite', RECIPE, after='delete'),
+    Endpoint('delete', 'recipes-favorite', RECIPE, before='post'),
+    Endpoint('post', 'recipes-shopping-cart', RECIPE, after='delete'),
+    Endpoint('delete', 'recipes-shopping-cart', RECIPE, before='post'),
+    Endpoint('get', 'recipes-download-shopping-cart'),
+    Endpoint('get', 'recipes-download-shopping-cart', query='format=csv'),
+    Endpoint('get', 'recipes-download-shopping-cart', query='format=pdf'),
+    Endpoint('get', 'tags-list'),
+    Endpoint('get', 'tags-detail', {'pk': 'tag'}),
+    Endpoint('get', 'ingredients-list'),
+    Endpoint('get', 'ingredients-list', query='name=инг'),
+    Endpoint('get', 'ingredients-detail', {'pk': 'ingredient'}),
+    Endpoint('get', 'users-subscriptions'),
+    Endpoint('get', 'users-subscriptions', query='recipes_limit=3'),
+    Endpoint('post', 'users-subscribe', {'pk': 'stranger'}, after='delete'),
+    Endpoint('delete', 'users-subscribe', {'pk': 'stranger'},
+             before='post'),
+    Endpoint('get', 'user-list'),
+    Endpoint('get', 'user-list', anonymous=True),
+    Endpoint('post', 'user-list', data=user_data, anonymous=True,
+             after=delete_created(User)),
+    Endpoint('get', 'user-detail', {'id': 'author'}),
+    Endpoint('put', 'user-detail', {'id': 'id'}, data=profile_data),
+    Endpoint('patch', 'user-detail', {'id': 'id'}, data=profile_data),
+    Endpoint('delete', 'user-detail', {'id': 'id'}, data=password_data,
+             setup=fresh_user),
+    Endpoint('get', 'user-me'),
+    Endpoint('put', 'user-me', data=profile_data),
+    Endpoint('patch', 'user-me', data=profile_data),
+    Endpoint('delete', 'user-me', data=password_data, setup=fresh_user),
+    Endpoint('post', 'user-set-password', setup=fresh_user, data={
+        'current_password': BENCHMARK_PASSWORD,
+        'new_password': BENCHMARK_PASSWORD}),
+    Endpoint('post', 'user-set-username', data=new_email_data,
+             setup=fresh_user),
+    Endpoint('post', 'login', anonymous=True, data={
+        'email': 'user0@benchmark.local', 'password': BENCHMARK_PASSWORD}),
+    Endpoint('post', 'logout', setup=fresh_token),
+)
+
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)]
+
+
+def add_dataset_arguments(parser):
+    """Размеры синтетических данных для команд замеров."""
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--recipes', type=int, default=2000)
+    parser.add_argument('--ingredients', type=int, default=500)
+    parser.add_argument('--per-recipe', type=int, default=8,
+                        help='Ингредиентов в рецепте.')
+    parser.add_argument('--subscriptions', type=int, default=20,
+                        help='Подписок у пользователя.')
+    parser.add_argument('--favorites', type=int, default=30,
+                        help='Рецептов в избранном у пользователя.')
+    parser.add_argument('--carts', type=int, default=5,
+                        help='Рецептов в корзине у пользователя.')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Отдельная тестовая база и каталог для файлов на время замера.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            # Тестовая база SQLite по умолчанию в памяти с общим
+            # кэшем: фоновая обработка картинок блокировала бы
+            # таблицы на время запросов.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                directory, 'benchmark.sqlite3')
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        databases = runner.setup_databases()
+        try:
+            with override_settings(MEDIA_ROOT=directory,
+                                   RECIPE_SIMILARITY_DIR=directory):
+                yield
+        finally:
+            runner.teardown_databases(databases)
+            runner.teardown_test_environment()
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+class Benchmark:
+    """
+    Наполняет базу синтетическими данными и замеряет маршруты API
+    через тестовый клиент: число запросов к базе при первом
+    (с пустыми кэшами) и повторных обращениях, медиану и p95
+    времени ответа, размер ответа.
+    """
+
+    def __init__(self, options, stdout=None):
+        self.options = options
+        self.stdout = stdout
+        self.random = random.Random(options['seed'])
+        self.clients = {}
+        self.counter = itertools.count()
+        self.context = {}
+
+    def next_number(self):
+        return next(self.counter)
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def sample(self, population, size):
+        return self.random.sample(population, min(size, len(population)))
+
+    def seed(self):
+        options = self.options
+        started = time.monotonic()
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), 'orange').save(buffer, 'PNG')
+        image = default_storage.save('recipes/benchmark.png',
+                                     ContentFile(buffer.getvalue()))
+        self.image_uri = 'data:image/png;base64,' + base64.b64encode(
+            buffer.getvalue()).decode()
+
+        tags = Tag.objects.bulk_create([
+            Tag(name=f'Тег {number}', color='#E26C2D',
+                slug=f'tag{number}') for number in range(6)])
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}',
+                       measurement_unit=('г', 'мл', 'шт')[number % 3])
+            for number in range(options['ingredients'])])
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+
+        password = make_password(BENCHMARK_PASSWORD)
+        User.objects.bulk_create([
+            User(email=f'user{number}@benchmark.local',
+                 username=f'user{number}', first_name='Имя',
+                 last_name='Фамилия', password=password)
+            for number in range(max(options['users'], 3))])
+        user_ids = list(User.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        # Первый пользователь выполняет запросы, на последнего
+        # он не подписан: на него замеряется подписка.
+        main, stranger = user_ids[0], user_ids[-1]
+        Subscribe.objects.bulk_create([
+            Subscribe(user_id=user, author_id=author)
+            for user in user_ids
+            for author in self.sample(
+                [author for author in user_ids
+                 if author != user and not (user == main
+                                            and author == stranger)],
+                options['subscriptions'])])
+
+        Recipe.objects.bulk_create([
+            Recipe(author_id=main if number % 10 == 0
+                   else self.random.choice(user_ids),
+                   name=f'Рецепт {number}',
+                   text='Описание рецепта для замера. ' * 5,
+                   cooking_time=self.random.randint(1, 180),
+                   image=image)
+            for number in range(options['recipes'])])
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        RecipeIngredientLink.objects.bulk_create([
+            RecipeIngredientLink(recipe_id=recipe, ingredient_id=ingredient,
+                                 amount=self.random.randint(1, 500))
+            for recipe in recipe_ids
+            for ingredient in self.sample(
+                ingredient_ids, options['per_recipe'])], batch_size=5000)
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+            for recipe in recipe_ids
+            for tag in self.sample(tag_ids, self.random.randint(1, 2))],
+            batch_size=5000)
+        Recipe.objects.refresh_tag_masks()
+
+        # Последний рецепт не входит в избранное и корзину первого
+        # пользователя: на нем замеряется их пополнение.
+        target = recipe_ids[-1]
+        favorites, carts = [], []
+        for user in user_ids:
+            pool = [recipe for recipe in recipe_ids
+                    if user != main or recipe != target]
+            favorites += [UserFavoriteRecipe(user_id=user, recipe_id=recipe)
+                          for recipe in self.sample(
+                              pool, options['favorites'])]
+            carts += [UserShoppingCart(user_id=user, recipe_id=recipe)
+                      for recipe in self.sample(pool, options['carts'])]
+        UserFavoriteRecipe.objects.bulk_create(favorites, batch_size=5000)
+        UserShoppingCart.objects.bulk_create(carts, batch_size=5000)
+        favorites_count = Counter(item.recipe_id for item in favorites)
+        carts_count = Counter(item.recipe_id for item in carts)
+        Recipe.objects.bulk_update([
+            Recipe(pk=recipe, favorites_count=favorites_count[recipe],
+                   shopping_cart_count=carts_count[recipe])
+            for recipe in recipe_ids
+        ], ['favorites_count', 'shopping_cart_count'], batch_size=1000)
+        ShoppingCartItem.objects.refresh(user_ids)
+        update_recipe_documents(recipe_ids)
+        for version in (tags_cache, ingredients_cache, recipes_version):
+            version.bump()
+
+        user = User.objects.get(pk=main)
+        pagination = RecipePageNumberPagination()
+        deep_page = max(
+            (len(recipe_ids) - 1) // pagination.page_size + 1, 1)
+        # Курсор указывает на последний рецепт предыдущей страницы,
+        # поэтому выдает ту же страницу, что и page=deep_page.
+        previous = Recipe.objects.order_by(
+            *pagination.cursor_ordering)[
+                max((deep_page - 1) * pagination.page_size - 1, 0)]
+        self.context = {
+            'user': user,
+            'id': main,
+            'stranger': stranger,
+            'author': user_ids[1],
+            'recipe': target,
+            'own_recipe': Recipe.objects.filter(author=main).values_list(
+                'pk', flat=True).first(),
+            'tag': tag_ids[0],
+            'tag_slug': tags[0].slug,
+            'other_tag_slug': tags[1].slug,
+            'ingredient': ingredient_ids[0],
+            'recipe_ingredients': self.sample(
+                ingredient_ids, options['per_recipe']),
+            'pantry': ','.join(map(str, self.sample(ingredient_ids, 15))),
+            'deep_page': deep_page,
+            'deep_cursor': pagination.encode_cursor(previous),
+        }
+        self.log('Данные созданы за {:.1f} с: пользователей {}, '
+                 'рецептов {}, связей с ингредиентами {}.'.format(
+                     time.monotonic() - started, len(user_ids),
+                     len(recipe_ids), RecipeIngredientLink.objects.count()))
+
+    def create_user(self):
+        number = self.next_number()
+        return User.objects.create_user(
+            email=f'fresh{number}@benchmark.local',
+            username=f'fresh{number}', first_name='Имя',
+            last_name='Фамилия', password=BENCHMARK_PASSWORD)
+
+    def create_recipe(self, author):
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт для удаления', text='Описание.',
+            cooking_time=10, image='recipes/benchmark.png',
+            tag_mask=tag_mask([self.context['tag']]))
+        RecipeIngredientLink.objects.bulk_create([
+            RecipeIngredientLink(recipe=recipe, ingredient_id=ingredient,
+                                 amount=10)
+            for ingredient in self.context['recipe_ingredients']])
+        recipe.tags.add(self.context['tag'])
+        return recipe
+
+    def client(self, user):
+        key = user.pk if user is not None else None
+        if key not in self.clients:
+            client = APIClient(raise_request_exception=False)
+            if user is not None:
+                client.force_authenticate(user)
+            self.clients[key] = client
+        return self.clients[key]
+
+    def request(self, endpoint):
+        """
+        Один запрос к маршруту. Возвращает ответ, число
+        запросов к базе и время в миллисекундах.
+        """
+        context = dict(self.context)
+        if endpoint.setup is not None:
+            context.update(endpoint.setup(self, context) or {})
+        if context['id'] is None:
+            context['id'] = context['user'].pk
+        url = reverse(f'api:{endpoint.route}', kwargs={
+            name: context[key] for name, key in endpoint.kwargs.items()})
+        if endpoint.query:
+            url += '?' + endpoint.query.format(**context)
+        client = self.client(None if endpoint.anonymous
+                             else context['user'])
+        if endpoint.before is not None:
+            getattr(client, endpoint.before)(url)
+        data = endpoint.data
+        if callable(data):
+            data = data(self, context)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, endpoint.method)(
+                url, data, format='json')
+            response.size = sum(map(len, response.streaming_content
+                                    if response.streaming
+                                    else [response.content]))
+            elapsed = (time.perf_counter() - started) * 1000
+        # Журнал запросов очищается в начале каждого запроса
+        # к клиенту, поэтому сохранить его нужно до обратного запроса.
+        response.queries = [query['sql'] for query in queries]
+        count = len(response.queries)
+        # Картинки обрабатываются в фоне; замеры не должны
+        # пересекаться с записью результатов в базу.
+        wait_for_derivatives()
+        if callable(endpoint.after):
+            endpoint.after(self, context, response)
+        elif endpoint.after is not None:
+            getattr(client, endpoint.after)(url)
+        return response, count, elapsed
+
+    def measure(self, endpoint):
+        clear_caches()
+        response, cold_queries, _ = self.request(endpoint)
+        timings, queries = [], 0
+        for _ in range(self.options['repeat']):
+            response, count, elapsed = self.request(endpoint)
+            timings.append(elapsed)
+            queries = max(queries, count)
+        timings.sort()
+        return {
+            'status': response.status_code,
+            'queries': queries,
+            'cold_queries': cold_queries,
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'bytes': response.size,
+        }
+
+    def run(self):
+        results = {}
+        for endpoint in ENDPOINTS:
+            name = endpoint_name(endpoint)
+            results[name] = result = self.measure(endpoint)
+            self.log('{:<55} {status:>3} запросов {queries:>3} '
+                     '(холодный {cold_queries:>3}) p50 {p50_ms:>8.2f} мс '
+                     'p95 {p95_ms:>8.2f} мс {bytes:>8} байт'.format(
+                         name, **result))
+        return results
+
+
+def uncovered_routes():
+    """
+    Маршруты api/urls.py, для которых нет замера и причины пропуска.
+    """
+    covered = {(endpoint.method, endpoint.route) for endpoint in ENDPOINTS}
+    return sorted(registered_routes() - covered - SKIPPED_ROUTES.keys())
+
+
+def compare(results, baseline, threshold, min_delta):
+    """
+    Сравнивает результаты с эталоном. Регрессия - другой код ответа,
+    рост числа запросов или рост p50/p95 больше чем на threshold
+    (доля) и больше чем на min_delta миллисекунд.
+    """
+    regressions = []
+    for name, result in results['endpoints'].items():
+        expected = baseline['endpoints'].get(name)
+        if expected is None:
+            continue
+        if result['status'] != expected['status']:
+            regressions.append(
+                f'{name}: код ответа {expected["status"]} -> '
+                f'{result["status"]}')
+        for key in ('queries', 'cold_queries'):
+            if result[key] > expected[key]:
+                regressions.append(
+                    f'{name}: {key} {expected[key]} -> {result[key]}')
+        for key in ('p50_ms', 'p95_ms'):
+            delta = result[key] - expected[key]
+            if delta > min_delta and delta > expected[key] * threshold:
+                regressions.append(
+                    f'{name}: {key} {expected[key]} -> {result[key]}')
+    return regressions
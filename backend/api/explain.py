@@ -0,0 +1,52 @@
+import json
+import re
+
+# Запросы, план которых проверяется; служебные (SAVEPOINT, RELEASE)
+# пропускаются.
+EXPLAINED_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+# Псевдонимы таблиц в SQL Django: "recipes_recipe" U0.
+TABLE_ALIAS = re.compile(r'"(\w+)" ([A-Z]\d+)\b')
+
+# Полный просмотр таблицы в EXPLAIN QUERY PLAN SQLite; просмотр
+# индекса (USING INDEX) полным просмотром не считается.
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+
+def explainable(sql):
+    return sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS)
+
+
+def explain(connection, sql):
+    """
+    План запроса и таблицы, которые он читает целиком
+    (Seq Scan в PostgreSQL, SCAN без индекса в SQLite).
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return plan, sorted(set(postgresql_full_scans(plan[0]['Plan'])))
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[3] for row in cursor.fetchall()]
+            return plan, sorted(set(sqlite_full_scans(plan, sql)))
+    raise NotImplementedError(
+        f'EXPLAIN для {connection.vendor} не поддерживается.')
+
+
+def postgresql_full_scans(node):
+    if node['Node Type'] == 'Seq Scan':
+        yield node['Relation Name']
+    for child in node.get('Plans', ()):
+        yield from postgresql_full_scans(child)
+
+
+def sqlite_full_scans(plan, sql):
+    aliases = {alias: table for table, alias in TABLE_ALIAS.findall(sql)}
+    for detail in plan:
+        match = SQLITE_SCAN.match(detail)
+        if match:
+            yield aliases.get(match.group(1), match.group(1))
@@ -0,0 +1,141 @@
+import binascii
+import uuid
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+
+# Сигнатуры допустимых форматов: (смещение, байты) -> расширение.
+IMAGE_SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'jpg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'GIF8', 'gif'),
+    (8, b'WEBP', 'webp'),
+)
+# Длина куска base64, кратная 4, чтобы куски декодировались независимо.
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def detect_image_extension(header):
+    for offset, signature, extension in IMAGE_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return extension
+    return None
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    """
+    Поле картинки, принимающее data URI в base64 или загруженный файл.
+    base64 декодируется по частям во временный файл, который
+    остается в памяти до RECIPE_IMAGE_SPOOL_SIZE байт и затем
+    переносится на диск. Размер ограничен RECIPE_IMAGE_MAX_SIZE,
+    сигнатура формата проверяется до декодирования всей строки.
+    """
+    default_error_messages = {
+        'too_large': 'Размер картинки превышает {max_size} байт.',
+        'invalid_base64': 'Картинка должна быть в формате data URI base64.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return self.decode(data)
+        if getattr(data, 'size', 0) > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+        return super().to_internal_value(data)
+
+    def decode(self, data):
+        if data.startswith('http'):
+            # Клиент прислал ссылку на уже сохраненную картинку.
+            raise SkipField()
+        start = data.find(';base64,')
+        if not data.startswith('data:') or start == -1:
+            self.fail('invalid_base64')
+        start += len(';base64,')
+        if (len(data) - start) // 4 * 3 > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+
+        file = SpooledTemporaryFile(
+            max_size=settings.RECIPE_IMAGE_SPOOL_SIZE)
+        extension = None
+        try:
+            for position in range(start, len(data), BASE64_CHUNK_SIZE):
+                chunk = binascii.a2b_base64(
+                    data[position:position + BASE64_CHUNK_SIZE])
+                if extension is None:
+                    extension = detect_image_extension(chunk)
+                    if extension is None:
+                        self.fail('invalid_image')
+                file.write(chunk)
+            size = file.tell()
+            file.seek(0)
+            Image.open(file).verify()
+        except (binascii.Error, ValueError, SyntaxError, OSError):
+            file.close()
+            self.fail('invalid_image')
+        except serializers.ValidationError:
+            file.close()
+            raise
+        file.seek(0)
+        return UploadedFile(file=file, name=f'{uuid.uuid4()}.{extension}',
+                            content_type=f'image/{extension}', size=size)
+
+
+class ImageSrcsetField(serializers.Field):
+    """
+    Поле для уменьшенных копий картинки рецепта.
+    Отдает для каждого формата строку в формате атрибута srcset:
+    {"webp": "<url> 320w, <url> 640w", "jpeg": "..."}.
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'image_variants'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        srcset = {}
+        for image_format, variants in value.items():
+            sources = []
+            for width, name in sorted(variants.items(),
+                                      key=lambda item: int(item[0])):
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                sources.append(f'{url} {width}w')
+            srcset[image_format] = ', '.join(sources)
+        return srcset
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """
+    Список первичных ключей, объекты по которому загружаются одним
+    запросом in_bulk, а не запросом на каждый ключ, как
+    в PrimaryKeyRelatedField(many=True).
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pk_field = queryset.model._meta.pk
+        pks = []
+        for pk in data:
+            if isinstance(pk, bool):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+            try:
+                pks.append(pk_field.to_python(pk))
+            except (TypeError, ValueError, ValidationError):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+        objects = queryset.in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
@@ -1,26 +1,61 @@
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
 
 from recipes.models import Recipe, Tag, UserFavoriteRecipe, UserShoppingCart
+from recipes.search import search_ingredients, search_recipes
+
+
+class IngredientSearchFilter(BaseFilterBackend):
+    """
+    Поиск ингредиентов по названию для автодополнения.
+    Совпадения с началом названия выводятся выше совпадений
+    внутри названия, количество результатов ограничено.
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query or getattr(view, 'action', None) != 'list':
+            return queryset
+        return search_ingredients(queryset, query)
 
 
 class RecipeQueryFilter(FilterSet):
     """
     Настроенный фильтр для модели Recipe в Django.
-    Позволяет фильтровать рецепты по различным критериям: по тегам, по автору,
-    по наличию в избранном и по наличию в списке покупок пользователя.
+    Позволяет фильтровать рецепты по различным критериям: по любому
+    из тегов (tags) или по всем тегам (tags_all), по автору,
+    по наличию в избранном и по наличию в списке покупок пользователя,
+    искать по тексту и сортировать по популярности.
     """
-    tags = filters.ModelMultipleChoiceFilter(field_name='tags__slug',
-                                             to_field_name='slug',
-                                             queryset=Tag.objects.all())
+    tags = filters.ModelMultipleChoiceFilter(to_field_name='slug',
+                                             queryset=Tag.objects.all(),
+                                             method='filter_tags')
+    tags_all = filters.ModelMultipleChoiceFilter(to_field_name='slug',
+                                                 queryset=Tag.objects.all(),
+                                                 method='filter_tags')
     is_favorited = filters.BooleanFilter(
         method='filter_favorited_recipes')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_recipes_in_shopping_cart')
+    search = filters.CharFilter(method='search_recipes')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='order_recipes')
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
 
+    def filter_tags(self, queryset, name, value):
+        """
+        Рецепты с любым из тегов tags или со всеми тегами tags_all
+        по маске тегов рецепта.
+        """
+        return queryset.with_tags([tag.pk for tag in value],
+                                  match_all=name == 'tags_all')
+
     def filter_favorited_recipes(self, queryset, name, value):
         """
         Фильтр для выборки рецептов, которые отмечены
@@ -44,3 +79,20 @@ class RecipeQueryFilter(FilterSet):
                 user=user).values_list('recipe_id', flat=True)
             return queryset.filter(id__in=shopping_cart_recipe_ids)
         return queryset
+
+    def order_recipes(self, queryset, name, value):
+        """
+        Сортировка по числу добавлений в избранное
+        по денормализованному счетчику.
+        """
+        if value == 'popular':
+            return queryset.order_by(
+                '-favorites_count', '-pub_date', '-id')
+        return queryset
+
+    def search_recipes(self, queryset, name, value):
+        """
+        Полнотекстовый поиск с сортировкой по релевантности.
+        Явная сортировка (ordering) имеет приоритет.
+        """
+        return search_recipes(queryset, value)
@@ -0,0 +1,83 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api.benchmark import (
+    SKIPPED_ROUTES, Benchmark, add_dataset_arguments, benchmark_database,
+    compare, uncovered_routes,
+)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет все маршруты API на синтетических данных: число '
+            'запросов к базе, медиану и p95 времени ответа, размер '
+            'ответа. Данные создаются в отдельной тестовой базе.')
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Замеров каждого маршрута.')
+        parser.add_argument('--output',
+                            help='Файл JSON для результатов.')
+        parser.add_argument('--baseline',
+                            help='Файл JSON с эталонными результатами.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.5,
+            help='Допустимый рост времени ответа, доля от эталона.')
+        parser.add_argument(
+            '--min-delta', type=float, default=5.0,
+            help='Рост времени ответа меньше этого (мс) не считается '
+                 'регрессией.')
+
+    def handle(self, *args, **options):
+        missing = uncovered_routes()
+        if missing:
+            raise CommandError('Нет замеров для маршрутов: {}.'.format(
+                ', '.join(f'{method.upper()} {route}'
+                          for method, route in missing)))
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+        results = self.benchmark(options)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты записаны в {options["output"]}.')
+        if baseline is not None:
+            self.check_baseline(results, baseline, options)
+
+    def benchmark(self, options):
+        with benchmark_database():
+            benchmark = Benchmark(options, self.stdout)
+            benchmark.seed()
+            endpoints = benchmark.run()
+            vendor = connection.vendor
+        for (method, route), reason in sorted(SKIPPED_ROUTES.items()):
+            self.stdout.write(f'Пропущен {method.upper()} {route}: {reason}.')
+        dataset = ('users', 'recipes', 'ingredients', 'per_recipe',
+                   'subscriptions', 'favorites', 'carts', 'repeat', 'seed')
+        return {
+            'created': timezone.now().isoformat(),
+            'vendor': vendor,
+            'dataset': {key: options[key] for key in dataset},
+            'endpoints': endpoints,
+        }
+
+    def check_baseline(self, results, baseline, options):
+        if baseline.get('vendor') != results['vendor']:
+            self.stdout.write(self.style.WARNING(
+                'Эталон снят на другой базе ({}), время ответа '
+                'несравнимо.'.format(baseline.get('vendor'))))
+        if baseline.get('dataset') != results['dataset']:
+            self.stdout.write(self.style.WARNING(
+                'Эталон снят на других данных.'))
+        regressions = compare(results, baseline, options['threshold'],
+                              options['min_delta'])
+        if regressions:
+            raise CommandError('Регрессии относительно эталона:\n{}'.format(
+                '\n'.join(regressions)))
+        self.stdout.write(self.style.SUCCESS(
+            'Регрессий относительно эталона нет.'))
@@ -0,0 +1,68 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from foodgram.db.pool import ConnectionPool, PooledDatabaseMixin
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время на соединение с базой в каждом запросе '
+            'к API: новое соединение, постоянное (CONN_MAX_AGE) и из '
+            'пула. Запрос к API моделируется запросом SELECT 1 '
+            'и закрытием соединения по правилам Django.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        base = connections[options['database']]
+        results = {
+            'Новое соединение': self.measure(
+                self.wrapper(base, max_age=0), options['repeat']),
+            'Постоянное соединение': self.measure(
+                self.wrapper(base, max_age=None), options['repeat']),
+        }
+        if isinstance(base, PooledDatabaseMixin):
+            pool = ConnectionPool(1, settings.DB_POOL_TIMEOUT,
+                                  settings.DB_POOL_MAX_LIFETIME)
+            results['Пул'] = self.measure(
+                self.wrapper(base, max_age=0, pool=pool), options['repeat'])
+            pool.close()
+        else:
+            self.stdout.write(
+                'Пул не замерен: движок базы не foodgram.db.postgresql.')
+        fresh = results['Новое соединение'][0]
+        for name, (median, p95) in results.items():
+            self.stdout.write(
+                '{}: медиана {:.2f} мс, p95 {:.2f} мс, экономия '
+                '{:.2f} мс на запрос.'.format(name, median, p95,
+                                              fresh - median))
+
+    @staticmethod
+    def wrapper(base, max_age, pool=None):
+        wrapper = base.copy()
+        wrapper.settings_dict['CONN_MAX_AGE'] = max_age
+        if isinstance(wrapper, PooledDatabaseMixin):
+            wrapper.pool = pool
+        return wrapper
+
+    @staticmethod
+    def measure(wrapper, repeat):
+        timings = []
+        try:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                with wrapper.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                # Так соединение закрывается по окончании запроса к API.
+                wrapper.close_if_unusable_or_obsolete()
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            wrapper.close()
+        timings.sort()
+        return (statistics.median(timings),
+                timings[min(int(len(timings) * 0.95), len(timings) - 1)])
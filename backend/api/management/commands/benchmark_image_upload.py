@@ -0,0 +1,84 @@
+import base64
+import io
+import random
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from drf_base64.fields import Base64ImageField
+from PIL import Image
+
+from api.benchmark import percentile
+from api.fields import StreamingBase64ImageField
+
+FIELDS = (
+    ('Base64ImageField (b64decode целиком)', Base64ImageField),
+    ('StreamingBase64ImageField', StreamingBase64ImageField),
+)
+
+
+def noise_image_uri(size, seed):
+    """
+    data URI картинки PNG из случайных пикселей: такая картинка
+    почти не сжимается, и ее размер близок к size байт.
+    """
+    side = max(int((size / 3) ** 0.5), 1)
+    pixels = random.Random(seed).randbytes(side * side * 3)
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (side, side), pixels).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode(), buffer.tell()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пиковое потребление памяти (tracemalloc) и время '
+            'декодирования большой картинки в base64 прежним полем '
+            'Base64ImageField и StreamingBase64ImageField.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=float, default=8,
+            help='Размер картинки в мегабайтах.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        data, size = noise_image_uri(
+            int(options['size'] * 1024 * 1024), options['seed'])
+        if size > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise CommandError(
+                f'Картинка {size} байт больше RECIPE_IMAGE_MAX_SIZE.')
+        self.stdout.write('Картинка {:.1f} МБ, data URI {:.1f} МБ.'.format(
+            size / 1024 / 1024, len(data) / 1024 / 1024))
+        for name, field_class in FIELDS:
+            peak = self.peak_memory(field_class(), data)
+            timings = sorted(self.elapsed(field_class(), data)
+                             for _ in range(options['repeat']))
+            self.stdout.write(
+                '{}: пик памяти {:.2f} МБ, медиана {:.1f} мс, '
+                'p95 {:.1f} мс.'.format(
+                    name, peak / 1024 / 1024,
+                    percentile(timings, 0.5), percentile(timings, 0.95)))
+
+    @staticmethod
+    def peak_memory(field, data):
+        """
+        Пик памяти сверх уже созданной строки запроса
+        от data URI до проверенного файла.
+        """
+        tracemalloc.start()
+        try:
+            field.run_validation(data).close()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak
+
+    @staticmethod
+    def elapsed(field, data):
+        # Время замеряется без tracemalloc, который замедляет
+        # выделение памяти.
+        started = time.perf_counter()
+        field.run_validation(data).close()
+        return (time.perf_counter() - started) * 1000
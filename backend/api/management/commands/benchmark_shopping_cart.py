@@ -0,0 +1,97 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Sum
+
+from api.benchmark import (
+    Benchmark, add_dataset_arguments, benchmark_database, percentile,
+)
+from api.renderers import SHOPPING_LIST_RENDERERS
+from recipes.models import RecipeIngredientLink, ShoppingCartItem
+from users.models import User
+
+RENDERERS = {renderer.format: renderer for renderer in SHOPPING_LIST_RENDERERS}
+
+
+def aggregated_rows(user_id):
+    """
+    Строки списка покупок прежним способом: суммирование
+    ингредиентов рецептов корзины при каждой выгрузке.
+    """
+    return (
+        RecipeIngredientLink.objects
+        .filter(recipe__usershoppingcart__user=user_id)
+        .values('ingredient')
+        .annotate(total_amount=Sum('amount'))
+        .values_list('ingredient__name', 'total_amount',
+                     'ingredient__measurement_unit')
+        .order_by('ingredient__name')
+        .iterator(chunk_size=settings.SHOPPING_CART_CHUNK_SIZE)
+    )
+
+
+def stored_rows(user_id):
+    """
+    Строки списка покупок из денормализованной таблицы,
+    как в download_shopping_cart.
+    """
+    return (
+        ShoppingCartItem.objects
+        .filter(user=user_id)
+        .values_list('ingredient__name', 'total_amount',
+                     'ingredient__measurement_unit')
+        .order_by('ingredient__name')
+        .iterator(chunk_size=settings.SHOPPING_CART_CHUNK_SIZE)
+    )
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает выгрузку списка покупок суммированием '
+            'ингредиентов рецептов корзины и чтением таблицы '
+            'ShoppingCartItem на синтетических данных. По умолчанию '
+            '500 пользователей по 20 рецептов в корзине - 10 000 корзин.')
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+        parser.set_defaults(users=500, carts=20)
+        parser.add_argument(
+            '--sample', type=int, default=100,
+            help='Число пользователей, для которых выгружается список.')
+        parser.add_argument('--format', choices=sorted(RENDERERS),
+                            default='txt')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            benchmark = Benchmark(options, self.stdout)
+            benchmark.seed()
+            users = benchmark.sample(
+                list(User.objects.filter(
+                    shopping_cart__isnull=False
+                ).distinct().values_list('pk', flat=True)),
+                options['sample'])
+            for user_id in users:
+                if list(aggregated_rows(user_id)) != list(
+                        stored_rows(user_id)):
+                    raise CommandError(
+                        'Списки покупок двух способов различаются '
+                        f'у пользователя {user_id}.')
+            renderer = RENDERERS[options['format']]()
+            results = {}
+            for name, rows in (('Суммирование по рецептам', aggregated_rows),
+                               ('ShoppingCartItem', stored_rows)):
+                results[name] = self.measure(renderer, rows, users)
+        for name, (median, p95) in results.items():
+            self.stdout.write('{}: медиана {:.2f} мс, p95 {:.2f} мс.'.format(
+                name, median, p95))
+
+    @staticmethod
+    def measure(renderer, rows, users):
+        timings = []
+        for user_id in users:
+            started = time.perf_counter()
+            for _ in renderer.stream(rows(user_id)):
+                pass
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return percentile(timings, 0.5), percentile(timings, 0.95)
@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from api.mixins import get_conditional_stats
+
+
+class Command(BaseCommand):
+    help = 'Выводит статистику условных GET-запросов (ETag).'
+
+    def handle(self, *args, **options):
+        stats = get_conditional_stats()
+        total = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / total * 100 if total else 0
+        self.stdout.write(
+            f'Ответов 304: {stats["hits"]}, полных ответов: '
+            f'{stats["misses"]}, доля 304: {hit_rate:.1f}%.')
+        self.stdout.write(
+            f'Сэкономлено байт: {stats["saved_bytes"]}.')
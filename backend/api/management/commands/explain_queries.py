@@ -0,0 +1,78 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import (
+    ENDPOINTS, Benchmark, add_dataset_arguments, benchmark_database,
+    clear_caches, endpoint_name,
+)
+from api.explain import explain, explainable
+
+# Длина текста запроса в отчете.
+SQL_SAMPLE_LENGTH = 300
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN для каждого запроса к базе маршрутов API '
+            'на синтетических данных и завершается с ошибкой, если план '
+            'читает целиком таблицу из --min-rows строк и больше. '
+            'Проверяются запросы повторного обращения, с заполненными '
+            'кэшами. С -v 2 выводятся планы.')
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='Полный просмотр таблицы меньшего размера допустим.')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            benchmark = Benchmark(options, self.stdout)
+            benchmark.seed()
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            problems = self.explain_endpoints(benchmark, options)
+        if problems:
+            raise CommandError('Полный просмотр больших таблиц:\n{}'.format(
+                '\n'.join(problems)))
+        self.stdout.write(self.style.SUCCESS(
+            'Полного просмотра больших таблиц нет.'))
+
+    def explain_endpoints(self, benchmark, options):
+        tables = set(connection.introspection.table_names())
+        rows = {}
+        plans = {}
+        problems = []
+        for endpoint in ENDPOINTS:
+            clear_caches()
+            benchmark.request(endpoint)
+            response, _, _ = benchmark.request(endpoint)
+            queries = list(dict.fromkeys(filter(explainable,
+                                                response.queries)))
+            large = set()
+            for sql in queries:
+                if sql not in plans:
+                    plans[sql] = explain(connection, sql)
+                plan, scans = plans[sql]
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{sql}\n{plan}\n')
+                scans = [table for table in scans if table in tables
+                         and self.count(table, rows) >= options['min_rows']]
+                if scans:
+                    problems.append('{}: {}\n  {}'.format(
+                        endpoint_name(endpoint), ', '.join(scans),
+                        sql[:SQL_SAMPLE_LENGTH]))
+                large.update(scans)
+            self.stdout.write('{:<55} запросов {:>3}{}'.format(
+                endpoint_name(endpoint), len(queries),
+                ', полный просмотр: ' + ', '.join(sorted(large))
+                if large else ''))
+        return problems
+
+    @staticmethod
+    def count(table, rows):
+        if table not in rows:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM {}'.format(
+                    connection.ops.quote_name(table)))
+                rows[table] = cursor.fetchone()[0]
+        return rows[table]
@@ -0,0 +1,83 @@
+import threading
+import time
+from urllib.parse import urljoin
+
+import requests
+from django.core.management import BaseCommand, CommandError
+
+DEFAULT_PATHS = ('/api/recipes/', '/api/tags/', '/api/ingredients/')
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запущенного сервера: одновременные клиенты '
+            'по кругу запрашивают адреса API. Выводит пропускную '
+            'способность и перцентили времени ответа.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Адрес сервера, например '
+                                        'http://localhost:9060.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Адрес для запросов; можно несколько.')
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--duration', type=float, default=20,
+                            help='Длительность теста, секунд.')
+        parser.add_argument('--token', help='Токен пользователя.')
+
+    def handle(self, *args, **options):
+        urls = [urljoin(options['url'], path)
+                for path in options['paths'] or DEFAULT_PATHS]
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        try:
+            requests.get(urls[0], headers=headers, timeout=10)
+        except requests.RequestException as error:
+            raise CommandError(f'Сервер недоступен: {error}')
+
+        results = [[] for _ in range(options['concurrency'])]
+        deadline = time.monotonic() + options['duration']
+        clients = [
+            threading.Thread(target=self.client, args=(
+                urls[number % len(urls):] + urls[:number % len(urls)],
+                headers, deadline, results[number]))
+            for number in range(options['concurrency'])]
+        started = time.monotonic()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - started
+        self.report([item for result in results for item in result],
+                    elapsed)
+
+    @staticmethod
+    def client(urls, headers, deadline, result):
+        session = requests.Session()
+        session.headers.update(headers)
+        number = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = session.get(urls[number % len(urls)],
+                                 timeout=30).status_code < 400
+            except requests.RequestException:
+                ok = False
+            result.append((time.perf_counter() - started, ok))
+            number += 1
+
+    def report(self, results, elapsed):
+        if not results:
+            raise CommandError('Ни один запрос не выполнен.')
+        timings = sorted(timing * 1000 for timing, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+
+        def percentile(fraction):
+            return timings[min(int(len(timings) * fraction),
+                               len(timings) - 1)]
+
+        self.stdout.write(
+            'Запросов: {}, ошибок: {}, {:.0f} в секунду. '
+            'Время ответа: p50 {:.0f} мс, p95 {:.0f} мс, '
+            'p99 {:.0f} мс.'.format(
+                len(results), errors, len(results) / elapsed,
+                percentile(0.5), percentile(0.95), percentile(0.99)))
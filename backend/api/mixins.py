@@ -0,0 +1,195 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+
+from foodgram.db.routers import (
+    choose_replica, is_pinned_to_primary, replica_aliases,
+    reset_read_replica, set_read_replica,
+)
+from recipes.cache import version_age
+
+logger = logging.getLogger(__name__)
+
+CONDITIONAL_STATS_KEYS = ('hits', 'misses', 'saved_bytes')
+CONDITIONAL_SIZE_TIMEOUT = 60 * 60 * 24
+
+
+def get_conditional_stats():
+    """
+    Счетчики условных запросов: ответы 304, полные ответы
+    с ETag и сэкономленные байты тел ответов.
+    """
+    cache = caches[settings.REFERENCE_CACHE_ALIAS]
+    values = cache.get_many(
+        [f'conditional:{key}' for key in CONDITIONAL_STATS_KEYS])
+    return {key: values.get(f'conditional:{key}', 0)
+            for key in CONDITIONAL_STATS_KEYS}
+
+
+def increment_conditional_stat(key, delta=1):
+    cache = caches[settings.REFERENCE_CACHE_ALIAS]
+    key = f'conditional:{key}'
+    if not cache.add(key, delta, timeout=None):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            cache.set(key, delta, timeout=None)
+
+
+class NotModified(Exception):
+    """
+    Прерывает обработку запроса готовым ответом 304.
+    """
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """
+    Миксин условных GET-запросов (ETag / If-None-Match).
+    ETag строится из версий данных, которые возвращает
+    get_etag_parts, без сериализации тела ответа, поэтому
+    304 отдается сразу после проверки прав, до запуска
+    сериализаторов. Действия перечисляются в conditional_actions.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def get_etag_parts(self, request):
+        """
+        Версии данных, от которых зависит ответ.
+        """
+        return []
+
+    def get_etag(self, request):
+        parts = self.get_etag_parts(request)
+        if parts is None:
+            return None
+        self.etag_versions = list(parts)
+        parts += [self.action, request.get_full_path(),
+                  request.accepted_renderer.format, request.user.pk]
+        return '"{}"'.format(hashlib.md5(
+            ':'.join(map(str, parts)).encode()).hexdigest())
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = None
+        if (request.method != 'GET'
+                or self.action not in self.conditional_actions):
+            return
+        self.etag = self.get_etag(request)
+        if self.etag is None:
+            return
+        response = get_conditional_response(request, etag=self.etag)
+        if response is not None:
+            increment_conditional_stat('hits')
+            saved_bytes = caches[settings.REFERENCE_CACHE_ALIAS].get(
+                f'conditional:size:{self.etag}', 0)
+            increment_conditional_stat('saved_bytes', saved_bytes)
+            logger.debug('304 %s, сэкономлено %s байт',
+                         request.path, saved_bytes)
+            response['ETag'] = self.etag
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def record_response_size(self, response):
+        increment_conditional_stat('misses')
+        caches[settings.REFERENCE_CACHE_ALIAS].set(
+            f'conditional:size:{response["ETag"]}', len(response.content),
+            timeout=CONDITIONAL_SIZE_TIMEOUT)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        etag = getattr(self, 'etag', None)
+        if etag and response.status_code == 200:
+            response['ETag'] = etag
+            if hasattr(response, 'add_post_render_callback'):
+                response.add_post_render_callback(self.record_response_size)
+            else:
+                self.record_response_size(response)
+        return response
+
+
+class ReferenceDataCacheMixin(ConditionalGetMixin):
+    """
+    Миксин для справочных таблиц без пагинации.
+    Полный список отдается заранее сериализованным JSON из кеша
+    reference_cache, ETag строится по версии таблицы.
+    """
+    reference_cache = None
+
+    def get_etag_parts(self, request):
+        return [self.reference_cache.get_version()]
+
+    def use_reference_cache(self, request):
+        return request.accepted_renderer.format == 'json'
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_reference_cache(request):
+            return super().list(request, *args, **kwargs)
+
+        def build():
+            serializer = self.get_serializer(self.get_queryset(), many=True)
+            return JSONRenderer().render(serializer.data)
+
+        _, content = self.reference_cache.get('list', build)
+        return HttpResponse(content, content_type='application/json')
+
+
+class ReplicaReadMixin:
+    """
+    Чтение безопасными методами с реплики (foodgram.db.routers).
+    Аутентификация и проверка прав идут по основной базе.
+    Реплика выбирается, если пользователь недавно ничего
+    не записывал и все версии данных ответа (get_replica_versions)
+    сменились раньше DB_REPLICA_MAX_LAG: реплика с допустимым
+    отставанием уже получила эти изменения, и ни ETag, ни кеши
+    процесса не свяжут новую версию с устаревшими данными.
+    """
+
+    def get_replica_versions(self, request):
+        versions = getattr(self, 'etag_versions', None)
+        if versions is None:
+            versions = self.get_etag_parts(request)
+        return versions
+
+    def use_replica(self, request):
+        if request.method not in SAFE_METHODS:
+            return False
+        user = request.user
+        if user.is_authenticated and is_pinned_to_primary(user.pk):
+            return False
+        versions = self.get_replica_versions(request)
+        return versions is not None and all(
+            version_age(version) > settings.DB_REPLICA_MAX_LAG
+            for version in versions)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if replica_aliases() and self.use_replica(request):
+            set_read_replica(choose_replica())
+
+    def dispatch(self, request, *args, **kwargs):
+        token = set_read_replica(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            reset_read_replica(token)
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        token = set_read_replica(None)
+        try:
+            return await super().async_dispatch(request, *args, **kwargs)
+        finally:
+            reset_read_replica(token)
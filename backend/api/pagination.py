@@ -1,10 +1,147 @@
+import base64
+import binascii
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Пагинатор, который берет COUNT(*) из кеша по ключу count_key.
+    Ключ включает версии данных, поэтому закешированное
+    значение не устаревает.
+    """
+
+    def __init__(self, *args, count_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_key = count_key
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        cache = caches[settings.REFERENCE_CACHE_ALIAS]
+        count = cache.get(self.count_key)
+        if count is None:
+            count = super().count
+            cache.set(self.count_key, count,
+                      timeout=settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
 
 
 class RecipePageNumberPagination(PageNumberPagination):
     """
     Настроенный класс пагинатора,
     который расширяет стандартный PageNumberPagination.
+    Общее количество объектов кешируется для вьюсетов с версиями
+    данных (get_etag_parts). Для вьюсетов с keyset_pagination = True
+    параметр cursor включает постраничный вывод по ключу
+    (pub_date, id) без OFFSET и COUNT(*). При другой сортировке
+    (ordering, search) курсор не применим, и страницы выводятся
+    по номеру.
     """
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-pub_date', '-id')
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(queryset, page_size,
+                                    count_key=self.count_key)
+
+    def get_count_key(self, request, view):
+        if (not settings.PAGINATION_COUNT_CACHE
+                or not hasattr(view, 'get_etag_parts')):
+            return None
+        parts = view.get_etag_parts(request)
+        if parts is None:
+            return None
+        params = sorted(
+            (key, value) for key, value in request.query_params.lists()
+            if key not in (self.page_query_param,
+                           self.page_size_query_param))
+        parts += [view.action, request.user.pk, params]
+        return 'pagination:count:{}'.format(hashlib.md5(
+            ':'.join(map(str, parts)).encode()).hexdigest())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_requested = (
+            getattr(view, 'keyset_pagination', False)
+            and self.cursor_query_param in request.query_params)
+        self.cursor_mode = cursor_requested and not queryset.query.order_by
+        self.cursor_fallback = cursor_requested and not self.cursor_mode
+        if self.cursor_mode:
+            return self.paginate_keyset(queryset, request)
+        self.count_key = self.get_count_key(request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def encode_cursor(self, obj):
+        value = f'{obj.pub_date.isoformat()}|{obj.pk}'
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            pub_date, pk = base64.urlsafe_b64decode(
+                cursor.encode()).decode().split('|')
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            pub_date = None
+        if pub_date is None:
+            raise NotFound('Неверный курсор.')
+        return pub_date, pk
+
+    def paginate_keyset(self, queryset, request):
+        self.page_size = self.get_page_size(request)
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        queryset = queryset.order_by(*self.cursor_ordering)
+        if cursor:
+            pub_date, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_cursor = (self.encode_cursor(page[-1])
+                            if self.has_next else None)
+        return page
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return self.without_cursor(super().get_next_link())
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor)
+
+    def get_previous_link(self):
+        return self.without_cursor(super().get_previous_link())
+
+    def without_cursor(self, url):
+        """
+        Ссылки постраничного вывода по номеру без параметра cursor.
+        """
+        if url is None or not self.cursor_fallback:
+            return url
+        return remove_query_param(url, self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
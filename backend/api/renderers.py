@@ -0,0 +1,117 @@
+import csv
+import io
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ShoppingListRenderer(ABC, BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+    Потоково формирует файл из строк (название, количество, единица),
+    не собирая весь список в памяти.
+    """
+    charset = 'utf-8'
+    title = 'Cписок покупок:'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Ответы с ошибками отдаются в JSON,
+        сам список покупок формируется методом stream.
+        """
+        return JSONRenderer().render(data)
+
+    @abstractmethod
+    def stream(self, ingredients):
+        """
+        Части файла (bytes) для строк (название, количество, единица).
+        """
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    """
+    Список покупок в виде текстового файла.
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield f'{self.title}\n'.encode(self.charset)
+        for ingredient in ingredients:
+            yield '{} - {} {}.\n'.format(*ingredient).encode(self.charset)
+
+
+class Echo:
+    """
+    Псевдобуфер, который возвращает записанную строку вместо хранения.
+    """
+    def write(self, value):
+        return value
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """
+    Список покупок в формате CSV.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('Ингредиент', 'Количество', 'Единица измерения')
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header).encode(self.charset)
+        for ingredient in ingredients:
+            yield writer.writerow(ingredient).encode(self.charset)
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """
+    Список покупок в формате PDF.
+    Строки читаются из курсора постранично, но сам документ
+    отдается после сборки: таблица ссылок PDF пишется в конце файла.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+    chunk_size = 64 * 1024
+
+    def register_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_CART_PDF_FONT))
+
+    def stream(self, ingredients):
+        self.register_font()
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        top = A4[1] - self.margin
+        line_height = self.font_size * 1.5
+        pdf.setFont(self.font_name, self.font_size)
+        pdf.drawString(self.margin, top, self.title)
+        y = top
+        for ingredient in ingredients:
+            y -= line_height
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(self.font_name, self.font_size)
+                y = top
+            pdf.drawString(self.margin, y, '{} - {} {}.'.format(*ingredient))
+        pdf.save()
+        buffer.seek(0)
+        while chunk := buffer.read(self.chunk_size):
+            yield chunk
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListPDFRenderer,
+)
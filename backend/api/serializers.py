@@ -1,3 +1,5 @@
+import json
+
 from django.db import transaction
 from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
@@ -8,9 +10,16 @@ from recipes.models import (
     Ingredient,
     Recipe,
     RecipeIngredientLink,
-    Tag)
+    ShoppingCartItem,
+    Tag,
+    tag_mask)
+from recipes.images import replace_derivatives, schedule_derivatives
 from users.models import Subscribe, User
 
+from .fields import (
+    BulkManyRelatedField, ImageSrcsetField, StreamingBase64ImageField,
+)
+
 
 class UserProfileReadSerializer(serializers.ModelSerializer):
     """
@@ -27,8 +36,11 @@ class UserProfileReadSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         user = self.context['request'].user
-        return user.is_authenticated and user.subscribing.filter(
-            author=obj).exists()
+        if not user.is_authenticated:
+            return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return Subscribe.objects.filter(user=user, author=obj).exists()
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -37,13 +49,14 @@ class RecipeSerializer(serializers.ModelSerializer):
     Используется для представления рецептов в списках подписок и избранного.
     """
     image = Base64ImageField(read_only=True)
+    image_srcset = ImageSrcsetField()
     name = serializers.ReadOnlyField()
     cooking_time = serializers.ReadOnlyField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'name',
-                  'image', 'cooking_time')
+                  'image', 'image_srcset', 'cooking_time')
 
 
 class UserSubscriptionsSerializer(serializers.ModelSerializer):
@@ -63,6 +76,8 @@ class UserSubscriptionsSerializer(serializers.ModelSerializer):
                   'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return (
             self.context.get('request').user.is_authenticated
             and Subscribe.objects.filter(user=self.context['request'].user,
@@ -70,17 +85,14 @@ class UserSubscriptionsSerializer(serializers.ModelSerializer):
         )
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            try:
-                recipes = recipes[:int(limit)]
-            except ValueError:
-                return serializers.ValidationError("Неверное значение.")
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()[:self.context.get('recipes_limit')]
         return RecipeSerializer(recipes, many=True, read_only=True).data
 
 
@@ -166,16 +178,19 @@ class RecipeDetailReadSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags',
                   'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image',
+                  'name', 'image', 'image_srcset',
                   'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return (
             self.context.get('request').user.is_authenticated
             and UserFavoriteRecipe.objects.filter(
@@ -184,6 +199,8 @@ class RecipeDetailReadSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return (
             self.context.get('request').user.is_authenticated
             and UserShoppingCart.objects.filter(
@@ -192,6 +209,18 @@ class RecipeDetailReadSerializer(serializers.ModelSerializer):
         )
 
 
+class PantryRecipeSerializer(RecipeDetailReadSerializer):
+    """
+    Рецепт в подборе по продуктам пользователя
+    с числом недостающих ингредиентов.
+    """
+    missing_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeDetailReadSerializer.Meta):
+        fields = (*RecipeDetailReadSerializer.Meta.fields,
+                  'missing_ingredients')
+
+
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
     """
     Сериализатор для создания ингредиентов рецепта.
@@ -213,12 +242,13 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     Также обеспечивает валидацию данных.
     Поддерживает транзакционное добавление тегов и ингредиентов.
     """
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = BulkManyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=Tag.objects.all()))
     author = UserProfileReadSerializer(read_only=True)
     id = serializers.ReadOnlyField()
     ingredients = RecipeIngredientCreateSerializer(many=True)
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -227,6 +257,28 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'name', 'text',
                   'cooking_time', 'author')
 
+    def to_internal_value(self, data):
+        """
+        Помимо JSON принимает multipart/form-data: картинка передается
+        файлом, теги - повторяющимся полем tags, ингредиенты - строкой
+        JSON в поле ingredients.
+        """
+        if hasattr(data, 'getlist'):
+            data = self.parse_form_data(data)
+        return super().to_internal_value(data)
+
+    def parse_form_data(self, data):
+        parsed = {key: data.get(key) for key in data}
+        if 'tags' in data:
+            parsed['tags'] = data.getlist('tags')
+        if 'ingredients' in data:
+            try:
+                parsed['ingredients'] = json.loads(data['ingredients'])
+            except json.JSONDecodeError:
+                raise serializers.ValidationError(
+                    {'ingredients': 'Ожидается список в формате JSON.'})
+        return parsed
+
     def validate(self, obj):
         for field in ['name', 'text', 'cooking_time']:
             if not obj.get(field):
@@ -247,6 +299,15 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Ингредиенты должны быть уникальны.'
             )
+        existing_ingredients = Ingredient.objects.in_bulk(
+            unique_ingredient_id_list)
+        missing_ingredients = sorted(
+            unique_ingredient_id_list - existing_ingredients.keys())
+        if missing_ingredients:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: {}.'.format(
+                    ', '.join(map(str, missing_ingredients)))
+            )
         return obj
 
     @transaction.atomic
@@ -255,23 +316,60 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         RecipeIngredientLink.objects.bulk_create(
             [RecipeIngredientLink(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(pk=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
 
+    def ingredients_update(self, recipe, ingredients):
+        """
+        Применяет к рецепту разницу между текущими и новыми ингредиентами:
+        одно удаление, пакетное создание и пакетное обновление.
+        Возвращает идентификаторы ингредиентов, количество которых изменилось.
+        """
+        links = {link.ingredient_id: link
+                 for link in RecipeIngredientLink.objects.filter(
+                     recipe=recipe)}
+        amounts = {ingredient['id']: ingredient['amount']
+                   for ingredient in ingredients}
+        removed = links.keys() - amounts.keys()
+        added = amounts.keys() - links.keys()
+        changed = []
+        for ingredient_id, link in links.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and link.amount != amount:
+                link.amount = amount
+                changed.append(link)
+        if removed:
+            RecipeIngredientLink.objects.filter(
+                recipe=recipe, ingredient__in=removed).delete()
+        RecipeIngredientLink.objects.bulk_create(
+            [RecipeIngredientLink(recipe=recipe,
+                                  ingredient_id=ingredient_id,
+                                  amount=amounts[ingredient_id])
+             for ingredient_id in added]
+        )
+        RecipeIngredientLink.objects.bulk_update(changed, ['amount'])
+        return removed | added | {link.ingredient_id for link in changed}
+
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=self.context['request'].user,
+                                       tag_mask=tag_mask(tag.pk
+                                                         for tag in tags),
                                        **validated_data)
         self.tags_and_ingredients_set(recipe, tags, ingredients)
+        schedule_derivatives(recipe)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        instance.image = validated_data.get('image', instance.image)
+        previous_variants = instance.image_variants
+        if 'image' in validated_data:
+            instance.image = validated_data['image']
+            instance.image_variants = {}
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
@@ -279,18 +377,22 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients')
 
-        RecipeIngredientLink.objects.filter(recipe=instance).delete()
-        for ingredient_data in ingredients_data:
-            RecipeIngredientLink.objects.create(
-                recipe=instance,
-                ingredient=Ingredient.objects.get(pk=ingredient_data['id']),
-                amount=ingredient_data['amount']
-            )
+        changed_ingredients = self.ingredients_update(
+            instance, ingredients_data)
+        if changed_ingredients:
+            ShoppingCartItem.objects.refresh_on_commit(
+                recipes=[instance.pk], ingredients=changed_ingredients)
 
         instance.tags.set(tags)
+        instance.tag_mask = tag_mask(tag.pk for tag in tags)
         instance.save()
+        if 'image' in validated_data:
+            replace_derivatives(instance, previous_variants)
         return instance
 
     def to_representation(self, instance):
+        user = self.context['request'].user
+        instance = Recipe.objects.with_related(user).with_user_flags(
+            user).get(pk=instance.pk)
         return RecipeDetailReadSerializer(
             instance, context=self.context).data
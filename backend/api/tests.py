@@ -0,0 +1,1066 @@
+import base64
+import io
+import itertools
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import OperationalError, connection
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.http import HttpResponse
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
+
+from recipes.images import get_executor, wait_for_derivatives
+from recipes.constants import TAG_MASK_BITS
+from recipes.models import (
+    Ingredient, Recipe, RecipeIngredientLink, Tag, UserFavoriteRecipe,
+    UserShoppingCart, tag_mask,
+)
+from recipes.pantry import PantryIndex
+from recipes.search import search_ingredients, update_recipe_documents
+from recipes.similarity import SimilarityIndex
+from users.models import Subscribe, User
+
+from foodgram.db import pool
+from foodgram.db.pool import ConnectionPool, PooledDatabaseMixin, PoolTimeout
+from foodgram.db.routers import (
+    ReplicaRouter, pin_to_primary, reset_read_replica, set_read_replica,
+)
+from foodgram.middleware import (
+    ReplicaPinMiddleware, RequestProfilingMiddleware,
+)
+
+from .views import FoodIngredientViewSet, RecipeViewSet, TagViewSet
+
+try:
+    from foodgram.db.postgresql.base import (
+        DatabaseWrapper as PostgresDatabaseWrapper)
+except ImproperlyConfigured:
+    # Без psycopg2 обертка PostgreSQL не импортируется.
+    PostgresDatabaseWrapper = None
+
+RECIPES = 60
+INGREDIENTS_PER_RECIPE = 10
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+def rendered(response):
+    # Готовый JSON справочников отдается обычным HttpResponse.
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def image_uri():
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), 'orange').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+class RecipeQueriesTestCase(TestCase):
+    """
+    Данные для проверок числа запросов: число запросов
+    не должно зависеть от числа рецептов, тегов и ингредиентов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.media_root = tempfile.mkdtemp()
+        # bulk_create возвращает первичные ключи не во всех СУБД,
+        # поэтому объекты перечитываются.
+        User.objects.bulk_create([
+            User(email=f'user{number}@test.local', username=f'user{number}',
+                 first_name='Имя', last_name='Фамилия')
+            for number in range(2)])
+        cls.user, cls.author = User.objects.order_by('pk')
+        Tag.objects.bulk_create([
+            Tag(name=f'Тег {number}', color='#E26C2D', slug=f'tag{number}')
+            for number in range(3)])
+        cls.tags = list(Tag.objects.order_by('pk'))
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(60)])
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+        tag_ids = [tag.pk for tag in cls.tags]
+        Recipe.objects.bulk_create([
+            Recipe(author=(cls.user, cls.author)[number % 2],
+                   name=f'Рецепт {number}', text='Описание.',
+                   cooking_time=10, image='recipes/test.png',
+                   tag_mask=tag_mask(tag_ids))
+            for number in range(RECIPES)])
+        cls.recipes = list(Recipe.objects.order_by('pk'))
+        RecipeIngredientLink.objects.bulk_create([
+            RecipeIngredientLink(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+            for recipe in cls.recipes
+            for number, ingredient in enumerate(
+                cls.ingredients[:INGREDIENTS_PER_RECIPE])])
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag_id)
+            for recipe in cls.recipes for tag_id in tag_ids])
+        UserFavoriteRecipe.objects.bulk_create([
+            UserFavoriteRecipe(user=cls.user, recipe=recipe)
+            for recipe in cls.recipes[::3]])
+        UserShoppingCart.objects.bulk_create([
+            UserShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in cls.recipes[::4]])
+        Subscribe.objects.create(user=cls.user, author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        clear_caches()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class RecipeReadQueriesTest(RecipeQueriesTestCase):
+    """
+    Список и карточка рецепта загружаются фиксированным числом
+    запросов, без N+1 по авторам, тегам, ингредиентам и отметкам
+    пользователя.
+    """
+
+    def test_list_anonymous(self):
+        with self.assertNumQueries(5):
+            response = self.anonymous.get('/api/recipes/?limit=50')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 50)
+
+    def test_list_authenticated(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/recipes/?limit=50')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 50)
+        self.assertTrue(any(recipe['is_favorited']
+                            for recipe in response.data['results']))
+
+    def test_retrieve_anonymous(self):
+        recipe = self.recipes[0]
+        with self.assertNumQueries(4):
+            response = self.anonymous.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']),
+                         INGREDIENTS_PER_RECIPE)
+
+    def test_retrieve_authenticated(self):
+        recipe = self.recipes[0]
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+
+class SubscriptionsQueriesTest(RecipeQueriesTestCase):
+    """
+    Подписки загружаются фиксированным числом запросов при любом
+    числе авторов, recipes_limit ограничивает рецепты каждого автора.
+    """
+    AUTHORS = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        User.objects.bulk_create([
+            User(email=f'author{number}@test.local',
+                 username=f'author{number}',
+                 first_name='Имя', last_name='Фамилия')
+            for number in range(cls.AUTHORS)])
+        authors = list(User.objects.filter(username__startswith='author'))
+        Recipe.objects.bulk_create([
+            Recipe(author=author, name=f'Рецепт автора {number}',
+                   text='Описание.', cooking_time=10,
+                   image='recipes/test.png')
+            for author in authors for number in range(3)])
+        Subscribe.objects.bulk_create([
+            Subscribe(user=cls.user, author=author) for author in authors])
+
+    def test_subscriptions(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                '/api/users/subscriptions/?limit=50&recipes_limit=2')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(len(results), self.AUTHORS + 1)
+        for author in results:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(len(author['recipes']),
+                             min(author['recipes_count'], 2))
+        counts = {author['id']: author['recipes_count']
+                  for author in results}
+        self.assertEqual(counts[self.author.pk], RECIPES // 2)
+
+    def test_invalid_recipes_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=много')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recipes_limit', response.data)
+
+
+class IngredientSearchTest(TestCase):
+    """
+    Поиск ингредиентов: совпадения с началом названия выше
+    совпадений внутри, без учета регистра кириллицы и буквы ё.
+    Индекс в памяти процесса отдает то же, что запрос PostgreSQL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create([
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('мука', 'мука ржаная', 'мускат', 'соль',
+                         'морская соль', 'ёжевика')])
+
+    def setUp(self):
+        clear_caches()
+
+    def search(self, query):
+        response = APIClient().get('/api/ingredients/', {'name': query})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_first(self):
+        self.assertEqual(self.search('Му'),
+                         ['мука', 'мука ржаная', 'мускат'])
+        self.assertEqual(self.search('СОЛЬ'), ['соль', 'морская соль'])
+        self.assertEqual(self.search('ежев'), ['ёжевика'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_limit(self):
+        self.assertEqual(self.search('му'), ['мука', 'мука ржаная'])
+
+    def test_same_as_postgresql(self):
+        # Запрос для PostgreSQL выполняется и в SQLite: LIKE в SQLite
+        # не сравнивает кириллицу без учета регистра, поэтому
+        # запросы в нижнем регистре.
+        queryset = Ingredient.objects.all()
+        for query in ('му', 'мука', 'соль', 'пирог'):
+            found = {}
+            for vendor in ('postgresql', 'sqlite'):
+                with mock.patch.object(connection, 'vendor', vendor):
+                    found[vendor] = list(search_ingredients(queryset, query))
+            self.assertEqual(found['postgresql'], found['sqlite'], query)
+
+
+class RequestProfilingTest(RecipeQueriesTestCase):
+    """
+    Профилирование включается REQUEST_PROFILING: ответ получает
+    заголовок Server-Timing, журнал - строку JSON на запрос.
+    Выключенное профилирование исключается из цепочки middleware.
+    """
+    URL = '/api/recipes/?limit=10'
+
+    def get(self):
+        # Цепочка middleware собирается при первом запросе клиента.
+        return APIClient().get(self.URL)
+
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestProfilingMiddleware(lambda request: HttpResponse())
+        self.assertNotIn('Server-Timing', self.get())
+
+    @override_settings(REQUEST_PROFILING=True)
+    def test_enabled(self):
+        with self.assertLogs('foodgram.profiling', 'INFO') as logs:
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="queries=5 duplicates=0", '
+                         r'serialize;dur=[\d.]+;desc="queries=0", '
+                         r'total;dur=[\d.]+$')
+        summary = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(summary['view'], 'api:recipes-list')
+        self.assertEqual(summary['queries'], 5)
+        self.assertEqual(summary['duplicates'], 0)
+
+    @override_settings(REQUEST_PROFILING=True,
+                       REQUEST_PROFILING_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        self.assertNotIn('Server-Timing', self.get())
+
+    @override_settings(REQUEST_PROFILING=True,
+                       REQUEST_PROFILING_SLOW_QUERY_MS=0)
+    def test_slow_queries(self):
+        with self.assertLogs('foodgram.profiling', 'WARNING') as logs:
+            self.get()
+        slow = json.loads(logs.records[0].getMessage())
+        self.assertTrue(slow['explain'].startswith('EXPLAIN'))
+        self.assertNotIn('%s', slow['explain'])
+
+
+class RecipeTagFilterTest(TestCase):
+    """
+    Фильтры tags (любой из тегов) и tags_all (все теги) по маске
+    тегов рецепта отдают те же рецепты, что и соединение с таблицей
+    тегов, в том числе для тегов вне маски.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            email='author@test.local', username='author',
+            first_name='Имя', last_name='Фамилия')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color='#E26C2D',
+                               slug=f'tag{number}')
+            for number in range(3)]
+        # Тег с id за пределами маски ищется соединением.
+        cls.tags.append(Tag.objects.create(
+            pk=TAG_MASK_BITS + 1, name='Тег вне маски', color='#000000',
+            slug='unmasked'))
+        for number in range(16):
+            tags = [tag for bit, tag in enumerate(cls.tags)
+                    if number & (1 << bit)]
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Описание.',
+                cooking_time=10, image='recipes/test.png',
+                tag_mask=tag_mask(tag.pk for tag in tags))
+            recipe.tags.set(tags)
+
+    def setUp(self):
+        clear_caches()
+
+    def found(self, param, tags):
+        response = APIClient().get('/api/recipes/', {
+            param: [tag.slug for tag in tags], 'limit': 50})
+        self.assertEqual(response.status_code, 200)
+        return sorted(recipe['id'] for recipe in response.data['results'])
+
+    def test_same_as_join(self):
+        for size in (1, 2, 3):
+            for tags in itertools.combinations(self.tags, size):
+                any_tag = Recipe.objects.filter(tags__in=tags).distinct()
+                all_tags = Recipe.objects.all()
+                for tag in tags:
+                    all_tags = all_tags.filter(tags=tag)
+                self.assertEqual(
+                    self.found('tags', tags),
+                    sorted(any_tag.values_list('pk', flat=True)), tags)
+                self.assertEqual(
+                    self.found('tags_all', tags),
+                    sorted(all_tags.values_list('pk', flat=True)), tags)
+
+    def test_deleted_tag(self):
+        tag = self.tags[1]
+        tag.delete()
+        for recipe in Recipe.objects.prefetch_related('tags'):
+            self.assertEqual(recipe.tag_mask, tag_mask(
+                tag.pk for tag in recipe.tags.all()))
+
+
+class RecipeWriteQueriesTest(RecipeQueriesTestCase):
+    """
+    Создание и изменение рецепта с большим числом ингредиентов
+    выполняется фиксированным числом запросов.
+    """
+    INGREDIENTS = 40
+
+    def recipe_data(self, ingredients, amount=1):
+        return {
+            'ingredients': [{'id': ingredient.pk, 'amount': amount}
+                            for ingredient in ingredients],
+            'tags': [tag.pk for tag in self.tags],
+            'image': image_uri(),
+            'name': 'Новый рецепт',
+            'text': 'Описание.',
+            'cooking_time': 15,
+        }
+
+    def test_create(self):
+        data = self.recipe_data(self.ingredients[:self.INGREDIENTS])
+        with self.assertNumQueries(15):
+            response = self.client.post('/api/recipes/', data,
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['ingredients']),
+                         self.INGREDIENTS)
+
+    def test_update(self):
+        recipe = self.recipes[0]
+        # Половина ингредиентов остается с новым количеством,
+        # остальные заменяются новыми.
+        ingredients = self.ingredients[
+            INGREDIENTS_PER_RECIPE // 2:
+            INGREDIENTS_PER_RECIPE // 2 + self.INGREDIENTS]
+        data = self.recipe_data(ingredients, amount=7)
+        with self.assertNumQueries(17):
+            response = self.client.patch(f'/api/recipes/{recipe.pk}/',
+                                         data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(RecipeIngredientLink.objects.filter(
+                recipe=recipe).values_list('ingredient', 'amount')),
+            {(ingredient.pk, 7) for ingredient in ingredients})
+
+    def test_unknown_tag(self):
+        data = self.recipe_data(self.ingredients[:2])
+        data['tags'].append(10 ** 6)
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/recipes/', data,
+                                        format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tags', response.data)
+
+
+class ShoppingCartDownloadTest(RecipeQueriesTestCase):
+    """
+    ETag списка покупок меняется после переименования ингредиента.
+    """
+
+    def test_etag(self):
+        url = '/api/recipes/download_shopping_cart/?format=txt'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        ingredient = self.ingredients[0]
+        ingredient.name = 'переименованный ингредиент'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ConditionalGetStatsTest(RecipeQueriesTestCase):
+    """
+    Команда conditional_get_stats выводит число ответов 304,
+    полных ответов и сэкономленных байт.
+    """
+
+    def stats(self):
+        out = io.StringIO()
+        call_command('conditional_get_stats', stdout=out)
+        return out.getvalue()
+
+    def test_output(self):
+        self.assertIn('Ответов 304: 0, полных ответов: 0, доля 304: 0.0%.',
+                      self.stats())
+        response = self.client.get('/api/recipes/')
+        self.client.get('/api/recipes/', HTTP_IF_NONE_MATCH=response['ETag'])
+        output = self.stats()
+        self.assertIn('Ответов 304: 1, полных ответов: 1, доля 304: 50.0%.',
+                      output)
+        self.assertIn(f'Сэкономлено байт: {len(response.content)}.', output)
+
+
+class RecipeCursorPaginationTest(RecipeQueriesTestCase):
+    """
+    Курсор работает для сортировки по дате, а вместе с другой
+    сортировкой страницы выводятся по номеру.
+    """
+
+    def test_cursor_pages(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=50')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), RECIPES - 50)
+        self.assertIsNone(response.data['next'])
+
+    def test_cursor_with_ordering(self):
+        response = self.client.get(
+            '/api/recipes/?cursor=&ordering=popular&limit=50')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], RECIPES)
+        self.assertIn('page=2', response.data['next'])
+        self.assertNotIn('cursor', response.data['next'])
+
+
+class RecipeCounterTest(RecipeQueriesTestCase):
+    """
+    Счетчики избранного и списка покупок меняются при любом
+    изменении отметок и не становятся отрицательными, если
+    разошлись с таблицами отметок.
+    """
+
+    def test_counter_floor(self):
+        recipe = self.recipes[0]
+        # В данных теста счетчики не заполнены и равны нулю.
+        for route in ('favorite', 'shopping_cart'):
+            response = self.client.delete(
+                f'/api/recipes/{recipe.pk}/{route}/')
+            self.assertEqual(response.status_code, 204)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.shopping_cart_count, 0)
+
+    def test_orm_marks(self):
+        # Отметки, измененные в обход API (в админке или из кода),
+        # тоже меняют счетчики.
+        first, second = self.recipes[1], self.recipes[2]
+        favorite = UserFavoriteRecipe.objects.create(
+            user=self.author, recipe=first)
+        cart = UserShoppingCart.objects.create(
+            user=self.author, recipe=first)
+        first.refresh_from_db()
+        self.assertEqual(first.favorites_count, 1)
+        self.assertEqual(first.shopping_cart_count, 1)
+        cart.recipe = second
+        cart.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.shopping_cart_count, 0)
+        self.assertEqual(second.shopping_cart_count, 1)
+        favorite.delete()
+        cart.delete()
+        second.refresh_from_db()
+        first.refresh_from_db()
+        self.assertEqual(first.favorites_count, 0)
+        self.assertEqual(second.shopping_cart_count, 0)
+
+    def test_popular_pages(self):
+        # Счетчики у всех рецептов равны, порядок страниц задает id.
+        expected = list(Recipe.objects.order_by(
+            '-favorites_count', '-pub_date', '-id').values_list(
+                'pk', flat=True))
+        received = []
+        url = '/api/recipes/?ordering=popular&limit=7'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            received += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(received, expected)
+
+
+@override_settings(HOME_FEED_SIZE=10)
+class RecipeFeedTest(RecipeQueriesTestCase):
+    """
+    Страницы ленты за пределами кеша берутся запросом к подпискам.
+    """
+
+    def feed_ids(self):
+        return list(Recipe.objects.filter(author=self.author).order_by(
+            '-pub_date', '-id').values_list('pk', flat=True))
+
+    def test_pages(self):
+        expected = self.feed_ids()
+        received = []
+        url = '/api/recipes/feed/?limit=4'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], len(expected))
+            received += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(received, expected)
+
+
+class RecipeSearchTest(RecipeQueriesTestCase):
+    """
+    Полнотекстовый поиск ранжирует совпадения в названии выше
+    совпадений в ингредиентах и не добавляет запросов на рецепт.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        update_recipe_documents([recipe.pk for recipe in cls.recipes])
+
+    def test_rank(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(
+                '/api/recipes/?search=рецепт+7&limit=50')
+        self.assertEqual(response.status_code, 200)
+        # Ингредиент 7 есть во всех рецептах, число 7 в названии -
+        # только у одного.
+        self.assertEqual(response.data['count'], RECIPES)
+        self.assertEqual(response.data['results'][0]['name'], 'Рецепт 7')
+
+    def test_no_match(self):
+        response = self.client.get('/api/recipes/?search=пирог')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+
+    def test_deleted_recipe(self):
+        recipe = self.recipes[7]
+        recipe.delete()
+        response = self.client.get('/api/recipes/?search=рецепт+7&limit=50')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], RECIPES - 1)
+        self.assertNotIn(recipe.name, [
+            result['name'] for result in response.data['results']])
+        if connection.vendor == 'sqlite':
+            # Документ удаляется из таблицы FTS5 вместе с рецептом.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT count(*) FROM recipes_recipe_fts '
+                    'WHERE recipes_recipe_fts MATCH %s', ['"рецепт" "7"'])
+                self.assertEqual(cursor.fetchone(), (RECIPES - 1,))
+
+
+class RecipePantryTest(RecipeQueriesTestCase):
+    """
+    Подбор по продуктам ранжирует рецепты по числу недостающих
+    ингредиентов и видит изменения рецептов без пересборки индекса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Ингредиенты после первых INGREDIENTS_PER_RECIPE не входят
+        # в общие рецепты теста.
+        cls.pantry = cls.ingredients[-4:]
+        cls.pantry_recipes = []
+        for number, ingredients in enumerate(
+                ((0, 1), (0, 1, 2), (2, 3), (3,))):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Подбор {number}',
+                text='Описание.', cooking_time=10,
+                image='recipes/test.png')
+            RecipeIngredientLink.objects.bulk_create([
+                RecipeIngredientLink(recipe=recipe, amount=1,
+                                     ingredient=cls.pantry[position])
+                for position in ingredients])
+            cls.pantry_recipes.append(recipe)
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('recipes.pantry.pantry_index', PantryIndex())
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def matches(self, query=''):
+        ingredients = ','.join(
+            str(ingredient.pk) for ingredient in self.pantry[:2])
+        response = self.client.get(
+            f'/api/recipes/pantry/?ingredients={ingredients}{query}')
+        self.assertEqual(response.status_code, 200)
+        return [(recipe['id'], recipe['missing_ingredients'])
+                for recipe in response.data['results']]
+
+    def test_rank(self):
+        first, second, _, _ = self.pantry_recipes
+        self.assertEqual(self.matches(), [(first.pk, 0), (second.pk, 1)])
+        self.assertEqual(self.matches('&max_missing=0'), [(first.pk, 0)])
+
+    def test_edited_recipe(self):
+        first, second, _, last = self.pantry_recipes
+        self.matches()
+        with self.captureOnCommitCallbacks(execute=True):
+            last.ingredients.all().delete()
+            RecipeIngredientLink.objects.bulk_create([
+                RecipeIngredientLink(recipe=last, ingredient=ingredient,
+                                     amount=1)
+                for ingredient in self.pantry[:2]])
+            last.save()
+        # При равном числе недостающих новые рецепты идут первыми.
+        self.assertEqual(self.matches(), [
+            (last.pk, 0), (first.pk, 0), (second.pk, 1)])
+        # Изменение перенесено в индекс без пересборки.
+        self.assertIn(last.pk, self.index.extra_slots)
+
+
+class RecipeSimilarityTest(TestCase):
+    """
+    Похожие и рекомендованные рецепты отдаются в порядке близости
+    без рецепта запроса и рецептов из избранного.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            email='user@test.local', username='user',
+            first_name='Имя', last_name='Фамилия')
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар', 'яйцо', 'соль', 'перец')]
+        cls.recipes = []
+        for number, positions in enumerate(
+                ((0, 1, 2), (0, 1, 3), (3, 4), (4,))):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Описание.',
+                cooking_time=10, image='recipes/test.png')
+            RecipeIngredientLink.objects.bulk_create([
+                RecipeIngredientLink(recipe=recipe, amount=1,
+                                     ingredient=ingredients[position])
+                for position in positions])
+            cls.recipes.append(recipe)
+        UserFavoriteRecipe.objects.create(user=cls.user,
+                                          recipe=cls.recipes[3])
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Индекс не собран и строится в памяти процесса.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings = override_settings(RECIPE_SIMILARITY_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch('recipes.similarity.similarity_index',
+                             SimilarityIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def found(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data]
+
+    def ids(self, *positions):
+        return [self.recipes[position].pk for position in positions]
+
+    def test_similar(self):
+        first, _, third, _ = self.recipes
+        self.assertEqual(
+            self.found(f'/api/recipes/{first.pk}/similar/'), self.ids(1))
+        self.assertEqual(
+            self.found(f'/api/recipes/{third.pk}/similar/'), self.ids(3, 1))
+        self.assertEqual(
+            self.found(f'/api/recipes/{third.pk}/similar/?limit=1'),
+            self.ids(3))
+
+    def test_recommended(self):
+        self.assertEqual(self.found('/api/recipes/recommended/'),
+                         self.ids(2))
+        response = APIClient().get('/api/recipes/recommended/')
+        self.assertEqual(response.status_code, 401)
+
+
+class AsyncReadViewsTest(TransactionTestCase):
+    """
+    Асинхронные list и retrieve отдают те же данные, что и синхронные.
+    Асинхронный путь читает базу из других потоков, поэтому данные
+    должны быть зафиксированы: тест выполняется без общей транзакции.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create(
+            email='user@test.local', username='user',
+            first_name='Имя', last_name='Фамилия')
+        self.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                      slug='breakfast')
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)]
+        self.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=self.user, name=f'Рецепт {number}', text='Описание.',
+                cooking_time=10, image='recipes/test.png',
+                tag_mask=tag_mask([self.tag.pk]))
+            recipe.tags.add(self.tag)
+            for amount, ingredient in enumerate(ingredients, start=1):
+                RecipeIngredientLink.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount)
+            self.recipes.append(recipe)
+        UserFavoriteRecipe.objects.create(user=self.user,
+                                          recipe=self.recipes[0])
+        self.factory = APIRequestFactory()
+
+    def assertSamePayload(self, viewset, actions, url, **kwargs):
+        for user in (None, self.user):
+            request = self.factory.get(url)
+            if user is not None:
+                request._force_auth_user = user
+            expected = rendered(viewset.as_view(actions)(request, **kwargs))
+            clear_caches()
+            request = self.factory.get(url)
+            if user is not None:
+                request._force_auth_user = user
+            response = rendered(async_to_sync(
+                viewset.as_async_view(actions))(request, **kwargs))
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(response.content, expected.content)
+
+    def test_recipes(self):
+        self.assertSamePayload(RecipeViewSet, {'get': 'list'},
+                               '/api/recipes/?limit=2')
+        self.assertSamePayload(RecipeViewSet, {'get': 'retrieve'},
+                               f'/api/recipes/{self.recipes[0].pk}/',
+                               pk=self.recipes[0].pk)
+
+    def test_references(self):
+        self.assertSamePayload(TagViewSet, {'get': 'list'}, '/api/tags/')
+        self.assertSamePayload(TagViewSet, {'get': 'retrieve'},
+                               f'/api/tags/{self.tag.pk}/', pk=self.tag.pk)
+        self.assertSamePayload(FoodIngredientViewSet, {'get': 'list'},
+                               '/api/ingredients/?name=инг')
+
+
+# Любая версия данных старше допустимого отставания реплики.
+class RecipeImageDerivativesTest(TransactionTestCase):
+    """
+    Копии картинки строятся в фоновом пуле после сохранения рецепта,
+    копии замененной картинки удаляются. Пул читает рецепт из других
+    потоков, поэтому тест выполняется без общей транзакции.
+    """
+
+    def setUp(self):
+        clear_caches()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create(
+            email='user@test.local', username='user',
+            first_name='Имя', last_name='Фамилия')
+        self.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                      slug='breakfast')
+        self.ingredient = Ingredient.objects.create(
+            name='ингредиент', measurement_unit='г')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def save_recipe(self, method, url):
+        tasks = []
+        executor = mock.Mock(submit=lambda *task: tasks.append(task))
+        with mock.patch('recipes.images.get_executor',
+                        return_value=executor):
+            response = getattr(self.client, method)(url, {
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 1}],
+                'tags': [self.tag.pk],
+                'image': image_uri(),
+                'name': 'Рецепт',
+                'text': 'Описание.',
+                'cooking_time': 10,
+            }, format='json')
+        self.assertIn(response.status_code, (200, 201))
+        # Задачи уходят в пул после ответа: SQLite в памяти блокирует
+        # таблицу, пока ее читает другое соединение.
+        for task in tasks:
+            get_executor().submit(*task)
+        wait_for_derivatives()
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def variant_names(self, recipe):
+        return [name for names in recipe.image_variants.values()
+                for name in names.values()]
+
+    def test_derivatives(self):
+        recipe = self.save_recipe('post', '/api/recipes/')
+        self.assertEqual(set(recipe.image_variants), {'webp', 'jpeg'})
+        previous = self.variant_names(recipe)
+        for name in previous:
+            self.assertTrue(default_storage.exists(name))
+        recipe = self.save_recipe('patch', f'/api/recipes/{recipe.pk}/')
+        current = self.variant_names(recipe)
+        self.assertEqual(len(current), len(previous))
+        for name in current:
+            self.assertTrue(default_storage.exists(name))
+        for name in previous:
+            self.assertFalse(default_storage.exists(name))
+
+
+@override_settings(DB_REPLICA_MAX_LAG=-1)
+class ReplicaRoutingTest(TestCase):
+    """
+    Чтение идет с реплики, пока пользователь не записал данные:
+    после записи он DB_REPLICA_PIN_SECONDS секунд читает
+    с основной базы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            email='user@test.local', username='user',
+            first_name='Имя', last_name='Фамилия')
+
+    def setUp(self):
+        clear_caches()
+        self.factory = APIRequestFactory()
+
+    def use_replica(self, method='get', user=None):
+        request = getattr(self.factory, method)('/api/recipes/')
+        if user is not None:
+            request._force_auth_user = user
+        view = RecipeViewSet()
+        view.action_map = {'get': 'list', 'post': 'create'}
+        request = view.initialize_request(request)
+        view.request = request
+        view.action = view.action_map[method]
+        return view.use_replica(request)
+
+    def test_unpinned_reads_replica(self):
+        self.assertTrue(self.use_replica())
+        self.assertTrue(self.use_replica(user=self.user))
+        self.assertFalse(self.use_replica('post', user=self.user))
+
+    def test_pinned_reads_primary(self):
+        pin_to_primary(self.user.pk)
+        self.assertFalse(self.use_replica(user=self.user))
+        self.assertTrue(self.use_replica())
+
+    def test_write_pins_user(self):
+        with mock.patch('foodgram.middleware.replica_aliases',
+                        return_value=['replica']):
+            middleware = ReplicaPinMiddleware(lambda request: None)
+        for method, status_code, pinned in (('get', 200, False),
+                                            ('post', 400, False),
+                                            ('post', 201, True)):
+            request = getattr(self.factory, method)('/api/recipes/')
+            request.user = self.user
+            middleware.process_response(request,
+                                        HttpResponse(status=status_code))
+            self.assertEqual(self.use_replica(user=self.user), not pinned)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Recipe))
+        token = set_read_replica('replica')
+        try:
+            self.assertEqual(router.db_for_read(Recipe), 'replica')
+            self.assertEqual(router.db_for_write(Recipe), 'default')
+        finally:
+            reset_read_replica(token)
+        self.assertIsNone(router.db_for_read(Recipe))
+
+
+class FakeConnection:
+    """Соединение с базой для проверок пула без сервера."""
+
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """
+    Пул выдает возвращенные соединения повторно, заменяет
+    не прошедшие проверку и ждет освобождения, когда все заняты.
+    """
+
+    def setUp(self):
+        self.pool = ConnectionPool(size=2, timeout=0.05, max_lifetime=60)
+
+    def acquire(self, check=lambda connection: True):
+        return self.pool.acquire(FakeConnection, check)
+
+    def test_checkout_return(self):
+        connection = self.acquire()
+        self.assertEqual(self.pool.stats()['in_use'], 1)
+        self.pool.release(connection)
+        # Незавершенная транзакция откатывается при возврате.
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+        self.assertIs(self.acquire(), connection)
+        self.assertEqual(self.pool.stats()['connects'], 1)
+
+    def test_release_unusable(self):
+        broken = self.acquire()
+        self.pool.release(broken, reusable=False)
+        self.assertTrue(broken.closed)
+        self.pool.max_lifetime = -1
+        expired = self.acquire()
+        self.pool.release(expired)
+        self.assertTrue(expired.closed)
+        stats = self.pool.stats()
+        self.assertEqual((stats['idle'], stats['discarded']), (0, 2))
+
+    def test_health_check(self):
+        check = mock.Mock(return_value=False)
+        connection = self.acquire()
+        self.pool.release(connection)
+        with mock.patch.object(pool, 'CHECK_IDLE_AFTER', -1):
+            # Без DB_HEALTH_CHECKS соединение не проверяется.
+            self.assertIs(self.acquire(check), connection)
+            check.assert_not_called()
+            self.pool.release(connection)
+            with override_settings(DB_HEALTH_CHECKS=True):
+                fresh = self.acquire(check)
+        check.assert_called_once_with(connection)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(fresh, connection)
+
+    def test_exhausted(self):
+        connections = [self.acquire(), self.acquire()]
+        with self.assertRaises(PoolTimeout):
+            self.acquire()
+        stats = self.pool.stats()
+        self.assertEqual((stats['waits'], stats['timeouts']), (1, 1))
+        # Ожидающий запрос получает соединение, возвращенное
+        # другим потоком.
+        self.pool.timeout = 5
+        release = threading.Timer(
+            0.01, self.pool.release, [connections[0]])
+        release.start()
+        self.assertIs(self.acquire(), connections[0])
+        release.join()
+        self.assertEqual(self.pool.stats()['in_use'], 2)
+
+
+class PooledDatabaseWrapper(PooledDatabaseMixin, sqlite3_base.DatabaseWrapper):
+    """Обертка SQLite с пулом: примесь не зависит от СУБД."""
+
+
+@override_settings(DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.05)
+class PooledDatabaseTest(SimpleTestCase):
+    """
+    Обертка базы с пулом берет соединения из пула процесса
+    и возвращает их при закрытии.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings_dict = {
+            **connection.settings_dict,
+            'NAME': f'{self.directory}/pooled.sqlite3',
+            'OPTIONS': {},
+        }
+        self.first, self.second = (
+            PooledDatabaseWrapper(settings_dict, alias='pooled')
+            for _ in range(2))
+
+    def tearDown(self):
+        for wrapper in (self.first, self.second):
+            wrapper.close()
+        pool.get_pool('pooled').close()
+        pool._pools.pop('pooled', None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_checkout_return(self):
+        self.assertIs(self.first.pool, self.second.pool)
+        self.first.ensure_connection()
+        raw = self.first.connection
+        with self.assertRaises(OperationalError):
+            self.second.ensure_connection()
+        self.first.close()
+        self.second.ensure_connection()
+        self.assertIs(self.second.connection, raw)
+        with self.second.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+        self.assertEqual(pool.pool_stats()['pooled']['connects'], 1)
+
+    @unittest.skipIf(PostgresDatabaseWrapper is None, 'нет psycopg2')
+    def test_postgresql_isolation_level(self):
+        wrapper = PostgresDatabaseWrapper(
+            {**connection.settings_dict, 'OPTIONS': {}}, alias='pooled')
+        wrapper.init_pooled_connection(mock.Mock(isolation_level=2))
+        self.assertEqual(wrapper.isolation_level, 2)
@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from . import views
+from .async_views import async_read_urls
 
 router = DefaultRouter()
 router.register('recipes', views.RecipeViewSet, basename='recipes')
@@ -10,8 +12,15 @@ router.register('users', views.UserProfileViewSet, basename='users')
 router.register('ingredients', views.FoodIngredientViewSet,
                 basename='ingredients')
 
+# Маршруты djoser для пользователей, с вьюсетом, читающим с реплик.
+users_router = DefaultRouter()
+users_router.register('users', views.UserViewSet)
+
 urlpatterns = [
     path('', include(router.urls)),
-    path('', include('djoser.urls')),
+    path('', include(users_router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns = async_read_urls(router) + urlpatterns
@@ -1,31 +1,63 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import hashlib
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import (
+    BooleanField, Count, Max, Prefetch, Value, prefetch_related_objects)
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
+from djoser.views import UserViewSet as DjoserUserViewSet
 
-from rest_framework import filters, mixins, status, viewsets
+from rest_framework import mixins, serializers, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from recipes.cache import (
+    ingredients_cache, popularity_version, recipes_version, tags_cache,
+    user_state_version, users_version,
+)
+from recipes.feed import FeedIds
+from recipes.pantry import match_pantry
+from recipes.similarity import recommended_recipes, similar_recipes
 from recipes.models import (
-    Ingredient, Recipe, RecipeIngredientLink,
+    Ingredient, Recipe, ShoppingCartItem,
     Tag, UserFavoriteRecipe, UserShoppingCart,
 )
 from users.models import Subscribe, User
 
-from .filters import RecipeQueryFilter
+from .async_views import AsyncReadMixin, prefetch_concurrently, run_in_thread
+from .filters import IngredientSearchFilter, RecipeQueryFilter
+from .mixins import (
+    ConditionalGetMixin, ReferenceDataCacheMixin, ReplicaReadMixin,
+)
 from .pagination import RecipePageNumberPagination
 from .permissions import IsAuthorOrReadOnly
+from .renderers import SHOPPING_LIST_RENDERERS
 from .serializers import (
-    AuthorSubscriptionSerializer, IngredientSerializer,
+    AuthorSubscriptionSerializer, IngredientSerializer, PantryRecipeSerializer,
     RecipeCreateSerializer, RecipeDetailReadSerializer,
     RecipeSerializer, TagSerializer, UserSubscriptionsSerializer,
 )
 
 
-class UserProfileViewSet(viewsets.GenericViewSet):
+class UserViewSet(ReplicaReadMixin, DjoserUserViewSet):
+    """
+    Пользователи djoser: списки и профили читаются с реплик.
+    """
+
+    def get_replica_versions(self, request):
+        versions = [users_version.get_version()]
+        if request.user.is_authenticated:
+            versions.append(user_state_version(request.user.pk).get_version())
+        return versions
+
+
+class UserProfileViewSet(ConditionalGetMixin, viewsets.GenericViewSet):
     """
     Вьюсет для управления профилями пользователей.
     Поддерживает создание,
@@ -34,17 +66,53 @@ class UserProfileViewSet(viewsets.GenericViewSet):
     queryset = User.objects.all()
     permission_classes = (AllowAny,)
     pagination_class = RecipePageNumberPagination
+    conditional_actions = ('subscriptions',)
+
+    def get_etag_parts(self, request):
+        return [users_version.get_version(),
+                recipes_version.get_version(),
+                user_state_version(request.user.pk).get_version()]
 
     @action(detail=False, methods=['get'],
             permission_classes=(IsAuthenticated,),
             pagination_class=RecipePageNumberPagination)
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscribing__user=request.user)
+        recipes_limit = self.get_recipes_limit()
+        queryset = User.objects.filter(
+            subscribing__user=request.user
+        ).annotate(
+            recipes_count=Count('recipes'),
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('pk')
         page = self.paginate_queryset(queryset)
+        recipes = Recipe.objects.filter(author__in=page)
+        if recipes_limit is not None:
+            recipes = recipes.latest_per_author(recipes_limit)
+        prefetch_related_objects(
+            page, Prefetch('recipes', queryset=recipes,
+                           to_attr='limited_recipes'))
         serializer = UserSubscriptionsSerializer(
-            page, many=True, context={'request': request})
+            page, many=True, context={'request': request,
+                                      'recipes_limit': recipes_limit})
         return self.get_paginated_response(serializer.data)
 
+    def get_recipes_limit(self):
+        """
+        Проверяет параметр recipes_limit и возвращает его как число
+        или None, если параметр не передан.
+        """
+        limit = self.request.query_params.get('recipes_limit')
+        if limit is None or limit == '':
+            return None
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise serializers.ValidationError(
+                {'recipes_limit': 'Неверное значение.'})
+        return limit
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=(IsAuthenticated,))
@@ -71,7 +139,10 @@ class UserProfileViewSet(viewsets.GenericViewSet):
                             status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(mixins.ListModelMixin,
+class TagViewSet(ReplicaReadMixin,
+                 AsyncReadMixin,
+                 ReferenceDataCacheMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
     """
@@ -83,9 +154,13 @@ class TagViewSet(mixins.ListModelMixin,
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    reference_cache = tags_cache
 
 
-class FoodIngredientViewSet(mixins.ListModelMixin,
+class FoodIngredientViewSet(ReplicaReadMixin,
+                            AsyncReadMixin,
+                            ReferenceDataCacheMixin,
+                            mixins.ListModelMixin,
                             mixins.RetrieveModelMixin,
                             viewsets.GenericViewSet):
     """
@@ -97,11 +172,17 @@ class FoodIngredientViewSet(mixins.ListModelMixin,
     permission_classes = (AllowAny, )
     serializer_class = IngredientSerializer
     pagination_class = None
-    filter_backends = (filters.SearchFilter, )
-    search_fields = ('^name', )
+    filter_backends = (IngredientSearchFilter, )
+    reference_cache = ingredients_cache
+
+    def use_reference_cache(self, request):
+        return (super().use_reference_cache(request)
+                and IngredientSearchFilter.search_param
+                not in request.query_params)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, AsyncReadMixin, ConditionalGetMixin,
+                    viewsets.ModelViewSet):
     """
     Вьюсет для управления кулинарными рецептами.
     Поддерживает все основные
@@ -109,19 +190,169 @@ class RecipeViewSet(viewsets.ModelViewSet):
     """
     queryset = Recipe.objects.all()
     pagination_class = RecipePageNumberPagination
+    keyset_pagination = True
+    conditional_actions = ('list', 'retrieve', 'feed', 'pantry')
     permission_classes = (IsAuthorOrReadOnly, )
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeQueryFilter
     http_method_names = ['get', 'post', 'patch', 'create', 'delete']
+    # Асинхронное чтение подгружает связанные объекты само.
+    load_related = True
+
+    def get_etag_parts(self, request):
+        parts = [recipes_version.get_version(),
+                 tags_cache.get_version(),
+                 ingredients_cache.get_version(),
+                 users_version.get_version()]
+        if request.user.is_authenticated:
+            parts.append(user_state_version(request.user.pk).get_version())
+        if request.query_params.get('ordering') == 'popular':
+            parts.append(popularity_version.get_version())
+        return parts
+
+    def get_queryset(self):
+        """
+        Для чтения подгружает связанные объекты и флаги пользователя,
+        чтобы страница рецептов стоила постоянное число запросов.
+        """
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve', 'feed', 'pantry',
+                           'similar', 'recommended'):
+            user = self.request.user
+            queryset = queryset.with_user_flags(user)
+            if self.load_related:
+                queryset = queryset.with_related(user)
+        return queryset
+
+    def load_page(self):
+        self.load_related = False
+        return self.paginate_queryset(
+            self.filter_queryset(self.get_queryset()))
+
+    def load_object(self):
+        self.load_related = False
+        return self.get_object()
+
+    async def async_list(self, request, *args, **kwargs):
+        """
+        Страница рецептов под ASGI: после запроса страницы автор,
+        теги и ингредиенты подгружаются одновременно.
+        """
+        page = await run_in_thread(self.load_page)
+        await prefetch_concurrently(
+            page, Recipe.objects.related_lookups(request.user))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    async def async_retrieve(self, request, *args, **kwargs):
+        instance = await run_in_thread(self.load_object)
+        await prefetch_concurrently(
+            [instance], Recipe.objects.related_lookups(request.user))
+        return Response(self.get_serializer(instance).data)
 
     def get_serializer_class(self):
         """
         Определяет класс сериализатора в зависимости от действия.
         """
-        if self.action in ('list', 'retrieve'):
+        if self.action == 'pantry':
+            return PantryRecipeSerializer
+        if self.action in ('list', 'retrieve', 'feed',
+                           'similar', 'recommended'):
             return RecipeDetailReadSerializer
         return RecipeCreateSerializer
 
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,),
+            keyset_pagination=False)
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь.
+        Id рецептов страницы берутся из ленты в кеше, а за ее
+        пределами - запросом к подпискам; сами рецепты загружаются
+        по первичному ключу.
+        """
+        page = self.paginate_queryset(FeedIds(request.user.pk))
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], keyset_pagination=False)
+    def pantry(self, request):
+        """
+        Подбор рецептов по продуктам: ?ingredients=1,2,3.
+        Сначала рецепты, для которых есть все ингредиенты, затем
+        рецепты без одного ингредиента и так далее.
+        Параметр max_missing ограничивает число недостающих.
+        """
+        ingredients = self.get_int_list_param('ingredients')
+        if not ingredients:
+            raise serializers.ValidationError(
+                {'ingredients': 'Обязательный параметр.'})
+        if len(ingredients) > settings.PANTRY_MAX_INGREDIENTS:
+            raise serializers.ValidationError(
+                {'ingredients': 'Не больше {} ингредиентов.'.format(
+                    settings.PANTRY_MAX_INGREDIENTS)})
+        max_missing = self.get_int_list_param('max_missing')
+        page = self.paginate_queryset(match_pantry(
+            ingredients, max_missing[0] if max_missing else None))
+        recipes = self.get_queryset().in_bulk([pk for pk, _ in page])
+        found = []
+        for pk, missing in page:
+            if pk in recipes:
+                recipes[pk].missing_ingredients = missing
+                found.append(recipes[pk])
+        serializer = self.get_serializer(found, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], pagination_class=None)
+    def similar(self, request, pk=None):
+        """
+        Рецепты с похожим набором ингредиентов.
+        """
+        recipe = get_object_or_404(Recipe, pk=pk)
+        return self.similarity_response(
+            lambda limit: similar_recipes(recipe.pk, limit))
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,), pagination_class=None)
+    def recommended(self, request):
+        """
+        Рецепты, похожие на рецепты из избранного пользователя.
+        """
+        return self.similarity_response(
+            lambda limit: recommended_recipes(request.user, limit))
+
+    def similarity_response(self, find):
+        """
+        Отдает не больше ?limit= рецептов в порядке близости.
+        Запрашивает из индекса вдвое больше, чтобы
+        удаленные рецепты не сокращали выдачу.
+        """
+        limit = self.get_int_list_param('limit')
+        limit = min(
+            limit[0] if limit else RecipePageNumberPagination.page_size,
+            settings.RECIPE_SIMILARITY_MAX_LIMIT)
+        ids = find(limit * 2)
+        recipes = self.get_queryset().in_bulk(ids)
+        found = [recipes[pk] for pk in ids if pk in recipes][:limit]
+        return Response(self.get_serializer(found, many=True).data)
+
+    def get_int_list_param(self, name):
+        """
+        Читает из запроса список неотрицательных чисел:
+        повторяющийся параметр или значения через запятую.
+        """
+        values = [value for param in self.request.query_params.getlist(name)
+                  for value in param.split(',') if value.strip()]
+        try:
+            values = [int(value) for value in values]
+        except ValueError:
+            values = [-1]
+        if any(value < 0 for value in values):
+            raise serializers.ValidationError({name: 'Неверное значение.'})
+        return values
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(IsAuthenticated,))
     def favorite(self, request, **kwargs):
@@ -133,16 +364,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.is_valid(raise_exception=True)
             if not UserFavoriteRecipe.objects.filter(
                     user=request.user, recipe=recipe).exists():
-                UserFavoriteRecipe.objects.create(
-                    user=request.user, recipe=recipe)
+                with transaction.atomic():
+                    UserFavoriteRecipe.objects.create(
+                        user=request.user, recipe=recipe)
                 return Response(serializer.data,
                                 status=status.HTTP_201_CREATED)
             return Response({'errors': 'Рецепт уже добавлен в избранное.'},
                             status=status.HTTP_400_BAD_REQUEST)
 
         if request.method == 'DELETE':
-            get_object_or_404(UserFavoriteRecipe, user=request.user,
-                              recipe=recipe).delete()
+            with transaction.atomic():
+                get_object_or_404(UserFavoriteRecipe, user=request.user,
+                                  recipe=recipe).delete()
             return Response({'detail': 'Рецепт удален из избранного.'},
                             status=status.HTTP_204_NO_CONTENT)
 
@@ -158,8 +391,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.is_valid(raise_exception=True)
             if not UserShoppingCart.objects.filter(
                     user=request.user, recipe=recipe).exists():
-                UserShoppingCart.objects.create(
-                    user=request.user, recipe=recipe)
+                with transaction.atomic():
+                    UserShoppingCart.objects.create(
+                        user=request.user, recipe=recipe)
                 return Response(serializer.data,
                                 status=status.HTTP_201_CREATED)
             return Response(
@@ -167,29 +401,57 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST)
 
         if request.method == 'DELETE':
-            get_object_or_404(UserShoppingCart, user=request.user,
-                              recipe=recipe).delete()
+            with transaction.atomic():
+                get_object_or_404(UserShoppingCart, user=request.user,
+                                  recipe=recipe).delete()
             return Response(
                 {'detail': 'Рецепт успешно удален из списка покупок.'},
                 status=status.HTTP_204_NO_CONTENT
             )
 
     @action(detail=False, methods=['get'],
-            permission_classes=(IsAuthenticated,))
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request, **kwargs):
+        """
+        Потоково отдает список покупок в формате, выбранном
+        параметром ?format= (txt, csv, pdf).
+        Повторная загрузка неизмененного списка возвращает 304.
+        """
+        renderer = request.accepted_renderer
+        cart = UserShoppingCart.objects.filter(user=request.user).aggregate(
+            count=Count('id'),
+            last_id=Max('id'),
+            last_modified=Max('recipe__updated_at'),
+        )
+        # Названия и единицы измерения ингредиентов меняются
+        # без изменения рецептов: их учитывает версия справочника.
+        etag = '"{}"'.format(hashlib.md5('{}:{}:{}:{}:{}:{}'.format(
+            request.user.id, renderer.format, cart['count'],
+            cart['last_id'], cart['last_modified'],
+            ingredients_cache.get_version()
+        ).encode()).hexdigest())
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
         ingredients = (
-            RecipeIngredientLink.objects
-            .filter(recipe__usershoppingcart__user=request.user)
-            .values('ingredient')
-            .annotate(total_amount=Sum('amount'))
+            ShoppingCartItem.objects
+            .filter(user=request.user)
             .values_list('ingredient__name', 'total_amount',
                          'ingredient__measurement_unit')
+            .order_by('ingredient__name')
+            .iterator(chunk_size=settings.SHOPPING_CART_CHUNK_SIZE)
         )
-        file_list = []
-        [file_list.append(
-            '{} - {} {}.'.format(*ingredient)) for ingredient in ingredients]
-        file = HttpResponse('Cписок покупок:\n' + '\n'.join(file_list),
-                            content_type='text/plain')
-        file['Content-Disposition'] = (
-            f'attachment;filename={settings.FILE_NAME}')
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        file = StreamingHttpResponse(renderer.stream(ingredients),
+                                     content_type=content_type)
+        file_name = f'{Path(settings.FILE_NAME).stem}.{renderer.format}'
+        file['Content-Disposition'] = f'attachment;filename={file_name}'
+        file['ETag'] = etag
+        if cart['last_modified']:
+            file['Last-Modified'] = http_date(
+                cart['last_modified'].timestamp())
         return file
@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+from collections import deque
+from functools import partial
+
+from django.conf import settings
+
+# Свободное соединение дольше этого (с) проверяется перед выдачей,
+# если включен DB_HEALTH_CHECKS.
+CHECK_IDLE_AFTER = 30
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = None
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Пул соединений с базой одного процесса. Соединений не больше
+    size; если все заняты, запрос ждет освобождения до timeout
+    секунд. Соединения старше max_lifetime закрываются
+    при возврате. Ведет счетчики для pool_stats.
+    """
+
+    def __init__(self, size, timeout, max_lifetime):
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.condition = threading.Condition()
+        # Пары (соединение, время возврата); последнее возвращенное
+        # выдается первым, редко нужные соединения устаревают.
+        self.idle = deque()
+        self.created = {}
+        self.in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.connect_time = 0.0
+        self.discarded = 0
+
+    def acquire(self, connect, check):
+        """
+        Выдает свободное соединение или открывает новое вызовом
+        connect(). check(connection) проверяет соединение,
+        простоявшее без дела дольше CHECK_IDLE_AFTER.
+        """
+        with self.condition:
+            self.wait_for_slot()
+            self.in_use += 1
+            entry = self.idle.pop() if self.idle else None
+        try:
+            if entry is not None:
+                connection, released = entry
+                if self.usable(connection, released, check):
+                    return connection
+                self.discard(connection)
+            started = time.perf_counter()
+            connection = connect()
+            elapsed = time.perf_counter() - started
+            with self.condition:
+                self.connects += 1
+                self.connect_time += elapsed
+                self.created[connection] = time.monotonic()
+            return connection
+        except BaseException:
+            with self.condition:
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+
+    def wait_for_slot(self):
+        # Свободные и выданные соединения вместе не превышают size.
+        if self.in_use < self.size:
+            return
+        self.waits += 1
+        started = time.monotonic()
+        deadline = started + self.timeout
+        try:
+            while self.in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f'Нет свободных соединений за {self.timeout} с.')
+                self.condition.wait(remaining)
+        finally:
+            self.wait_time += time.monotonic() - started
+
+    def usable(self, connection, released, check):
+        if getattr(connection, 'closed', False) or self.expired(connection):
+            return False
+        if (settings.DB_HEALTH_CHECKS
+                and time.monotonic() - released > CHECK_IDLE_AFTER):
+            return check(connection)
+        return True
+
+    def expired(self, connection):
+        created = self.created.get(connection, 0)
+        return time.monotonic() - created > self.max_lifetime
+
+    def release(self, connection, reusable=True):
+        """
+        Возвращает соединение в пул. Незавершенная транзакция
+        откатывается; соединение после ошибки или устаревшее
+        закрывается.
+        """
+        if reusable and not self.expired(connection):
+            try:
+                connection.rollback()
+            except Exception:
+                reusable = False
+        with self.condition:
+            self.in_use -= 1
+            if reusable and not self.expired(connection):
+                self.idle.append((connection, time.monotonic()))
+                connection = None
+            self.condition.notify()
+        if connection is not None:
+            self.discard(connection)
+
+    def discard(self, connection):
+        with self.condition:
+            self.created.pop(connection, None)
+            self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, deque()
+        for connection, _ in idle:
+            self.discard(connection)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'waits': self.waits,
+                'wait_ms': round(self.wait_time * 1000, 2),
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'connect_ms': round(self.connect_time * 1000, 2),
+                'discarded': self.discarded,
+            }
+
+
+def get_pool(alias):
+    """
+    Пул базы alias текущего процесса. После fork (процессы
+    gunicorn) пулы создаются заново: соединения родителя
+    не используются.
+    """
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(
+                settings.DB_POOL_SIZE, settings.DB_POOL_TIMEOUT,
+                settings.DB_POOL_MAX_LIFETIME)
+        return _pools[alias]
+
+
+def pool_stats():
+    """Счетчики пулов текущего процесса по базам."""
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            return {}
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
+
+class PooledDatabaseMixin:
+    """
+    Примесь к DatabaseWrapper: соединения берутся из пула процесса
+    (при DB_POOL_SIZE > 0) и возвращаются в него вместо закрытия.
+    При DB_HEALTH_CHECKS постоянное соединение проверяется перед
+    первым запросом к базе в каждом запросе к API.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = get_pool(self.alias) if settings.DB_POOL_SIZE else None
+        self.health_check_done = False
+
+    def get_new_connection(self, conn_params):
+        if self.pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            connection = self.pool.acquire(
+                partial(super().get_new_connection, conn_params),
+                self.ping)
+        except PoolTimeout as error:
+            raise self.Database.OperationalError(str(error)) from error
+        self.init_pooled_connection(connection)
+        return connection
+
+    def init_pooled_connection(self, connection):
+        """Состояние обертки для соединения, взятого из пула."""
+
+    def ping(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except self.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.pool is None:
+            return super()._close()
+        self.pool.release(self.connection, reusable=not self.errors_occurred)
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def _cursor(self, name=None):
+        if (settings.DB_HEALTH_CHECKS and self.connection is not None
+                and not self.health_check_done):
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+        return super()._cursor(name)
@@ -0,0 +1,16 @@
+from django.db.backends.postgresql import base
+
+from foodgram.db.pool import PooledDatabaseMixin
+
+
+class DatabaseWrapper(PooledDatabaseMixin, base.DatabaseWrapper):
+    """
+    PostgreSQL с пулом соединений процесса и проверкой
+    постоянных соединений. Подключается через
+    DB_ENGINE=foodgram.db.postgresql.
+    """
+
+    def init_pooled_connection(self, connection):
+        # Уровень изоляции соединения из пула задан при его открытии.
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
@@ -0,0 +1,123 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Отставание реплики PostgreSQL, секунд. На основной базе функции
+# возвращают NULL, отставание считается нулевым.
+LAG_SQL = '''
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM
+            now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+_read_replica = ContextVar('read_replica', default=None)
+
+# Последние замеры отставания реплик процесса: alias -> (время, секунд).
+_lag_checks = {}
+
+
+def replica_aliases():
+    """Все базы, кроме основной, считаются репликами."""
+    return [alias for alias in settings.DATABASES
+            if alias != DEFAULT_DB_ALIAS]
+
+
+def measure_lag(alias):
+    """
+    Отставание реплики, секунд; недоступная реплика отстает
+    бесконечно. У других СУБД (SQLite-файл вместо реплики
+    в тестах) отставание не измеряется.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        return float('inf')
+
+
+def replica_lag(alias):
+    """
+    Отставание реплики не старше DB_REPLICA_LAG_CHECK_INTERVAL.
+    """
+    now = time.monotonic()
+    checked_at, lag = _lag_checks.get(alias, (None, None))
+    if (checked_at is None
+            or now - checked_at >= settings.DB_REPLICA_LAG_CHECK_INTERVAL):
+        lag = measure_lag(alias)
+        _lag_checks[alias] = (now, lag)
+    return lag
+
+
+def choose_replica():
+    """
+    Случайная реплика с отставанием не больше DB_REPLICA_MAX_LAG
+    или None, если таких нет.
+    """
+    replicas = [alias for alias in replica_aliases()
+                if replica_lag(alias) <= settings.DB_REPLICA_MAX_LAG]
+    return random.choice(replicas) if replicas else None
+
+
+def set_read_replica(alias):
+    """
+    Направляет чтение текущего запроса на реплику alias
+    (None - на основную базу). Возвращает токен для сброса.
+    """
+    return _read_replica.set(alias)
+
+
+def reset_read_replica(token):
+    _read_replica.reset(token)
+
+
+def pin_key(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """
+    После записи пользователь читает с основной базы
+    DB_REPLICA_PIN_SECONDS секунд: реплика могла еще
+    не получить его изменения. Отметка хранится в кеше
+    REFERENCE_CACHE_ALIAS, общем для процессов gunicorn
+    (SHARED_CACHE_ALIASES в настройках), поэтому действует
+    в любом процессе, а не только в записавшем.
+    """
+    caches[settings.REFERENCE_CACHE_ALIAS].set(
+        pin_key(user_id), True, timeout=settings.DB_REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    return bool(caches[settings.REFERENCE_CACHE_ALIAS].get(pin_key(user_id)))
+
+
+class ReplicaRouter:
+    """
+    Чтение - с реплики, выбранной для текущего запроса
+    (set_read_replica), остальное - с основной базы. Запись всегда
+    идет в основную базу. В тестах реплику может заменить второй
+    файл SQLite: для него отставание не измеряется, данные в него
+    копируются самим тестом.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
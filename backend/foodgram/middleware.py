@@ -0,0 +1,205 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram.db.pool import pool_stats
+from foodgram.db.routers import pin_to_primary, replica_aliases
+
+logger = logging.getLogger('foodgram.profiling')
+
+# Повторяющихся запросов в записи журнала.
+TOP_DUPLICATES = 3
+
+# Длина текста запроса в списке повторов.
+SQL_SAMPLE_LENGTH = 300
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN (ANALYZE, BUFFERS) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+_current_profile = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """
+    Счетчики одного запроса: запросы к базе и их время,
+    время сериализации и число запросов, сделанных во время нее.
+    Экземпляр подключается к соединениям как execute_wrapper.
+    """
+
+    def __init__(self):
+        self.queries = Counter()
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serialize_queries = 0
+        self.serialize_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_time += elapsed
+            self.queries[sql] += 1
+            if self.serialize_depth:
+                self.serialize_queries += 1
+            if elapsed * 1000 >= settings.REQUEST_PROFILING_SLOW_QUERY_MS:
+                log_slow_query(sql, params, many, context, elapsed)
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.queries.values())
+
+    def server_timing(self, total):
+        return (
+            'db;dur={:.1f};desc="queries={} duplicates={}", '
+            'serialize;dur={:.1f};desc="queries={}", '
+            'total;dur={:.1f}'.format(
+                self.db_time * 1000, self.query_count, self.duplicates,
+                self.serialize_time * 1000, self.serialize_queries,
+                total * 1000))
+
+    def summary(self, request, response, total):
+        match = request.resolver_match
+        summary = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(self.db_time * 1000, 2),
+            'queries': self.query_count,
+            'duplicates': self.duplicates,
+            'serialize_ms': round(self.serialize_time * 1000, 2),
+            'serialize_queries': self.serialize_queries,
+            'top_duplicates': [
+                {'sql': sql[:SQL_SAMPLE_LENGTH], 'count': count}
+                for sql, count in self.queries.most_common(TOP_DUPLICATES)
+                if count > 1
+            ],
+        }
+        pools = pool_stats()
+        if pools:
+            summary['pools'] = pools
+        return summary
+
+
+def log_slow_query(sql, params, many, context, elapsed):
+    """
+    Пишет в журнал медленный запрос с подставленными
+    параметрами, готовый для EXPLAIN.
+    """
+    connection = context['connection']
+    if not many:
+        sql = connection.ops.last_executed_query(
+            context['cursor'], sql, params)
+    logger.warning(json.dumps({
+        'slow_query_ms': round(elapsed * 1000, 2),
+        'database': connection.alias,
+        'explain': EXPLAIN_PREFIXES.get(connection.vendor, 'EXPLAIN ') + sql,
+    }, ensure_ascii=False))
+
+
+def instrument_serializers():
+    """
+    Оборачивает BaseSerializer.data: время внешнего обращения
+    к data (вложенные сериализаторы входят в него) записывается
+    в профиль текущего запроса.
+    """
+    original = serializers.BaseSerializer.data.fget
+    if getattr(original, 'profiled', False):
+        return
+
+    @wraps(original)
+    def data(serializer):
+        profile = _current_profile.get()
+        if profile is None or profile.serialize_depth:
+            return original(serializer)
+        profile.serialize_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(serializer)
+        finally:
+            profile.serialize_time += time.perf_counter() - started
+            profile.serialize_depth -= 1
+
+    data.profiled = True
+    serializers.BaseSerializer.data = property(data)
+
+
+class RequestProfilingMiddleware:
+    """
+    Профилирование запросов: число и время запросов к базе,
+    повторяющиеся запросы (признак N+1), время сериализации,
+    счетчики пулов соединений процесса.
+    Итоги отдаются в заголовке Server-Timing и пишутся в журнал
+    foodgram.profiling строкой JSON. Профилируется доля запросов
+    REQUEST_PROFILING_SAMPLE_RATE. При REQUEST_PROFILING = False
+    middleware исключается из цепочки при запуске.
+    Время потоковых ответов учитывается до начала передачи.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total = time.perf_counter() - started
+        response['Server-Timing'] = profile.server_timing(total)
+        logger.info(json.dumps(profile.summary(request, response, total),
+                               ensure_ascii=False))
+        return response
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """
+    После успешной записи пользователь читает с основной базы
+    DB_REPLICA_PIN_SECONDS секунд (foodgram.db.routers).
+    Пользователя по токену DRF записывает в request.user.
+    Без реплик middleware исключается из цепочки при запуске.
+    """
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        user = getattr(request, 'user', None)
+        if (request.method not in SAFE_METHODS
+                and response.status_code < 400
+                and user is not None and user.is_authenticated):
+            pin_to_primary(user.pk)
+        return response
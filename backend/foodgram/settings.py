@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -31,12 +32,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'foodgram.middleware.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -61,17 +64,59 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Пул соединений процесса для движка foodgram.db.postgresql;
+# 0 - без пула.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 0))
+
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800))
+
+# Проверка постоянного соединения перед первым запросом к базе.
+DB_HEALTH_CHECKS = os.getenv('DB_HEALTH_CHECKS', 'False').lower() == 'true'
+
 DATABASES = {
     'default': {
         'ENGINE': os.getenv('DB_ENGINE'),
         'NAME': os.getenv('DB_NAME', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'django'),
-        'HOST': 'db',
-        'PORT': os.getenv('DB_PORT', 5432)
+        'HOST': os.getenv('DB_HOST', 'db'),
+        'PORT': os.getenv('DB_PORT', 5432),
+        # С пулом соединение возвращается в пул после каждого запроса.
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else int(
+            os.getenv('DB_CONN_MAX_AGE', 60)),
+        # PgBouncer в режиме transaction не поддерживает
+        # серверные курсоры.
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv(
+            'DB_DISABLE_SERVER_SIDE_CURSORS', 'False').lower() == 'true',
     }
 }
 
+# Реплики для чтения: хосты через запятую, можно с портом (host:5433).
+DB_REPLICA_HOSTS = [
+    host for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host]
+
+for number, replica in enumerate(DB_REPLICA_HOSTS, start=1):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['foodgram.db.routers.ReplicaRouter']
+
+# Допустимое отставание реплики, секунд.
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+
+DB_REPLICA_LAG_CHECK_INTERVAL = float(
+    os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', 1))
+
+# Сколько секунд после записи пользователь читает с основной базы.
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 10))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': ('django.contrib.auth.password_validation'
@@ -144,3 +189,130 @@ CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
 
 FILE_NAME = 'shopping_cart.txt'
+
+SHOPPING_CART_CHUNK_SIZE = int(os.getenv('SHOPPING_CART_CHUNK_SIZE', 500))
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+
+# Конфигурация полнотекстового поиска PostgreSQL. После ее смены
+# документы рецептов пересобираются командой rebuild_search_index.
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+
+PANTRY_MAX_INGREDIENTS = int(os.getenv('PANTRY_MAX_INGREDIENTS', 100))
+
+PANTRY_INDEX_MAX_CHANGES = int(os.getenv('PANTRY_INDEX_MAX_CHANGES', 10000))
+
+RECIPE_SIMILARITY_DIR = os.getenv(
+    'RECIPE_SIMILARITY_DIR', os.path.join(BASE_DIR, 'similarity'))
+
+RECIPE_SIMILARITY_HISTORY = int(os.getenv('RECIPE_SIMILARITY_HISTORY', 50))
+
+RECIPE_SIMILARITY_MAX_LIMIT = int(
+    os.getenv('RECIPE_SIMILARITY_MAX_LIMIT', 50))
+
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+FEED_CACHE_BACKEND = os.getenv('FEED_CACHE_BACKEND', LOCAL_CACHE_BACKENDS[0])
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', LOCAL_CACHE_BACKENDS[0]),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    # Ленты подписок. memcached вытесняет давно не читавшиеся
+    # ленты сам (LRU), в памяти процесса их число ограничено.
+    'feed': {
+        'BACKEND': FEED_CACHE_BACKEND,
+        'LOCATION': os.getenv('FEED_CACHE_LOCATION', 'feed'),
+        'TIMEOUT': int(os.getenv('FEED_CACHE_TIMEOUT', 60 * 60 * 24)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('FEED_CACHE_MAX_USERS', 10000)),
+        } if FEED_CACHE_BACKEND in LOCAL_CACHE_BACKENDS else {},
+    },
+}
+
+REFERENCE_CACHE_ALIAS = os.getenv('REFERENCE_CACHE_ALIAS', 'default')
+
+HOME_FEED_CACHE_ALIAS = 'feed'
+
+# Кеши с версиями данных, ETag, готовым JSON справочников, счетчиками
+# страниц и лентами подписок. С несколькими процессами gunicorn они
+# должны быть общими (memcached, см. docker-compose.yml): в LocMemCache
+# изменение видно только процессу, который его записал.
+SHARED_CACHE_ALIASES = ['default', REFERENCE_CACHE_ALIAS,
+                        HOME_FEED_CACHE_ALIAS]
+
+SERVER_WORKERS = int(os.getenv('GUNICORN_WORKERS', 1))
+
+if SERVER_WORKERS > 1:
+    local_caches = sorted({
+        alias for alias in SHARED_CACHE_ALIASES
+        if CACHES[alias]['BACKEND'] in LOCAL_CACHE_BACKENDS})
+    if local_caches:
+        raise ImproperlyConfigured(
+            'GUNICORN_WORKERS={} требует общего кеша, а кеши {} хранятся '
+            'в памяти процесса. Задайте CACHE_BACKEND, CACHE_LOCATION, '
+            'FEED_CACHE_BACKEND и FEED_CACHE_LOCATION (memcached) '
+            'или GUNICORN_WORKERS=1.'.format(
+                SERVER_WORKERS, ', '.join(local_caches)))
+
+HOME_FEED_SIZE = int(os.getenv('HOME_FEED_SIZE', 300))
+
+USER_STATE_VERSION_TIMEOUT = int(
+    os.getenv('USER_STATE_VERSION_TIMEOUT', 60 * 60 * 24 * 30))
+
+PAGINATION_COUNT_CACHE = (
+    os.getenv('PAGINATION_COUNT_CACHE', 'True').lower() == 'true')
+
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', 60 * 60))
+
+RECIPE_IMAGE_WIDTHS = [
+    int(width) for width
+    in os.getenv('RECIPE_IMAGE_WIDTHS', '320,640,1280').split(',')]
+
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', 80))
+
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024))
+
+RECIPE_IMAGE_SPOOL_SIZE = int(
+    os.getenv('RECIPE_IMAGE_SPOOL_SIZE', 1024 * 1024))
+
+# Асинхронные list и retrieve рецептов, тегов и ингредиентов
+# для запуска под ASGI (SERVER_MODE=asgi в gunicorn.conf.py).
+# Выключены по умолчанию: на замерах они не быстрее синхронных.
+ASYNC_READ_VIEWS = (
+    os.getenv('ASYNC_READ_VIEWS', 'False').lower() == 'true')
+
+REQUEST_PROFILING = (
+    os.getenv('REQUEST_PROFILING', 'False').lower() == 'true')
+
+REQUEST_PROFILING_SAMPLE_RATE = float(
+    os.getenv('REQUEST_PROFILING_SAMPLE_RATE', 1.0))
+
+REQUEST_PROFILING_SLOW_QUERY_MS = float(
+    os.getenv('REQUEST_PROFILING_SLOW_QUERY_MS', 100))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,28 @@
+"""
+Настройки gunicorn. Режим запуска задается SERVER_MODE:
+sync - синхронные процессы (по умолчанию), threads - процессы
+с потоками gthread, asgi - процессы uvicorn. Асинхронное чтение
+рецептов, тегов и ингредиентов под ASGI включается отдельно
+настройкой ASYNC_READ_VIEWS.
+"""
+import os
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'sync')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:9060')
+# Один процесс по умолчанию: без общего кеша (CACHE_BACKEND) версии
+# данных, ETag и ленты хранятся в памяти каждого процесса отдельно.
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif SERVER_MODE == 'threads':
+    wsgi_app = 'foodgram.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', 8))
+elif SERVER_MODE == 'sync':
+    wsgi_app = 'foodgram.wsgi:application'
+else:
+    raise ValueError(f'Неизвестный SERVER_MODE: {SERVER_MODE}')
@@ -40,13 +40,18 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author', 'tags')
     empty_value_display = 'Н/Д'
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(pk=form.instance.pk).refresh_tag_masks()
+
     @admin.display(description='Теги')
     def display_tags(self, obj):
         return ", ".join([tag.name for tag in obj.tags.all()])
 
-    @admin.display(description='В избранном')
+    @admin.display(description='В избранном',
+                   ordering='favorites_count')
     def in_favorites(self, obj):
-        return UserFavoriteRecipe.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
 
 @admin.register(Ingredient)
@@ -0,0 +1,53 @@
+import io
+import json
+import os
+import tarfile
+
+# Версия формата архива рецептов. Версия 2: manifest.json -
+# первый файл архива.
+ARCHIVE_VERSION = 2
+
+MANIFEST_MEMBER = 'manifest.json'
+TAGS_MEMBER = 'tags.ndjson'
+RECIPES_DIR = 'recipes/'
+IMAGES_DIR = 'images/'
+
+
+def recipes_member(number):
+    return f'{RECIPES_DIR}{number:06d}.ndjson'
+
+
+def image_member(recipe):
+    _, extension = os.path.splitext(recipe.image.name)
+    return f'{IMAGES_DIR}{recipe.pk}{extension.lower()}'
+
+
+def open_archive(path, mode):
+    """
+    Открывает архив в потоковом режиме; архивы .gz сжимаются.
+    """
+    if mode == 'w':
+        compressed = path.endswith(('.gz', '.tgz'))
+        return tarfile.open(path, 'w|gz' if compressed else 'w|')
+    return tarfile.open(path, 'r|*')
+
+
+def add_bytes(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+def add_json_lines(archive, name, records):
+    """
+    Добавляет в архив файл NDJSON: по одной записи JSON в строке.
+    """
+    add_bytes(archive, name, b''.join(
+        json.dumps(record, ensure_ascii=False).encode() + b'\n'
+        for record in records))
+
+
+def read_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
@@ -0,0 +1,108 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def new_version():
+    return f'{time.time():.3f}-{uuid.uuid4().hex}'
+
+
+def version_age(version):
+    """
+    Секунды с момента смены версии; для токена без времени - 0.
+    """
+    try:
+        changed = float(version.split('-', 1)[0])
+    except (AttributeError, ValueError):
+        return 0.0
+    return max(time.time() - changed, 0.0)
+
+
+class CacheVersion:
+    """
+    Версия набора данных в общем кеше (settings.REFERENCE_CACHE_ALIAS).
+    Версия - случайный токен: если ключ вытеснен из кеша,
+    новая версия не совпадет ни с одной из выданных ранее.
+    В начале токена - время смены версии (см. version_age).
+    """
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.version_key = f'reference:{name}:version'
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[settings.REFERENCE_CACHE_ALIAS]
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, new_version(),
+                           timeout=self.timeout)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def bump(self, **kwargs):
+        """
+        Помечает данные устаревшими во всех процессах.
+        """
+        self.cache.set(self.version_key, new_version(),
+                       timeout=self.timeout)
+
+    def bump_on_commit(self, **kwargs):
+        """
+        Меняет версию после фиксации текущей транзакции, чтобы
+        по новой версии не были прочитаны незафиксированные данные.
+        """
+        transaction.on_commit(self.bump)
+
+
+class ReferenceCache(CacheVersion):
+    """
+    Кеш справочной таблицы в памяти процесса.
+    Хранит производные от таблицы данные (готовый JSON, поисковый
+    индекс) вместе с версией, под которой они были построены.
+    Версия общая для всех воркеров: при ее смене
+    данные строятся заново.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = {}
+
+    def get(self, key, build):
+        """
+        Возвращает пару (версия, данные) для ключа key,
+        вызывая build() только если версия таблицы изменилась.
+        """
+        version = self.get_version()
+        with self._lock:
+            if self._version != version:
+                self._entries = {}
+                self._version = version
+            if key not in self._entries:
+                self._entries[key] = build()
+            return version, self._entries[key]
+
+
+def user_state_version(user_id):
+    """
+    Версия пользовательских отметок: избранного,
+    списка покупок и подписок.
+    """
+    return CacheVersion(f'user:{user_id}',
+                        timeout=settings.USER_STATE_VERSION_TIMEOUT)
+
+
+tags_cache = ReferenceCache('tags')
+ingredients_cache = ReferenceCache('ingredients')
+recipes_version = CacheVersion('recipes')
+popularity_version = CacheVersion('popularity')
+users_version = CacheVersion('users')
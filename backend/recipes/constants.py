@@ -2,3 +2,6 @@ MAX_LENGTH_NAME = 200
 MAX_LENGTH_MEASUREMENT_UNIT = 200
 MAX_LENGTH_SLUG = 200
 MAX_LENGTH_COLOR = 7
+# Тег с id N - бит N - 1 маски тегов рецепта (BigIntegerField,
+# знаковый бит не используется).
+TAG_MASK_BITS = 63
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from recipes.models import Recipe
+from users.models import Subscribe
+
+
+def get_feed_cache():
+    return caches[settings.HOME_FEED_CACHE_ALIAS]
+
+
+def feed_key(user_id):
+    return f'feed:{user_id}'
+
+
+def feed_queryset(user_id):
+    """
+    Id рецептов авторов, на которых подписан пользователь,
+    новые первыми: лента без кеша (fan-out on read).
+    """
+    return (
+        Recipe.objects.filter(author__subscribing__user=user_id)
+        .order_by('-pub_date', '-id')
+        .values_list('pk', flat=True)
+    )
+
+
+def build_feed_ids(user_id):
+    """
+    Собирает id последних рецептов ленты одним запросом
+    по индексу (author, pub_date).
+    """
+    return list(feed_queryset(user_id)[:settings.HOME_FEED_SIZE])
+
+
+def get_feed_ids(user_id):
+    """
+    Возвращает id рецептов ленты пользователя, новые первыми.
+    Лента строится при первом чтении и хранится в кеше
+    HOME_FEED_CACHE_ALIAS, который вытесняет давно
+    не читавшиеся ленты (LRU).
+    """
+    cache = get_feed_cache()
+    ids = cache.get(feed_key(user_id))
+    if ids is None:
+        ids = build_feed_ids(user_id)
+        cache.set(feed_key(user_id), ids)
+    return ids
+
+
+class FeedIds:
+    """
+    Id рецептов ленты для пагинатора. В кеше хранятся только
+    HOME_FEED_SIZE последних рецептов, поэтому страницы за его
+    пределами и общее количество берутся запросом к базе.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.cached = get_feed_ids(user_id)
+
+    @property
+    def is_complete(self):
+        # Неполная лента в кеше содержит все рецепты подписок.
+        return len(self.cached) < settings.HOME_FEED_SIZE
+
+    def count(self):
+        if self.is_complete:
+            return len(self.cached)
+        return feed_queryset(self.user_id).count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if (self.is_complete or index.stop is not None
+                and 0 <= index.stop <= len(self.cached)):
+            return self.cached[index]
+        return list(feed_queryset(self.user_id)[index])
+
+
+def followers_of(author_id):
+    return list(Subscribe.objects.filter(
+        author=author_id).values_list('user', flat=True))
+
+
+def push_to_feeds(recipe_id, user_ids):
+    """
+    Добавляет новый рецепт в начало уже построенных лент подписчиков.
+    Ленты, которых нет в кеше, соберутся при чтении.
+    """
+    cache = get_feed_cache()
+    feeds = cache.get_many([feed_key(user_id) for user_id in user_ids])
+    for key, ids in feeds.items():
+        if recipe_id not in ids:
+            feeds[key] = [recipe_id, *ids][:settings.HOME_FEED_SIZE]
+    if feeds:
+        cache.set_many(feeds)
+
+
+def drop_feeds(user_ids):
+    """
+    Удаляет ленты пользователей из кеша, чтобы
+    при следующем чтении они собрались заново.
+    """
+    get_feed_cache().delete_many(
+        [feed_key(user_id) for user_id in user_ids])
@@ -0,0 +1,142 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image
+
+from recipes.cache import recipes_version
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Формат в Pillow и расширение файла для каждого формата копий.
+IMAGE_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images')
+        return _executor
+
+
+def wait_for_derivatives():
+    """
+    Дожидается завершения поставленных в пул задач.
+    Следующая задача создаст новый пул.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def derivative_name(name, width, extension):
+    stem, _ = os.path.splitext(name)
+    return f'{stem}_{width}.{extension}'
+
+
+def build_derivatives(name):
+    """
+    Сохраняет рядом с оригиналом уменьшенные копии картинки
+    для каждой ширины из RECIPE_IMAGE_WIDTHS в форматах WebP и JPEG.
+    Возвращает словарь {формат: {ширина: имя файла}}.
+    """
+    with default_storage.open(name) as file:
+        original = Image.open(file)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    variants = {}
+    for width in sorted(settings.RECIPE_IMAGE_WIDTHS):
+        width = min(width, original.width)
+        if str(width) in variants.get('webp', {}):
+            break
+        resized = original.copy()
+        resized.thumbnail((width, original.height))
+        for key, (image_format, extension) in IMAGE_FORMATS.items():
+            image = resized
+            if image_format == 'JPEG':
+                image = resized.convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, image_format,
+                       quality=settings.RECIPE_IMAGE_QUALITY, optimize=True)
+            variant = derivative_name(name, width, extension)
+            if default_storage.exists(variant):
+                default_storage.delete(variant)
+            default_storage.save(variant, ContentFile(buffer.getvalue()))
+            variants.setdefault(key, {})[str(width)] = variant
+    return variants
+
+
+def delete_derivatives(variants):
+    """
+    Удаляет файлы копий из словаря image_variants.
+    """
+    for names in variants.values():
+        for name in names.values():
+            default_storage.delete(name)
+
+
+def generate_derivatives(recipe_id, name):
+    """
+    Строит копии картинки и сохраняет их список в рецепте,
+    если картинка рецепта за это время не сменилась,
+    иначе удаляет построенные копии.
+    """
+    variants = build_derivatives(name)
+    if Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=variants):
+        recipes_version.bump()
+    else:
+        delete_derivatives(variants)
+
+
+def generate_derivatives_in_worker(recipe_id, name):
+    close_old_connections()
+    try:
+        generate_derivatives(recipe_id, name)
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(recipe):
+    """
+    Ставит построение копий картинки рецепта в фоновый пул
+    после фиксации транзакции.
+    """
+    if not recipe.image:
+        return
+    recipe_id, name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: get_executor().submit(
+            generate_derivatives_in_worker, recipe_id, name))
+
+
+def replace_derivatives(recipe, previous_variants):
+    """
+    После фиксации транзакции со сменой картинки удаляет копии
+    прежней картинки и ставит в пул построение копий новой.
+    """
+    if previous_variants:
+        transaction.on_commit(partial(delete_derivatives, previous_variants))
+    schedule_derivatives(recipe)
@@ -0,0 +1,231 @@
+import csv
+import json
+import os
+import time
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+DATA_DIR = Path(__file__).resolve().parent / 'management' / 'commands' / 'data'
+
+FORMATS = ('csv', 'json')
+
+# Размер блока чтения JSON-файла, символов.
+JSON_CHUNK_SIZE = 1 << 16
+
+JSON_SEPARATORS = ' \t\r\n,'
+
+
+def read_csv(file):
+    yield from csv.reader(file)
+
+
+def split_json_items(decoder, buffer):
+    """
+    Выделяет из буфера все полностью прочитанные элементы массива.
+    Возвращает элементы и непрочитанный остаток буфера.
+    """
+    items, position = [], 0
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_SEPARATORS:
+            position += 1
+        if position == len(buffer) or buffer[position] == ']':
+            return items, buffer[position:]
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            return items, buffer[position:]
+        items.append(item)
+
+
+def read_json(file):
+    """
+    Потоково читает JSON-массив объектов или списков, не загружая
+    файл целиком: элементы разбираются из буфера по мере чтения.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON-файл должен содержать массив.')
+    buffer = buffer[1:]
+    while True:
+        items, buffer = split_json_items(decoder, buffer)
+        yield from items
+        chunk = file.read(JSON_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+    if buffer.strip() != ']':
+        raise CommandError('Ошибка в JSON-файле рядом с: {}'.format(
+            buffer[:100]))
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+class ImportCommand(BaseCommand):
+    """
+    Основа команд загрузки справочников из CSV или JSON.
+    Файл читается потоково блоками по --batch-size строк,
+    каждый блок сверяется с базой запросом по ключу key_fields:
+    новые строки добавляются многострочным INSERT, измененные
+    обновляются bulk_update, остальные пропускаются. Если ключ
+    составляют все поля, строки только добавляются.
+    Вся загрузка идет в одной транзакции.
+    """
+    model = None
+    # Порядок столбцов в CSV и ключи объектов в JSON.
+    fields = ()
+    # Поля уникального ограничения, по которому ищутся дубли.
+    key_fields = ()
+    default_file = None
+    reference_cache = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=str(DATA_DIR / self.default_file),
+            help='Путь к файлу с данными.')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Формат файла; по умолчанию определяется по расширению.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество строк в одном запросе к базе.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        data_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        if data_format not in READERS:
+            raise CommandError(
+                f'Неизвестный формат файла: {data_format or path}.')
+        self.stdout.write(f'Загрузка данных из {path}')
+        self.max_lengths = [
+            (name, self.model._meta.get_field(name).max_length)
+            for name in self.fields]
+        self.update_fields = [name for name in self.fields
+                              if name not in self.key_fields]
+        self.counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        started = time.monotonic()
+        try:
+            with open(path, newline='', encoding='utf-8') as file, \
+                    transaction.atomic():
+                batch = []
+                for row in READERS[data_format](file):
+                    batch.append(row)
+                    if len(batch) >= options['batch_size']:
+                        self.import_batch(batch)
+                        batch = []
+                if batch:
+                    self.import_batch(batch)
+        except FileNotFoundError:
+            raise CommandError(f'Файл {path} не найден.')
+        except IntegrityError as error:
+            raise CommandError(f'Загрузка отменена: {error}')
+        if self.reference_cache is not None:
+            self.reference_cache.bump()
+        self.stdout.write(self.style.SUCCESS(
+            'Готово за {:.1f} с: добавлено {inserted}, обновлено {updated}, '
+            'пропущено {skipped}.'.format(
+                time.monotonic() - started, **self.counts)))
+
+    def clean_row(self, row):
+        """
+        Приводит строку файла к словарю значений полей.
+        Возвращает None для неполной или слишком длинной строки.
+        """
+        if isinstance(row, dict):
+            values = [row.get(name) for name in self.fields]
+        elif isinstance(row, (list, tuple)) and len(row) == len(self.fields):
+            values = row
+        else:
+            return None
+        cleaned = {}
+        for (name, max_length), value in zip(self.max_lengths, values):
+            value = str(value or '').strip()
+            if not value or (max_length and len(value) > max_length):
+                return None
+            cleaned[name] = value
+        return cleaned
+
+    def fetch_existing(self, keys):
+        """
+        Возвращает словарь {ключ: (pk, значения остальных полей)}
+        для строк блока, которые уже есть в базе. Поиск идет по первому
+        полю ключа частями по ограничению базы на число параметров.
+        """
+        first_keys = list({key[0] for key in keys})
+        field = self.model._meta.get_field(self.key_fields[0])
+        size = connection.ops.bulk_batch_size([field], first_keys) or 1
+        existing = {}
+        width = len(self.key_fields)
+        sql = 'SELECT {} FROM {} WHERE {} IN ({{}})'.format(
+            ', '.join(map(self.column, (
+                self.model._meta.pk.name, *self.key_fields,
+                *self.update_fields))),
+            connection.ops.quote_name(self.model._meta.db_table),
+            self.column(field.name))
+        with connection.cursor() as cursor:
+            for start in range(0, len(first_keys), size):
+                chunk = first_keys[start:start + size]
+                cursor.execute(sql.format(', '.join(['%s'] * len(chunk))),
+                               chunk)
+                for pk, *values in cursor.fetchall():
+                    existing[tuple(values[:width])] = (pk, values[width:])
+        return existing
+
+    def column(self, name):
+        return connection.ops.quote_name(
+            self.model._meta.get_field(name).column)
+
+    def insert(self, rows):
+        """
+        Добавляет строки многострочными INSERT без создания
+        экземпляров моделей: для миллионов строк это основная
+        часть времени загрузки.
+        """
+        fields = [self.model._meta.get_field(name) for name in self.fields]
+        size = connection.ops.bulk_batch_size(fields, rows) or 1
+        sql = 'INSERT INTO {} ({}) VALUES {{}}'.format(
+            connection.ops.quote_name(self.model._meta.db_table),
+            ', '.join(map(self.column, self.fields)))
+        placeholder = '({})'.format(', '.join(['%s'] * len(self.fields)))
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), size):
+                chunk = rows[start:start + size]
+                cursor.execute(
+                    sql.format(', '.join([placeholder] * len(chunk))),
+                    [row[name] for row in chunk for name in self.fields])
+
+    def import_batch(self, rows):
+        values = {}
+        for row in rows:
+            cleaned = self.clean_row(row)
+            if cleaned is None:
+                self.counts['skipped'] += 1
+                continue
+            key = tuple(cleaned[name] for name in self.key_fields)
+            if key in values:
+                self.counts['skipped'] += 1
+            values[key] = cleaned
+        existing = self.fetch_existing(values)
+        to_create, to_update = [], []
+        for key, row in values.items():
+            if key not in existing:
+                to_create.append(row)
+                continue
+            pk, current = existing[key]
+            if (self.update_fields
+                    and current != [row[name]
+                                    for name in self.update_fields]):
+                to_update.append(self.model(pk=pk, **row))
+            else:
+                self.counts['skipped'] += 1
+        self.insert(to_create)
+        if to_update:
+            self.model.objects.bulk_update(to_update, self.update_fields)
+        self.counts['inserted'] += len(to_create)
+        self.counts['updated'] += len(to_update)
+        self.stdout.write('Обработано строк: {}.'.format(
+            sum(self.counts.values())))
@@ -0,0 +1,59 @@
+import random
+import time
+
+import numpy as np
+from django.core.management import BaseCommand
+
+from recipes.pantry import PantryIndex
+
+
+class Command(BaseCommand):
+    help = ('Замеряет подбор рецептов по продуктам '
+            'на синтетических данных без обращения к базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=500000)
+        parser.add_argument('--ingredients', type=int, default=2200)
+        parser.add_argument('--per-recipe', type=int, default=10,
+                            help='Среднее число ингредиентов в рецепте.')
+        parser.add_argument('--pantry', type=int, default=15,
+                            help='Число продуктов в запросе.')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = np.random.default_rng(options['seed'])
+        recipes = options['recipes']
+        ingredients = options['ingredients']
+        # Популярность ингредиентов убывает по закону Ципфа,
+        # как у соли и сахара по сравнению с редкими специями.
+        weights = 1 / np.arange(1, ingredients + 1)
+        weights /= weights.sum()
+        sizes = generator.poisson(options['per_recipe'] - 1, recipes) + 1
+        links = np.column_stack((
+            generator.choice(ingredients, sizes.sum(), p=weights) + 1,
+            np.repeat(np.arange(1, recipes + 1), sizes),
+        ))
+        links = np.unique(links, axis=0)
+
+        index = PantryIndex()
+        started = time.perf_counter()
+        index.load(np.arange(1, recipes + 1), links)
+        self.stdout.write('Сборка индекса: {:.0f} мс, связей: {}.'.format(
+            (time.perf_counter() - started) * 1000, len(links)))
+
+        picker = random.Random(options['seed'])
+        timings = []
+        for _ in range(options['repeat']):
+            pantry = picker.sample(
+                range(1, ingredients + 1), options['pantry'])
+            started = time.perf_counter()
+            matches = index.match(pantry)
+            matches[:6]
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            'Подбор: медиана {:.1f} мс, p95 {:.1f} мс, '
+            'последний результат: {} рецептов.'.format(
+                timings[len(timings) // 2],
+                timings[int(len(timings) * 0.95)], len(matches)))
@@ -0,0 +1,34 @@
+from django.core.management import BaseCommand
+
+from recipes.similarity import (
+    build_arrays, load_arrays, read_current, save_arrays, update_arrays,
+)
+
+
+class Command(BaseCommand):
+    help = ('Собирает индекс близости рецептов по ингредиентам '
+            '(TF-IDF) в каталоге RECIPE_SIMILARITY_DIR.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Только перенести в текущий индекс новые, измененные '
+                 'и удаленные рецепты с прежними IDF.')
+
+    def handle(self, *args, **options):
+        build = read_current()
+        arrays = load_arrays(build) if options['incremental'] and build else {}
+        if 'synced_at' in arrays:
+            arrays, updated, deleted = update_arrays(arrays)
+            if not updated and not deleted:
+                self.stdout.write('Изменений нет.')
+                return
+            save_arrays(arrays)
+            self.stdout.write(
+                f'Добавлено и изменено рецептов: {updated}, '
+                f'удалено: {deleted}.')
+            return
+        arrays = build_arrays()
+        save_arrays(arrays)
+        self.stdout.write('Проиндексировано рецептов: {}.'.format(
+            len(arrays['recipe_ids'])))
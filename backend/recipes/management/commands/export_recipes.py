@@ -0,0 +1,109 @@
+import json
+import tarfile
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+from django.db.models import Prefetch
+
+from recipes.archive import (
+    ARCHIVE_VERSION, MANIFEST_MEMBER, TAGS_MEMBER, add_bytes,
+    add_json_lines, image_member, open_archive, recipes_member,
+)
+from recipes.models import Recipe, RecipeIngredientLink, Tag
+
+
+class Command(BaseCommand):
+    help = ('Выгружает рецепты с тегами, ингредиентами и картинками '
+            'в архив tar (NDJSON и каталог картинок).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл архива: .tar или .tar.gz.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Количество рецептов в одном файле NDJSON архива.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = images = 0
+        with open_archive(options['path'], 'w') as archive:
+            # Манифест - первый файл архива: загрузка читает архив
+            # потоком и проверяет версию до загрузки рецептов.
+            add_bytes(archive, MANIFEST_MEMBER, json.dumps({
+                'version': ARCHIVE_VERSION,
+                'recipes': Recipe.objects.count(),
+            }).encode())
+            add_json_lines(archive, TAGS_MEMBER, (
+                {'name': tag.name, 'color': tag.color, 'slug': tag.slug}
+                for tag in Tag.objects.order_by('pk')))
+            for number, batch in enumerate(
+                    self.iter_batches(options['batch_size']), start=1):
+                files = {}
+                for recipe in batch:
+                    if recipe.image and default_storage.exists(
+                            recipe.image.name):
+                        files[recipe.pk] = image_member(recipe)
+                add_json_lines(archive, recipes_member(number), (
+                    self.serialize(recipe, files.get(recipe.pk))
+                    for recipe in batch))
+                for recipe in batch:
+                    if recipe.pk in files:
+                        self.add_image(archive, recipe, files[recipe.pk])
+                count += len(batch)
+                images += len(files)
+                self.report(count, started)
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {count}, картинок: {images}.'))
+
+    def iter_batches(self, batch_size):
+        """
+        Рецепты блоками по первичному ключу: в памяти
+        одновременно не больше одного блока.
+        """
+        recipes = Recipe.objects.order_by('pk').select_related(
+            'author').prefetch_related(
+                'tags',
+                Prefetch('ingredients',
+                         queryset=RecipeIngredientLink.objects.select_related(
+                             'ingredient')))
+        last_pk = 0
+        while True:
+            batch = list(recipes.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def serialize(self, recipe, image):
+        author = recipe.author
+        return {
+            'id': recipe.pk,
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'pub_date': recipe.pub_date.isoformat(),
+            'image': image,
+            'author': {
+                'email': author.email,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+            },
+            'tags': [tag.slug for tag in recipe.tags.all()],
+            'ingredients': [{
+                'name': link.ingredient.name,
+                'measurement_unit': link.ingredient.measurement_unit,
+                'amount': link.amount,
+            } for link in recipe.ingredients.all()],
+        }
+
+    def add_image(self, archive, recipe, name):
+        info = tarfile.TarInfo(name)
+        info.size = recipe.image.size
+        with default_storage.open(recipe.image.name, 'rb') as file:
+            archive.addfile(info, file)
+
+    def report(self, count, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write('Выгружено рецептов: {} ({:.0f} в секунду).'.format(
+            count, count / elapsed if elapsed else count))
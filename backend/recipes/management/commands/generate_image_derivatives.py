@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+
+from recipes.images import generate_derivatives
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии картинок рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Только для рецептов без готовых копий.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if options['missing']:
+            recipes = recipes.filter(image_variants={})
+        count = 0
+        for recipe_id, name in recipes.values_list(
+                'pk', 'image').iterator():
+            generate_derivatives(recipe_id, name)
+            count += 1
+        self.stdout.write(f'Обработано картинок: {count}.')
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from recipes.archive import (
+    ARCHIVE_VERSION, IMAGES_DIR, MANIFEST_MEMBER, RECIPES_DIR, TAGS_MEMBER,
+    open_archive, read_json_lines,
+)
+from recipes.cache import ingredients_cache, recipes_version, tags_cache
+from recipes.feed import drop_feeds
+from recipes.images import schedule_derivatives, wait_for_derivatives
+from recipes.models import (
+    ImportedRecipeBatch, Ingredient, Recipe, RecipeIngredientLink, Tag,
+    tag_mask,
+)
+from recipes.search import update_recipe_documents
+from users.models import Subscribe, User
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты из архива export_recipes. Каждый файл '
+            'NDJSON архива загружается отдельной транзакцией вместе '
+            'с отметкой в таблице загруженных блоков, поэтому прерванную '
+            'загрузку можно продолжить повторным запуском.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл архива.')
+
+    def handle(self, *args, **options):
+        self.ingredients = {
+            (name, unit): pk for pk, name, unit
+            in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit').iterator()}
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+        self.authors = {}
+        self.created_ingredients = False
+        self.started = time.monotonic()
+        self.count = 0
+        pending = number = None
+        try:
+            with open_archive(options['path'], 'r') as archive:
+                for number, member in enumerate(archive):
+                    if number == 0:
+                        self.check_manifest(member, archive)
+                    elif member.name == TAGS_MEMBER:
+                        self.import_tags(archive.extractfile(member))
+                    elif member.name.startswith(RECIPES_DIR):
+                        self.flush(pending)
+                        pending = self.start_batch(member, archive)
+                    elif member.name.startswith(IMAGES_DIR):
+                        self.save_image(pending, member, archive)
+                if number is None:
+                    raise CommandError('Архив пуст.')
+                self.flush(pending)
+        except FileNotFoundError:
+            raise CommandError(f'Файл {options["path"]} не найден.')
+        finally:
+            # Копии картинок строятся в фоновом пуле, который
+            # не должен завершиться вместе с командой.
+            wait_for_derivatives()
+            if self.created_ingredients:
+                ingredients_cache.bump()
+            tags_cache.bump()
+            recipes_version.bump()
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {self.count}.'))
+
+    def check_manifest(self, member, archive):
+        """
+        Архив читается потоком, поэтому версия формата проверяется
+        по первому файлу до загрузки рецептов.
+        """
+        if member.name != MANIFEST_MEMBER:
+            raise CommandError(
+                f'Первый файл архива - {member.name}, а не '
+                f'{MANIFEST_MEMBER}: архив выгружен не export_recipes '
+                'или старой версией.')
+        try:
+            manifest = json.load(archive.extractfile(member))
+        except ValueError:
+            manifest = None
+        if not isinstance(manifest, dict):
+            raise CommandError(f'Неверный {MANIFEST_MEMBER}.')
+        if manifest.get('version') != ARCHIVE_VERSION:
+            raise CommandError(
+                f'Неподдерживаемая версия архива: {manifest.get("version")}.')
+
+    def import_tags(self, file):
+        """
+        Создает теги архива с новыми слагами. Тег, название и цвет
+        которого уже заняты тегом с другим слагом, не создается:
+        его рецепты получают существующий тег.
+        """
+        records = [record for record in read_json_lines(file)
+                   if record['slug'] not in self.tags]
+        existing = {
+            (name, color): slug for name, color, slug
+            in Tag.objects.filter(
+                name__in={record['name'] for record in records}
+            ).values_list('name', 'color', 'slug')}
+        aliases, tags = {}, []
+        for record in records:
+            key = (record['name'], record['color'])
+            if key in existing:
+                aliases[record['slug']] = existing[key]
+                self.stdout.write(self.style.WARNING(
+                    f'Тег {record["slug"]} совпадает по названию и цвету '
+                    f'с тегом {existing[key]}: рецептам назначается '
+                    f'тег {existing[key]}.'))
+            else:
+                existing[key] = record['slug']
+                tags.append(Tag(name=record['name'], color=record['color'],
+                                slug=record['slug']))
+        Tag.objects.bulk_create(tags)
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+        self.tags.update((alias, self.tags[slug])
+                         for alias, slug in aliases.items())
+
+    def start_batch(self, member, archive):
+        """
+        Читает файл NDJSON с блоком рецептов. Уже загруженные
+        блоки (по контрольной сумме файла) пропускаются вместе
+        с картинками.
+        """
+        data = archive.extractfile(member).read()
+        checksum = hashlib.sha256(data).hexdigest()
+        if ImportedRecipeBatch.objects.filter(checksum=checksum).exists():
+            self.stdout.write(f'Пропущен загруженный блок {member.name}.')
+            return None
+        records = list(read_json_lines(data.splitlines()))
+        return {
+            'name': member.name,
+            'checksum': checksum,
+            'records': records,
+            'images': {record['image']: None for record in records
+                       if record.get('image')},
+        }
+
+    def save_image(self, pending, member, archive):
+        if pending is None or member.name not in pending['images']:
+            return
+        name = 'recipes/' + os.path.basename(member.name)
+        pending['images'][member.name] = default_storage.save(
+            name, archive.extractfile(member))
+
+    def resolve_authors(self, records):
+        authors = {record['author']['email']: record['author']
+                   for record in records
+                   if record['author']['email'] not in self.authors}
+        if not authors:
+            return
+        self.authors.update(User.objects.filter(
+            email__in=authors).values_list('email', 'pk'))
+        missing = [author for email, author in authors.items()
+                   if email not in self.authors]
+        users = [User(**author) for author in missing]
+        for user in users:
+            user.set_unusable_password()
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        self.authors.update(User.objects.filter(
+            email__in=authors).values_list('email', 'pk'))
+        for email in authors:
+            if email not in self.authors:
+                raise CommandError(
+                    f'Не удалось создать автора {email}: '
+                    'имя пользователя уже занято.')
+
+    def resolve_ingredients(self, records):
+        missing = {
+            (item['name'], item['measurement_unit'])
+            for record in records for item in record['ingredients']
+        } - self.ingredients.keys()
+        if not missing:
+            return
+        Ingredient.objects.bulk_create([
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in missing], ignore_conflicts=True)
+        for pk, name, unit in Ingredient.objects.filter(
+                name__in={name for name, _ in missing}).values_list(
+                    'pk', 'name', 'measurement_unit'):
+            self.ingredients[(name, unit)] = pk
+        self.created_ingredients = True
+
+    def create_recipes(self, recipes):
+        """
+        Создает рецепты одним запросом, если база возвращает
+        первичные ключи из bulk_create, иначе по одному.
+        Дата публикации из архива сохраняется отдельным
+        bulk_update: при создании ее заменяет auto_now_add.
+        """
+        pub_dates = [recipe.pub_date for recipe in recipes]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        for recipe, pub_date in zip(recipes, pub_dates):
+            recipe.pub_date = pub_date
+        Recipe.objects.bulk_update(recipes, ['pub_date'])
+
+    def flush(self, batch):
+        if batch is None:
+            return
+        records = batch['records']
+        with transaction.atomic():
+            self.resolve_authors(records)
+            self.resolve_ingredients(records)
+            recipes = [Recipe(
+                author_id=self.authors[record['author']['email']],
+                name=record['name'],
+                text=record['text'],
+                cooking_time=record['cooking_time'],
+                pub_date=parse_datetime(record['pub_date']),
+                image=batch['images'].get(record.get('image')) or '',
+                tag_mask=tag_mask(self.tags[slug] for slug in record['tags']
+                                  if slug in self.tags),
+            ) for record in records]
+            self.create_recipes(recipes)
+            links, tags = [], []
+            for recipe, record in zip(recipes, records):
+                amounts = {
+                    self.ingredients[(item['name'],
+                                      item['measurement_unit'])]:
+                    item['amount'] for item in record['ingredients']}
+                links += [RecipeIngredientLink(
+                    recipe=recipe, ingredient_id=ingredient, amount=amount)
+                    for ingredient, amount in amounts.items()]
+                tags += [Recipe.tags.through(
+                    recipe_id=recipe.pk, tag_id=self.tags[slug])
+                    for slug in set(record['tags']) if slug in self.tags]
+            RecipeIngredientLink.objects.bulk_create(links)
+            Recipe.tags.through.objects.bulk_create(tags)
+            update_recipe_documents([recipe.pk for recipe in recipes])
+            # Отметка о блоке фиксируется вместе с рецептами:
+            # после сбоя блок либо загружен целиком, либо
+            # загрузится заново.
+            ImportedRecipeBatch.objects.create(
+                checksum=batch['checksum'], member=batch['name'],
+                recipes=len(recipes))
+            for recipe in recipes:
+                schedule_derivatives(recipe)
+        drop_feeds(Subscribe.objects.filter(
+            author__in={recipe.author_id for recipe in recipes}
+        ).values_list('user', flat=True))
+        self.count += len(recipes)
+        elapsed = time.monotonic() - self.started
+        self.stdout.write('Загружено рецептов: {} ({:.0f} в секунду).'.format(
+            self.count, self.count / elapsed if elapsed else self.count))
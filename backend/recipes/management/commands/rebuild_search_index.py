@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import update_recipe_documents
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковые документы всех рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество рецептов в одном запросе.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        for start in range(0, len(ids), batch_size):
+            update_recipe_documents(ids[start:start + batch_size])
+        self.stdout.write(f'Проиндексировано рецептов: {len(ids)}.')
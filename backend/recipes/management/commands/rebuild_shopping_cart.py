@@ -0,0 +1,56 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCartItem
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает денормализованные списки покупок '
+            'и сверяет их с суммами, посчитанными по рецептам.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сверить данные, ничего не изменяя.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Размер пакета при вставке строк.')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            self.rebuild(options['batch_size'])
+        mismatches = self.verify()
+        if mismatches:
+            raise CommandError(
+                f'Найдено расхождений: {mismatches}.')
+        self.stdout.write(self.style.SUCCESS(
+            'Списки покупок совпадают с рецептами.'))
+
+    @transaction.atomic
+    def rebuild(self, batch_size):
+        ShoppingCartItem.objects.all().delete()
+        batch = []
+        created = 0
+        for user_id, ingredient_id, total_amount in (
+                ShoppingCartItem.objects.live_totals().iterator()):
+            batch.append(ShoppingCartItem(user_id=user_id,
+                                          ingredient_id=ingredient_id,
+                                          total_amount=total_amount))
+            if len(batch) >= batch_size:
+                ShoppingCartItem.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        ShoppingCartItem.objects.bulk_create(batch)
+        created += len(batch)
+        self.stdout.write(f'Создано позиций: {created}.')
+
+    def verify(self):
+        """
+        Сравнивает таблицу с суммами, посчитанными по рецептам.
+        Скорость выгрузки обоими способами замеряет
+        benchmark_shopping_cart.
+        """
+        live = set(ShoppingCartItem.objects.live_totals())
+        stored = set(ShoppingCartItem.objects.values_list(
+            'user', 'ingredient', 'total_amount'))
+        return len(live ^ stored)
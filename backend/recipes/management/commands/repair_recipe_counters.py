@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from recipes.cache import popularity_version
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счетчики избранного и списков покупок рецептов '
+            'с фактическими данными и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить счетчики, ничего не изменяя.')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        broken = Recipe.objects.with_real_counters().exclude(
+            favorites_count=F('real_favorites_count'),
+            shopping_cart_count=F('real_shopping_cart_count'),
+        ).values_list('pk', 'real_favorites_count',
+                      'real_shopping_cart_count')
+        broken = list(broken)
+        if options['check']:
+            if broken:
+                raise CommandError(
+                    f'Неверные счетчики у рецептов: {len(broken)}.')
+            self.stdout.write(self.style.SUCCESS('Счетчики в порядке.'))
+            return
+        Recipe.objects.bulk_update(
+            [Recipe(pk=pk, favorites_count=favorites_count,
+                    shopping_cart_count=shopping_cart_count)
+             for pk, favorites_count, shopping_cart_count in broken],
+            ['favorites_count', 'shopping_cart_count'],
+            batch_size=1000
+        )
+        if broken:
+            popularity_version.bump_on_commit()
+        self.stdout.write(f'Исправлено рецептов: {len(broken)}.')
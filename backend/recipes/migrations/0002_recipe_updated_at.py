@@ -0,0 +1,29 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:24
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(upload_to='recipes/', verbose_name='Картинка'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='name',
+            field=models.CharField(max_length=200, validators=[django.core.validators.RegexValidator('^[A-Za-zА-Яа-я\\s]+$', 'Разрешены только буквы и пробелы.')], verbose_name='Название'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:25
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_shopping_cart_items(apps, schema_editor):
+    RecipeIngredientLink = apps.get_model('recipes', 'RecipeIngredientLink')
+    ShoppingCartItem = apps.get_model('recipes', 'ShoppingCartItem')
+    totals = RecipeIngredientLink.objects.filter(
+        recipe__usershoppingcart__isnull=False
+    ).values(
+        'recipe__usershoppingcart__user', 'ingredient'
+    ).annotate(
+        total_amount=Sum('amount')
+    ).values_list(
+        'recipe__usershoppingcart__user', 'ingredient', 'total_amount'
+    ).order_by()
+    ShoppingCartItem.objects.bulk_create(
+        [ShoppingCartItem(user_id=user_id, ingredient_id=ingredient_id,
+                          total_amount=total_amount)
+         for user_id, ingredient_id, total_amount in totals],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0002_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(verbose_name='Общее количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Позиции списка покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_cart_item'),
+        ),
+        migrations.RunPython(fill_shopping_cart_items,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+CREATE_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_prefix_idx '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm_idx '
+    'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+)
+
+DROP_INDEXES = (
+    'DROP INDEX IF EXISTS recipes_ingredient_name_trgm_idx',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_prefix_idx',
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in CREATE_INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in DROP_INDEXES:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_shoppingcartitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_ingredient_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'),
+        ),
+    ]
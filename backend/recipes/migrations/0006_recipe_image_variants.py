@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Уменьшенные копии картинки'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    counters = {
+        'favorites_count': apps.get_model('recipes', 'UserFavoriteRecipe'),
+        'shopping_cart_count': apps.get_model('recipes', 'UserShoppingCart'),
+    }
+    Recipe.objects.update(**{
+        field: Coalesce(Subquery(
+            model.objects.filter(recipe=OuterRef('pk')).values(
+                'recipe').annotate(count=Count('pk')).values('count')
+        ), 0)
+        for field, model in counters.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date'], name='recipe_popularity_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
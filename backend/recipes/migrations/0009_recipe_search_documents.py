@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db import migrations
+
+POSTGRES_CREATE = (
+    'ALTER TABLE recipes_recipe '
+    'ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    """
+    UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector(%(config)s, name), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_recipeingredientlink link
+            JOIN recipes_ingredient ingredient
+                ON ingredient.id = link.ingredient_id
+            WHERE link.recipe_id = recipes_recipe.id), '')), 'B')
+        || setweight(to_tsvector(%(config)s, text), 'C')
+    """,
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+
+POSTGRES_DROP = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_idx',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+SQLITE_CREATE = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts USING fts5('
+    'name, ingredients, text, tokenize="unicode61 remove_diacritics 2")',
+    """
+    INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text)
+    SELECT recipe.id, recipe.name,
+        coalesce(group_concat(ingredient.name, ' '), ''), recipe.text
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_recipeingredientlink link
+        ON link.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = link.ingredient_id
+    GROUP BY recipe.id
+    """,
+)
+
+SQLITE_DROP = (
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+)
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        # Конфигурация та же, что у поиска рецептов.
+        params = ({'config': settings.RECIPE_SEARCH_CONFIG}
+                  if vendor == 'postgresql' else None)
+        for sql in statements.get(vendor, ()):
+            schema_editor.execute(sql, params)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_author_pub_date_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'postgresql': POSTGRES_CREATE, 'sqlite': SQLITE_CREATE}),
+            run({'postgresql': POSTGRES_DROP, 'sqlite': SQLITE_DROP}),
+        ),
+    ]
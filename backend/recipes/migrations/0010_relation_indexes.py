@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+# Промежуточная таблица тегов создается Django, индексы для нее
+# задаются SQL. (tag_id, recipe_id) - фильтр ?tags= читает рецепты
+# тега только по индексу.
+CREATE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_tags_tag_recipe_idx '
+    'ON recipes_recipe_tags (tag_id, recipe_id)',
+)
+
+DROP_INDEXES = (
+    'DROP INDEX IF EXISTS recipes_recipe_tags_tag_recipe_idx',
+)
+
+
+def create_tag_indexes(apps, schema_editor):
+    for sql in CREATE_INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_tag_indexes(apps, schema_editor):
+    for sql in DROP_INDEXES:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_search_documents'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipeingredientlink',
+            index=models.Index(fields=['recipe', 'ingredient'], include=('amount',), name='recipe_link_amount_idx'),
+        ),
+        migrations.RunPython(create_tag_indexes, drop_tag_indexes),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+from recipes.constants import TAG_MASK_BITS
+
+
+def fill_tag_masks(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Tag = apps.get_model('recipes', 'Tag')
+    for tag_id in Tag.objects.filter(
+            pk__lte=TAG_MASK_BITS).values_list('pk', flat=True):
+        Recipe.objects.filter(tags=tag_id).update(
+            tag_mask=F('tag_mask').bitor(1 << (tag_id - 1)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_relation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.RunPython(fill_tag_masks, migrations.RunPython.noop),
+    ]
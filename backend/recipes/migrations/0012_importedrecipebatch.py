@@ -0,0 +1,27 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_tag_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedRecipeBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 файла блока')),
+                ('member', models.CharField(max_length=255, verbose_name='Файл в архиве')),
+                ('recipes', models.PositiveIntegerField(verbose_name='Количество рецептов')),
+                ('imported_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')),
+            ],
+            options={
+                'verbose_name': 'Загруженный блок рецептов',
+                'verbose_name_plural': 'Загруженные блоки рецептов',
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_importedrecipebatch'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_popularity_idx',
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popularity_idx'),
+        ),
+    ]
@@ -1,13 +1,21 @@
+from collections import defaultdict
+
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    BooleanField, Count, Exists, F, OuterRef, Prefetch, Subquery, Sum, Value,
+    Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, RowNumber
 
 from recipes.constants import (
     MAX_LENGTH_NAME,
     MAX_LENGTH_MEASUREMENT_UNIT,
     MAX_LENGTH_SLUG,
-    MAX_LENGTH_COLOR)
+    MAX_LENGTH_COLOR,
+    TAG_MASK_BITS)
 from recipes.validators import hex_validator
-from users.models import User
+from users.models import Subscribe, User
 from users.validators import regex_name_validator
 
 
@@ -72,6 +80,143 @@ class Tag(models.Model):
         return self.name
 
 
+def tag_mask(tag_ids):
+    """
+    Битовая маска тегов: тегу с id N соответствует бит N - 1.
+    Теги с id больше TAG_MASK_BITS в маску не входят.
+    """
+    mask = 0
+    for tag_id in tag_ids:
+        if 0 < tag_id <= TAG_MASK_BITS:
+            mask |= 1 << (tag_id - 1)
+    return mask
+
+
+class RecipeQuerySet(models.QuerySet):
+    """
+    Набор запросов для рецептов с оптимизированной загрузкой
+    связанных объектов и пользовательских флагов.
+    """
+
+    def with_tags(self, tag_ids, match_all=False):
+        """
+        Рецепты с любым из тегов, с match_all - со всеми тегами.
+        Проверяется маска tag_mask, без соединения с таблицей тегов
+        и DISTINCT. Теги вне маски ищутся соединением.
+        """
+        tag_ids = set(tag_ids)
+        if not tag_ids:
+            return self
+        if max(tag_ids) > TAG_MASK_BITS:
+            if not match_all:
+                return self.filter(tags__in=tag_ids).distinct()
+            queryset = self
+            for tag_id in tag_ids:
+                queryset = queryset.filter(tags=tag_id)
+            return queryset
+        mask = tag_mask(tag_ids)
+        queryset = self.alias(tag_bits=F('tag_mask').bitand(mask))
+        if match_all:
+            return queryset.filter(tag_bits=mask)
+        return queryset.filter(tag_bits__gt=0)
+
+    def refresh_tag_masks(self):
+        """
+        Пересчитывает маски тегов рецептов по таблице тегов.
+        Нужен после записи в нее в обход сериализатора.
+        """
+        through = self.model.tags.through
+        tag_ids = defaultdict(list)
+        for recipe_id, tag_id in through.objects.filter(
+                recipe__in=self.values('pk')).values_list(
+                    'recipe_id', 'tag_id'):
+            tag_ids[recipe_id].append(tag_id)
+        self.model.objects.bulk_update(
+            [self.model(pk=pk, tag_mask=tag_mask(tag_ids[pk]))
+             for pk in self.values_list('pk', flat=True)],
+            ['tag_mask'], batch_size=1000)
+
+    @staticmethod
+    def related_lookups(user):
+        """
+        Независимые друг от друга подгрузки автора, тегов
+        и ингредиентов. Для авторизованного пользователя автор
+        аннотируется флагом is_subscribed.
+        """
+        authors = User.objects.all()
+        if user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('pk'))))
+        return [
+            Prefetch('author', queryset=authors),
+            Prefetch('tags'),
+            Prefetch('ingredients',
+                     queryset=RecipeIngredientLink.objects.select_related(
+                         'ingredient')),
+        ]
+
+    def with_related(self, user):
+        """
+        Подгружает автора, теги и ингредиенты фиксированным числом
+        запросов.
+        """
+        return self.prefetch_related(*self.related_lookups(user))
+
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты флагами is_favorited и is_in_shopping_cart
+        для текущего пользователя.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(UserFavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(UserShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def with_real_counters(self):
+        """
+        Аннотирует рецепты фактическим числом добавлений
+        в избранное и в списки покупок.
+        """
+        return self.annotate(
+            real_favorites_count=Coalesce(Subquery(
+                UserFavoriteRecipe.objects.filter(
+                    recipe=OuterRef('pk')
+                ).values('recipe').annotate(
+                    count=Count('pk')).values('count')
+            ), 0),
+            real_shopping_cart_count=Coalesce(Subquery(
+                UserShoppingCart.objects.filter(
+                    recipe=OuterRef('pk')
+                ).values('recipe').annotate(
+                    count=Count('pk')).values('count')
+            ), 0),
+        )
+
+    def latest_per_author(self, limit):
+        """
+        Оставляет не более limit последних рецептов каждого автора.
+        Нумерация внутри автора считается одним оконным запросом
+        ROW_NUMBER() OVER (PARTITION BY author_id).
+        """
+        ranked = self.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=F('pub_date').desc(),
+        )).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.model.objects.filter(pk__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.row_number <= %s',
+            (*params, limit)))
+
+
 class Recipe(models.Model):
     """
     Основная модель для хранения рецептов.
@@ -95,10 +240,20 @@ class Recipe(models.Model):
         'Картинка',
         upload_to='recipes/',
     )
+    image_variants = models.JSONField(
+        'Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False
+    )
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -109,11 +264,36 @@ class Recipe(models.Model):
         Tag,
         verbose_name='Теги'
     )
+    tag_mask = models.BigIntegerField(
+        'Маска тегов',
+        default=0,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date', '-id'],
+                         name='recipe_popularity_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -151,6 +331,11 @@ class RecipeIngredientLink(models.Model):
                 name='unique_combination'
             )
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'ingredient'],
+                         include=['amount'],
+                         name='recipe_link_amount_idx'),
+        ]
 
     def __str__(self):
         return (f'{self.recipe.name}: '
@@ -219,3 +404,169 @@ class UserShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.recipe.name}'
+
+
+class PendingCartRefresh:
+    """
+    Пересчет списков покупок, отложенный до фиксации транзакции.
+    Изменения рецептов одной транзакции объединяются в один
+    refresh: пользователи - заданные явно и владельцы корзин
+    с рецептами recipes на момент фиксации, ингредиенты - все
+    затронутые (None - все ингредиенты).
+    """
+
+    def __init__(self):
+        self.users = set()
+        self.recipes = set()
+        self.ingredients = set()
+        self.done = False
+
+    def add(self, users=(), recipes=(), ingredients=None):
+        self.users.update(users)
+        self.recipes.update(recipes)
+        if ingredients is None or self.ingredients is None:
+            self.ingredients = None
+        else:
+            self.ingredients.update(ingredients)
+
+    def __call__(self):
+        self.done = True
+        users = self.users | set(UserShoppingCart.objects.filter(
+            recipe__in=self.recipes).values_list('user', flat=True))
+        if users:
+            ShoppingCartItem.objects.refresh(users, self.ingredients)
+
+
+class ShoppingCartItemQuerySet(models.QuerySet):
+    """
+    Набор запросов для денормализованного списка покупок.
+    """
+
+    def refresh_on_commit(self, users=(), recipes=(), ingredients=None):
+        """
+        Пересчитывает позиции после фиксации текущей транзакции.
+        Повторные вызовы в той же транзакции дополняют уже
+        запланированный пересчет (PendingCartRefresh).
+        """
+        connection = transaction.get_connection(self.db)
+        pending = next((callback for _, callback in connection.run_on_commit
+                        if isinstance(callback, PendingCartRefresh)
+                        and not callback.done), None)
+        if pending is None:
+            pending = PendingCartRefresh()
+            pending.add(users, recipes, ingredients)
+            transaction.on_commit(pending, using=self.db)
+        else:
+            pending.add(users, recipes, ingredients)
+
+    def live_totals(self, users=None):
+        """
+        Суммы ингредиентов в корзинах, посчитанные по рецептам.
+        """
+        # Одно условие на корзину: второй вызов filter() по связи
+        # многие-ко-многим добавил бы второе соединение, и суммы
+        # умножились бы на число корзин с рецептом.
+        if users is None:
+            links = RecipeIngredientLink.objects.filter(
+                recipe__usershoppingcart__isnull=False)
+        else:
+            links = RecipeIngredientLink.objects.filter(
+                recipe__usershoppingcart__user__in=users)
+        return links.values(
+            'recipe__usershoppingcart__user', 'ingredient'
+        ).annotate(
+            total_amount=Sum('amount')
+        ).values_list(
+            'recipe__usershoppingcart__user', 'ingredient', 'total_amount'
+        ).order_by()
+
+    @transaction.atomic
+    def refresh(self, users, ingredients=None):
+        """
+        Пересчитывает позиции списка покупок пользователей
+        (users - идентификаторы или подзапрос по ним).
+        Если переданы ингредиенты, обновляются только их суммы.
+        """
+        list(User.objects.select_for_update().filter(
+            pk__in=users).order_by('pk').values_list('pk'))
+        items = self.filter(user__in=users)
+        totals = self.live_totals(users)
+        if ingredients is not None:
+            items = items.filter(ingredient__in=ingredients)
+            totals = totals.filter(ingredient__in=ingredients)
+        items.delete()
+        self.bulk_create(
+            [self.model(user_id=user_id, ingredient_id=ingredient_id,
+                        total_amount=total_amount)
+             for user_id, ingredient_id, total_amount in totals]
+        )
+
+
+class ShoppingCartItem(models.Model):
+    """
+    Денормализованная модель списка покупок.
+    Хранит итоговое количество каждого ингредиента
+    по всем рецептам в корзине пользователя.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_items',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField(
+        'Общее количество'
+    )
+
+    objects = ShoppingCartItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_item'
+            )
+        ]
+
+    def __str__(self):
+        return (f'{self.user.username} - {self.ingredient.name}: '
+                f'{self.total_amount} {self.ingredient.measurement_unit}')
+
+
+class ImportedRecipeBatch(models.Model):
+    """
+    Блок рецептов архива, загруженный командой import_recipes.
+    Запись создается в той же транзакции, что и рецепты блока,
+    поэтому повторный запуск пропускает ровно загруженные блоки.
+    """
+    checksum = models.CharField(
+        'SHA-256 файла блока',
+        max_length=64,
+        unique=True
+    )
+    member = models.CharField(
+        'Файл в архиве',
+        max_length=255
+    )
+    recipes = models.PositiveIntegerField(
+        'Количество рецептов'
+    )
+    imported_at = models.DateTimeField(
+        'Дата загрузки',
+        auto_now_add=True
+    )
+
+    class Meta:
+        verbose_name = 'Загруженный блок рецептов'
+        verbose_name_plural = 'Загруженные блоки рецептов'
+
+    def __str__(self):
+        return f'{self.member} ({self.checksum[:12]})'
@@ -0,0 +1,216 @@
+import itertools
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from recipes.cache import recipes_version
+from recipes.models import Recipe, RecipeIngredientLink
+
+# Запас при поиске измененных рецептов: транзакция может
+# зафиксироваться позже времени, записанного в updated_at.
+CHANGES_MARGIN = timedelta(minutes=1)
+
+
+class PantryMatches:
+    """
+    Упорядоченный результат подбора: пары (id рецепта, число
+    недостающих ингредиентов). Поддерживает len() и срезы,
+    поэтому его можно передать пагинатору.
+    """
+
+    def __init__(self, recipe_ids, missing):
+        self.recipe_ids = recipe_ids
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def __getitem__(self, index):
+        return list(zip(self.recipe_ids[index].tolist(),
+                        self.missing[index].tolist()))
+
+
+class PantryIndex:
+    """
+    Обратный индекс «ингредиент -> рецепты» в памяти процесса.
+    Каждому рецепту выделен слот. Списки слотов хранятся в виде CSR:
+    массив слотов, отсортированный по ингредиентам, и смещения
+    списка каждого ингредиента. Измененный или новый рецепт получает
+    новый слот в дополнительных списках, старый слот помечается
+    неактивным. Когда изменений накапливается больше
+    PANTRY_INDEX_MAX_CHANGES, индекс собирается заново.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self.synced_at = None
+
+    def load(self, recipe_ids, links):
+        """
+        Собирает индекс из отсортированного массива id рецептов
+        и массива пар (ингредиент, рецепт).
+        """
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        links = links[np.lexsort((links[:, 1], links[:, 0]))]
+        slots = np.searchsorted(recipe_ids, links[:, 1]).astype(np.int32)
+        self.keys, starts = np.unique(links[:, 0], return_index=True)
+        self.indptr = np.append(starts, len(links))
+        self.postings = slots
+        self.base_size = len(recipe_ids)
+        self.recipe_ids = recipe_ids
+        self.sizes = np.bincount(
+            slots, minlength=len(recipe_ids)).astype(np.int32)
+        self.active = np.ones(len(recipe_ids), dtype=bool)
+        self.extra_postings = {}
+        self.extra_slots = {}
+        self.applied = {}
+
+    def build(self):
+        self.synced_at = Recipe.objects.aggregate(
+            synced_at=Max('updated_at'))['synced_at']
+        recipe_ids = np.fromiter(
+            Recipe.objects.order_by('pk').values_list(
+                'pk', flat=True).iterator(), dtype=np.int64)
+        links = np.fromiter(itertools.chain.from_iterable(
+            RecipeIngredientLink.objects.values_list(
+                'ingredient', 'recipe').iterator(chunk_size=10000)
+        ), dtype=np.int64)
+        self.load(recipe_ids, links)
+        if self.synced_at is not None:
+            self.applied = dict(Recipe.objects.filter(
+                updated_at__gt=self.synced_at - CHANGES_MARGIN
+            ).values_list('pk', 'updated_at'))
+
+    def find_slot(self, recipe_id):
+        if recipe_id in self.extra_slots:
+            return self.extra_slots[recipe_id]
+        slot = int(np.searchsorted(
+            self.recipe_ids[:self.base_size], recipe_id))
+        if slot < self.base_size and self.recipe_ids[slot] == recipe_id:
+            return slot
+        return None
+
+    def put(self, recipes):
+        """
+        Добавляет рецепты {id: ингредиенты} в новые слоты, отключая
+        их прежние слоты. Массивы слотов удлиняются одним
+        concatenate на все рецепты синхронизации.
+        """
+        if not recipes:
+            return
+        for recipe_id in recipes:
+            slot = self.find_slot(recipe_id)
+            if slot is not None:
+                self.active[slot] = False
+        start = len(self.recipe_ids)
+        count = len(recipes)
+        self.recipe_ids = np.concatenate((
+            self.recipe_ids, np.fromiter(recipes, np.int64, count)))
+        self.sizes = np.concatenate((self.sizes, np.fromiter(
+            map(len, recipes.values()), np.int32, count)))
+        self.active = np.concatenate((self.active, np.ones(count, bool)))
+        for slot, (recipe_id, ingredients) in enumerate(
+                recipes.items(), start):
+            self.extra_slots[recipe_id] = slot
+            for ingredient in ingredients:
+                self.extra_postings.setdefault(ingredient, []).append(slot)
+
+    def apply_changes(self):
+        """
+        Переносит в индекс рецепты, измененные после последней
+        синхронизации. Возвращает False, если индекс нужно
+        собрать заново.
+        """
+        since = self.synced_at - CHANGES_MARGIN
+        changed = {
+            pk: updated_at for pk, updated_at
+            in Recipe.objects.filter(updated_at__gt=since).values_list(
+                'pk', 'updated_at')
+            if self.applied.get(pk) != updated_at
+        }
+        if len(self.extra_slots) + len(changed) > (
+                settings.PANTRY_INDEX_MAX_CHANGES):
+            return False
+        ingredients = {pk: [] for pk in changed}
+        for recipe_id, ingredient in RecipeIngredientLink.objects.filter(
+                recipe__in=changed).values_list('recipe', 'ingredient'):
+            ingredients[recipe_id].append(ingredient)
+        self.put(ingredients)
+        self.applied.update(changed)
+        if changed:
+            self.synced_at = max(self.synced_at, *changed.values())
+        self.applied = {pk: updated_at
+                        for pk, updated_at in self.applied.items()
+                        if updated_at > self.synced_at - CHANGES_MARGIN}
+        # Удаленные рецепты не оставляют следов в updated_at:
+        # их выдает только расхождение в количестве.
+        return Recipe.objects.count() == int(self.active.sum())
+
+    def refresh(self):
+        """
+        Синхронизирует индекс с базой, если версия рецептов изменилась.
+        """
+        version = recipes_version.get_version()
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            if self.synced_at is None or not self.apply_changes():
+                self.build()
+            self.version = version
+
+    def lookup(self, ingredients, max_missing=None):
+        with self._lock:
+            self.refresh()
+            return self.match(ingredients, max_missing)
+
+    def get_postings(self, ingredient):
+        position = np.searchsorted(self.keys, ingredient)
+        parts = []
+        if position < len(self.keys) and self.keys[position] == ingredient:
+            parts.append(self.postings[
+                self.indptr[position]:self.indptr[position + 1]])
+        if ingredient in self.extra_postings:
+            parts.append(np.array(
+                self.extra_postings[ingredient], dtype=np.int32))
+        return parts
+
+    def match(self, ingredients, max_missing=None):
+        """
+        Подбирает рецепты, в которых есть хотя бы один из ингредиентов.
+        Совпадения считаются одним bincount по спискам слотов,
+        рецепты упорядочены по числу недостающих ингредиентов,
+        затем от новых к старым.
+        """
+        parts = [part for ingredient in set(ingredients)
+                 for part in self.get_postings(ingredient)]
+        if not parts:
+            empty = np.array([], dtype=np.int64)
+            return PantryMatches(empty, empty)
+        matched = np.bincount(np.concatenate(parts),
+                              minlength=len(self.recipe_ids))
+        matched[~self.active] = 0
+        candidates = np.flatnonzero(matched)
+        missing = self.sizes[candidates] - matched[candidates]
+        if max_missing is not None:
+            candidates = candidates[missing <= max_missing]
+            missing = missing[missing <= max_missing]
+        recipe_ids = self.recipe_ids[candidates]
+        order = np.lexsort((-recipe_ids, missing))
+        return PantryMatches(recipe_ids[order], missing[order])
+
+
+pantry_index = PantryIndex()
+
+
+def match_pantry(ingredients, max_missing=None):
+    """
+    Подбор рецептов по продуктам с синхронизацией индекса процесса.
+    """
+    return pantry_index.lookup(ingredients, max_missing)
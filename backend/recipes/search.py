@@ -0,0 +1,223 @@
+import bisect
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import (
+    BooleanField, Case, FloatField, IntegerField, Q, Value, When)
+from django.db.models.expressions import RawSQL
+
+from recipes.cache import ingredients_cache
+from recipes.models import Ingredient
+
+# Короче этой длины поиск идет только по началу названия.
+MIN_CONTAINS_LENGTH = 3
+
+# Рецептов в одном запросе при обновлении индекса SQLite
+# (ограничение на число параметров запроса).
+SQLITE_BATCH_SIZE = 500
+
+# Документ рецепта: название (вес A), ингредиенты (B), описание (C).
+POSTGRES_UPDATE_DOCUMENTS = """
+    UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector(%s, name), 'A')
+        || setweight(to_tsvector(%s, coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_recipeingredientlink link
+            JOIN recipes_ingredient ingredient
+                ON ingredient.id = link.ingredient_id
+            WHERE link.recipe_id = recipes_recipe.id), '')), 'B')
+        || setweight(to_tsvector(%s, text), 'C')
+    WHERE id = ANY(%s)
+"""
+
+SQLITE_DELETE_DOCUMENTS = 'DELETE FROM recipes_recipe_fts WHERE rowid IN ({})'
+
+SQLITE_INSERT_DOCUMENTS = """
+    INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text)
+    SELECT recipe.id, recipe.name,
+        coalesce(group_concat(ingredient.name, ' '), ''), recipe.text
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_recipeingredientlink link
+        ON link.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = link.ingredient_id
+    WHERE recipe.id IN ({})
+    GROUP BY recipe.id
+"""
+
+
+def normalize(value):
+    """
+    Приводит строку к виду для сравнения без учета регистра,
+    в том числе для кириллицы.
+    """
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientPrefixIndex:
+    """
+    Индекс ингредиентов в памяти процесса.
+    Хранит отсортированный массив нормализованных названий,
+    поиск по началу названия выполняется бинарным поиском.
+    Перестраивается при смене версии кеша ингредиентов.
+    Используется, если база данных не PostgreSQL.
+    """
+
+    def load(self):
+        def build():
+            entries = sorted(
+                (normalize(name), pk) for pk, name
+                in Ingredient.objects.values_list('pk', 'name'))
+            return ([key for key, _ in entries],
+                    [pk for _, pk in entries])
+
+        _, index = ingredients_cache.get('prefix_index', build)
+        return index
+
+    def search(self, query, limit):
+        """
+        Возвращает идентификаторы ингредиентов: сначала названия,
+        начинающиеся с запроса, затем содержащие его.
+        """
+        keys, ids = self.load()
+        query = normalize(query)
+        found = []
+        position = bisect.bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(ids[position])
+            position += 1
+        if len(query) < MIN_CONTAINS_LENGTH:
+            return found
+        for key, pk in zip(keys, ids):
+            if len(found) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                found.append(pk)
+        return found
+
+
+ingredient_index = IngredientPrefixIndex()
+
+
+def search_ingredients(queryset, query, limit=None):
+    """
+    Поиск ингредиентов по названию с ранжированием:
+    совпадения с началом названия выше совпадений внутри названия.
+    В PostgreSQL запрос обслуживается индексами по UPPER(name),
+    в остальных базах - индексом в памяти процесса.
+    """
+    limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+    if connections[queryset.db].vendor != 'postgresql':
+        ids = ingredient_index.search(query, limit)
+        return queryset.filter(pk__in=ids).order_by(Case(
+            *[When(pk=pk, then=Value(position))
+              for position, pk in enumerate(ids)],
+            output_field=IntegerField()
+        ))
+    if len(query) < MIN_CONTAINS_LENGTH:
+        return queryset.filter(name__istartswith=query)[:limit]
+    return queryset.filter(name__icontains=query).annotate(
+        prefix_rank=Case(
+            When(name__istartswith=query, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by('prefix_rank', 'name')[:limit]
+
+
+def search_terms(query):
+    """
+    Разбивает запрос на слова без служебных символов
+    полнотекстового поиска.
+    """
+    return re.findall(r'\w+', query.lower())
+
+
+def update_recipe_documents(recipe_ids, using='default'):
+    """
+    Пересобирает поисковые документы рецептов:
+    столбец tsvector в PostgreSQL или таблицу FTS5 в SQLite.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    connection = connections[using]
+    config = settings.RECIPE_SEARCH_CONFIG
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(POSTGRES_UPDATE_DOCUMENTS,
+                           (config, config, config, recipe_ids))
+        elif connection.vendor == 'sqlite':
+            for start in range(0, len(recipe_ids), SQLITE_BATCH_SIZE):
+                batch = recipe_ids[start:start + SQLITE_BATCH_SIZE]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(
+                    SQLITE_DELETE_DOCUMENTS.format(placeholders), batch)
+                cursor.execute(
+                    SQLITE_INSERT_DOCUMENTS.format(placeholders), batch)
+
+
+def delete_recipe_documents(recipe_ids, using='default'):
+    """
+    Удаляет поисковые документы удаленных рецептов из таблицы FTS5
+    в SQLite. В PostgreSQL документ хранится в строке рецепта
+    и удаляется вместе с ней.
+    """
+    recipe_ids = list(recipe_ids)
+    connection = connections[using]
+    if not recipe_ids or connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for start in range(0, len(recipe_ids), SQLITE_BATCH_SIZE):
+            batch = recipe_ids[start:start + SQLITE_BATCH_SIZE]
+            cursor.execute(SQLITE_DELETE_DOCUMENTS.format(
+                ', '.join(['%s'] * len(batch))), batch)
+
+
+def search_recipes(queryset, query):
+    """
+    Полнотекстовый поиск рецептов по названию, описанию и названиям
+    ингредиентов. Каждое слово запроса ищется как начало слова,
+    результаты сортируются по релевантности search_rank.
+    В PostgreSQL запрос идет по GIN-индексу столбца search_vector,
+    в SQLite - по таблице FTS5, в остальных базах - через LIKE.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        params = (settings.RECIPE_SEARCH_CONFIG, tsquery)
+        queryset = queryset.filter(RawSQL(
+            'recipes_recipe.search_vector @@ to_tsquery(%s, %s)',
+            params, output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            'ts_rank(recipes_recipe.search_vector, to_tsquery(%s, %s))',
+            params, output_field=FloatField()
+        ))
+    elif vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # Таблица FTS5 присоединяется к рецептам: MATCH и bm25
+        # вычисляются за один проход по индексу, а не подзапросом
+        # на каждую строку.
+        queryset = queryset.extra(
+            select={'search_rank':
+                    '-bm25(recipes_recipe_fts, 10.0, 5.0, 1.0)'},
+            tables=['recipes_recipe_fts'],
+            where=['recipes_recipe_fts.rowid = recipes_recipe.id',
+                   'recipes_recipe_fts MATCH %s'],
+            params=[match],
+        )
+    else:
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term)
+                | Q(text__icontains=term)
+                | Q(ingredients__ingredient__name__icontains=term)
+            )
+        queryset = queryset.distinct().annotate(
+            search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.order_by('-search_rank', '-pub_date')
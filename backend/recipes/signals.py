@@ -0,0 +1,237 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save,
+)
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+
+from recipes.cache import (
+    ingredients_cache, popularity_version, recipes_version, tags_cache,
+    user_state_version, users_version,
+)
+from recipes.feed import drop_feeds, followers_of, push_to_feeds
+from recipes.models import (
+    Ingredient, Recipe, RecipeIngredientLink, ShoppingCartItem, Tag,
+    UserFavoriteRecipe, UserShoppingCart,
+)
+from recipes.search import delete_recipe_documents, update_recipe_documents
+from users.models import Subscribe, User
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    """
+    Сбрасывает кеш ингредиентов после их изменения.
+    """
+    ingredients_cache.bump_on_commit()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    """
+    Сбрасывает кеш тегов после их изменения.
+    """
+    tags_cache.bump_on_commit()
+
+
+@receiver(post_delete, sender=Tag)
+def clear_tag_bit(instance, **kwargs):
+    """
+    Убирает бит удаленного тега из масок рецептов.
+    """
+    Recipe.objects.with_tags([instance.pk]).refresh_tag_masks()
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes(**kwargs):
+    """
+    Меняет версию рецептов после их изменения.
+    """
+    recipes_version.bump_on_commit()
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_users(update_fields=None, **kwargs):
+    """
+    Меняет версию профилей пользователей.
+    Обновление только даты входа профиль не меняет.
+    """
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    users_version.bump_on_commit()
+
+
+@receiver([post_save, post_delete], sender=UserFavoriteRecipe)
+@receiver([post_save, post_delete], sender=UserShoppingCart)
+@receiver([post_save, post_delete], sender=Subscribe)
+def invalidate_user_state(instance, **kwargs):
+    """
+    Меняет версию отметок пользователя после изменения
+    избранного, списка покупок или подписок.
+    """
+    user_state_version(instance.user_id).bump_on_commit()
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, **kwargs):
+    """
+    Добавляет опубликованный рецепт в ленты подписчиков автора.
+    """
+    if created:
+        transaction.on_commit(lambda: push_to_feeds(
+            instance.pk, followers_of(instance.author_id)))
+
+
+@receiver(post_delete, sender=Recipe)
+def drop_recipe_feeds(instance, **kwargs):
+    """
+    Сбрасывает ленты подписчиков автора удаленного рецепта.
+    """
+    transaction.on_commit(partial(
+        drop_feeds, followers_of(instance.author_id)))
+
+
+@receiver([post_save, post_delete], sender=Subscribe)
+def drop_subscriber_feed(instance, **kwargs):
+    """
+    Сбрасывает ленту пользователя после изменения его подписок.
+    """
+    transaction.on_commit(partial(drop_feeds, [instance.user_id]))
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(instance, **kwargs):
+    """
+    Обновляет поисковый документ рецепта после фиксации транзакции.
+    Ингредиенты меняются в одной транзакции с сохранением рецепта,
+    поэтому к этому моменту они уже записаны.
+    """
+    transaction.on_commit(partial(update_recipe_documents, [instance.pk]))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(instance, using, **kwargs):
+    """
+    Удаляет поисковый документ рецепта вместе с рецептом.
+    """
+    delete_recipe_documents([instance.pk], using)
+
+
+@receiver(post_save, sender=Ingredient)
+def index_ingredient_recipes(instance, created, **kwargs):
+    """
+    Обновляет поисковые документы рецептов
+    с переименованным ингредиентом.
+    """
+    if not created:
+        transaction.on_commit(lambda: update_recipe_documents(
+            Recipe.objects.filter(
+                ingredients__ingredient=instance
+            ).values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Recipe)
+def refresh_carts_of_deleted_recipe(instance, **kwargs):
+    """
+    Пересчитывает списки покупок с удаляемым рецептом. Корзины
+    удаляются каскадно вместе с рецептом, поэтому их владельцы
+    запоминаются до удаления.
+    """
+    users = list(UserShoppingCart.objects.filter(
+        recipe=instance).values_list('user', flat=True))
+    if users:
+        ShoppingCartItem.objects.refresh_on_commit(
+            users=users, ingredients=instance.ingredients.values_list(
+                'ingredient', flat=True))
+
+
+@receiver(post_save, sender=RecipeIngredientLink)
+def refresh_carts_of_saved_link(instance, created, **kwargs):
+    """
+    Пересчитывает списки покупок с рецептом после изменения его
+    ингредиентов в обход сериализатора (в админке). Прежний
+    ингредиент измененной связи неизвестен, поэтому пересчитываются
+    все позиции владельцев корзин.
+    """
+    ShoppingCartItem.objects.refresh_on_commit(
+        recipes=[instance.recipe_id],
+        ingredients=[instance.ingredient_id] if created else None)
+
+
+@receiver(post_delete, sender=RecipeIngredientLink)
+def refresh_carts_of_deleted_link(instance, **kwargs):
+    ShoppingCartItem.objects.refresh_on_commit(
+        recipes=[instance.recipe_id], ingredients=[instance.ingredient_id])
+
+
+COUNTER_FIELDS = {
+    UserFavoriteRecipe: 'favorites_count',
+    UserShoppingCart: 'shopping_cart_count',
+}
+
+
+def change_counter(recipe_id, field, delta):
+    """
+    Атомарно изменяет счетчик рецепта выражением F().
+    Счетчик не опускается ниже нуля, даже если он уже
+    разошелся с таблицей отметок.
+    """
+    Recipe.objects.filter(pk=recipe_id).update(
+        **{field: Greatest(F(field) + delta, 0)})
+    popularity_version.bump_on_commit()
+
+
+@receiver(pre_save, sender=UserFavoriteRecipe)
+@receiver(pre_save, sender=UserShoppingCart)
+def remember_previous_mark(sender, instance, **kwargs):
+    """
+    Запоминает пользователя и рецепт сохраняемой отметки:
+    в админке их можно сменить у существующей записи.
+    """
+    instance.previous_mark = None
+    if instance.pk is not None:
+        instance.previous_mark = sender.objects.filter(
+            pk=instance.pk).values_list('user', 'recipe').first()
+
+
+@receiver(post_save, sender=UserFavoriteRecipe)
+@receiver(post_save, sender=UserShoppingCart)
+def count_saved_mark(sender, instance, created, **kwargs):
+    """
+    Обновляет счетчики рецептов после сохранения отметки любым
+    способом: через API, в админке или из кода. Массовые операции
+    (bulk_create, update) сигналов не отправляют - их счетчики
+    исправляет команда repair_recipe_counters.
+    """
+    field = COUNTER_FIELDS[sender]
+    previous = getattr(instance, 'previous_mark', None)
+    if created:
+        change_counter(instance.recipe_id, field, 1)
+    elif previous is not None and previous[1] != instance.recipe_id:
+        change_counter(previous[1], field, -1)
+        change_counter(instance.recipe_id, field, 1)
+
+
+@receiver(post_delete, sender=UserFavoriteRecipe)
+@receiver(post_delete, sender=UserShoppingCart)
+def count_deleted_mark(sender, instance, **kwargs):
+    change_counter(instance.recipe_id, COUNTER_FIELDS[sender], -1)
+
+
+@receiver([post_save, post_delete], sender=UserShoppingCart)
+def refresh_cart_owner(instance, **kwargs):
+    """
+    Пересчитывает список покупок пользователя после изменения
+    корзины любым способом, а если в админке у записи сменили
+    пользователя или рецепт - и список прежнего владельца.
+    """
+    users = [instance.user_id]
+    previous = getattr(instance, 'previous_mark', None)
+    if previous is not None and previous != (instance.user_id,
+                                             instance.recipe_id):
+        users.append(previous[0])
+    ShoppingCartItem.objects.refresh_on_commit(users=users)
@@ -0,0 +1,322 @@
+import itertools
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from recipes.cache import recipes_version
+from recipes.models import Recipe, RecipeIngredientLink, UserFavoriteRecipe
+
+logger = logging.getLogger(__name__)
+
+# Массивы индекса. Строки - рецепты, столбцы - ингредиенты; матрица
+# хранится дважды: по строкам (векторы рецептов) и по столбцам
+# (обратные списки для расчета косинусной близости). synced_at -
+# последнее время изменения рецепта на момент сборки (timestamp).
+INDEX_ARRAYS = (
+    'recipe_ids', 'ingredient_ids', 'idf',
+    'row_indptr', 'row_columns', 'row_weights',
+    'column_indptr', 'column_rows', 'column_weights',
+    'synced_at',
+)
+
+# Запас при поиске измененных рецептов: транзакция может
+# зафиксироваться позже времени, записанного в updated_at.
+CHANGES_MARGIN = timedelta(minutes=1)
+
+CURRENT_FILE = 'current'
+
+
+def fetch_links(recipes=None):
+    """
+    Пары (ингредиент, рецепт) из базы в виде массива numpy.
+    """
+    links = RecipeIngredientLink.objects.all()
+    if recipes is not None:
+        links = links.filter(recipe__in=recipes)
+    return np.fromiter(itertools.chain.from_iterable(
+        links.values_list('ingredient', 'recipe').iterator(
+            chunk_size=10000)
+    ), dtype=np.int64).reshape(-1, 2)
+
+
+def compute_idf(recipe_count, links):
+    """
+    Сглаженный IDF ингредиентов: редкие ингредиенты
+    сильнее влияют на близость рецептов.
+    """
+    ingredient_ids, frequency = np.unique(links[:, 0], return_counts=True)
+    idf = np.log((1 + recipe_count) / (1 + frequency)) + 1
+    return ingredient_ids, idf.astype(np.float32)
+
+
+def vectorize(recipe_ids, links, ingredient_ids, idf):
+    """
+    TF-IDF векторы рецептов с единичной нормой в виде
+    троек (строка, столбец, вес). Ингредиенты без IDF пропускаются.
+    """
+    rows = np.searchsorted(recipe_ids, links[:, 1])
+    columns = np.searchsorted(ingredient_ids, links[:, 0])
+    known = columns < len(ingredient_ids)
+    known[known] = ingredient_ids[columns[known]] == links[known, 0]
+    rows, columns = rows[known], columns[known]
+    weights = idf[columns]
+    norms = np.sqrt(np.bincount(
+        rows, weights=weights ** 2, minlength=len(recipe_ids)))
+    return rows, columns, (weights / norms[rows]).astype(np.float32)
+
+
+def assemble(recipe_ids, ingredient_ids, idf, rows, columns, weights):
+    """
+    Раскладывает тройки в массивы индекса по строкам и по столбцам.
+    """
+    by_row = np.lexsort((columns, rows))
+    by_column = np.lexsort((rows, columns))
+    return {
+        'recipe_ids': recipe_ids,
+        'ingredient_ids': ingredient_ids,
+        'idf': idf,
+        'row_indptr': np.searchsorted(
+            rows[by_row], np.arange(len(recipe_ids) + 1)),
+        'row_columns': columns[by_row].astype(np.int32),
+        'row_weights': weights[by_row],
+        'column_indptr': np.searchsorted(
+            columns[by_column], np.arange(len(ingredient_ids) + 1)),
+        'column_rows': rows[by_column].astype(np.int32),
+        'column_weights': weights[by_column],
+    }
+
+
+def last_change():
+    """
+    Время последнего изменения рецептов как timestamp.
+    """
+    synced_at = Recipe.objects.aggregate(
+        synced_at=Max('updated_at'))['synced_at']
+    return np.float64(synced_at.timestamp() if synced_at else 0)
+
+
+def build_arrays():
+    """
+    Полная сборка индекса по всем рецептам.
+    """
+    synced_at = last_change()
+    recipe_ids = np.fromiter(
+        Recipe.objects.order_by('pk').values_list('pk', flat=True).iterator(),
+        dtype=np.int64)
+    links = fetch_links()
+    ingredient_ids, idf = compute_idf(len(recipe_ids), links)
+    arrays = assemble(recipe_ids, ingredient_ids, idf,
+                      *vectorize(recipe_ids, links, ingredient_ids, idf))
+    arrays['synced_at'] = synced_at
+    return arrays
+
+
+def update_arrays(arrays):
+    """
+    Переносит в индекс изменения рецептов после его сборки
+    с прежними IDF: удаленные рецепты убираются, новые и измененные
+    (по updated_at) векторизуются заново. Возвращает новые массивы
+    и число добавленных или измененных и удаленных рецептов.
+    """
+    synced_at = last_change()
+    since = datetime.fromtimestamp(
+        float(arrays['synced_at']), timezone.utc) - CHANGES_MARGIN
+    recipe_ids = arrays['recipe_ids']
+    current = np.fromiter(
+        Recipe.objects.order_by('pk').values_list('pk', flat=True).iterator(),
+        dtype=np.int64)
+    changed = np.fromiter(
+        Recipe.objects.filter(updated_at__gt=since).values_list(
+            'pk', flat=True), dtype=np.int64)
+    fresh_ids = np.union1d(np.setdiff1d(current, recipe_ids), changed)
+    keep = np.isin(recipe_ids, current) & ~np.isin(recipe_ids, fresh_ids)
+    deleted = int(len(recipe_ids) - np.isin(recipe_ids, current).sum())
+    if not len(fresh_ids) and not deleted:
+        return arrays, 0, 0
+    old_rows = np.repeat(np.arange(len(recipe_ids)),
+                         np.diff(arrays['row_indptr']))
+    kept = keep[old_rows]
+    rows, columns, weights = vectorize(
+        fresh_ids, fetch_links(fresh_ids.tolist()),
+        arrays['ingredient_ids'], arrays['idf'])
+    # Строки оставшихся и новых рецептов нумеруются заново
+    # в порядке id.
+    ids = np.concatenate((recipe_ids[keep], fresh_ids))
+    order = np.argsort(ids, kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    updated = assemble(
+        ids[order], arrays['ingredient_ids'], arrays['idf'],
+        position[np.concatenate((
+            (np.cumsum(keep) - 1)[old_rows[kept]],
+            rows + int(keep.sum())))],
+        np.concatenate((arrays['row_columns'][kept], columns)),
+        np.concatenate((arrays['row_weights'][kept], weights)),
+    )
+    updated['synced_at'] = max(synced_at, np.float64(arrays['synced_at']))
+    return updated, len(fresh_ids), deleted
+
+
+def save_arrays(arrays, directory=None):
+    """
+    Записывает индекс в новый каталог и атомарно переключает
+    на него файл current. Предыдущая сборка сохраняется,
+    пока ее могут читать запущенные процессы.
+    """
+    directory = directory or settings.RECIPE_SIMILARITY_DIR
+    build = uuid.uuid4().hex
+    os.makedirs(os.path.join(directory, build))
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(directory, build, f'{name}.npy'), arrays[name])
+    previous = read_current(directory)
+    pointer = os.path.join(directory, f'{CURRENT_FILE}.{build}')
+    with open(pointer, 'w') as file:
+        file.write(build)
+    os.replace(pointer, os.path.join(directory, CURRENT_FILE))
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and name not in (build, previous):
+            shutil.rmtree(path)
+    return build
+
+
+def read_current(directory=None):
+    directory = directory or settings.RECIPE_SIMILARITY_DIR
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def load_arrays(build, directory=None):
+    """
+    Открывает массивы сборки через mmap: страницы файлов
+    общие для всех процессов gunicorn.
+    """
+    directory = directory or settings.RECIPE_SIMILARITY_DIR
+    paths = {name: os.path.join(directory, build, f'{name}.npy')
+             for name in INDEX_ARRAYS}
+    # В сборках прежних версий нет synced_at.
+    return {name: np.load(path, mmap_mode='r')
+            for name, path in paths.items() if os.path.exists(path)}
+
+
+class SimilarityIndex:
+    """
+    Индекс близости рецептов по ингредиентам (TF-IDF и косинусная
+    мера). Собирается командой build_similarity_index и читается
+    процессами через mmap; изменения рецептов попадают в него
+    при следующем запуске команды (--incremental переносит новые,
+    измененные и удаленные рецепты). Без собранного индекса
+    (локальный запуск) массивы строятся в памяти и пересобираются
+    при смене версии рецептов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.key = None
+        self.arrays = None
+
+    def get_arrays(self):
+        build = read_current()
+        key = build or recipes_version.get_version()
+        with self._lock:
+            if key != self.key:
+                if build:
+                    self.arrays = load_arrays(build)
+                else:
+                    logger.info('Индекс близости рецептов не собран, '
+                                'строится в памяти процесса.')
+                    self.arrays = build_arrays()
+                self.key = key
+            return self.arrays
+
+    @staticmethod
+    def row_of(arrays, recipe_id):
+        row = int(np.searchsorted(arrays['recipe_ids'], recipe_id))
+        if (row < len(arrays['recipe_ids'])
+                and arrays['recipe_ids'][row] == recipe_id):
+            return row
+        return None
+
+    def vector(self, arrays, recipe_ids):
+        """
+        Сумма векторов рецептов в виде (столбцы, веса). Векторы
+        рецептов, которых еще нет в индексе, считаются по базе.
+        """
+        columns, weights, missing = [], [], []
+        for recipe_id in recipe_ids:
+            row = self.row_of(arrays, recipe_id)
+            if row is None:
+                missing.append(recipe_id)
+                continue
+            start, end = arrays['row_indptr'][row:row + 2]
+            columns.append(arrays['row_columns'][start:end])
+            weights.append(arrays['row_weights'][start:end])
+        if missing:
+            missing = np.array(sorted(missing), dtype=np.int64)
+            _, new_columns, new_weights = vectorize(
+                missing, fetch_links(missing.tolist()),
+                arrays['ingredient_ids'], arrays['idf'])
+            columns.append(new_columns)
+            weights.append(new_weights)
+        if not columns:
+            return np.array([], dtype=np.int64), np.array([])
+        return np.concatenate(columns), np.concatenate(weights)
+
+    def nearest(self, recipe_ids, limit):
+        """
+        Id рецептов, ближайших к сумме векторов recipe_ids,
+        по убыванию близости. Сами recipe_ids в выдачу не входят.
+        """
+        arrays = self.get_arrays()
+        columns, weights = self.vector(arrays, recipe_ids)
+        indptr = arrays['column_indptr']
+        rows = [arrays['column_rows'][indptr[column]:indptr[column + 1]]
+                for column in columns]
+        if not rows:
+            return []
+        scores = np.bincount(
+            np.concatenate(rows),
+            weights=np.concatenate([
+                arrays['column_weights'][indptr[column]:indptr[column + 1]]
+                * weight for column, weight in zip(columns, weights)]),
+            minlength=len(arrays['recipe_ids']))
+        for recipe_id in recipe_ids:
+            row = self.row_of(arrays, recipe_id)
+            if row is not None:
+                scores[row] = 0
+        limit = min(limit, int(np.count_nonzero(scores)))
+        if not limit:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        recipe_ids = arrays['recipe_ids'][top]
+        order = np.lexsort((-recipe_ids, -scores[top]))
+        return recipe_ids[order].tolist()
+
+
+similarity_index = SimilarityIndex()
+
+
+def similar_recipes(recipe_id, limit):
+    return similarity_index.nearest([recipe_id], limit)
+
+
+def recommended_recipes(user, limit):
+    """
+    Рецепты, близкие к последним рецептам из избранного пользователя.
+    """
+    history = list(UserFavoriteRecipe.objects.filter(
+        user=user).order_by('-id').values_list(
+            'recipe', flat=True)[:settings.RECIPE_SIMILARITY_HISTORY])
+    if not history:
+        return []
+    return similarity_index.nearest(history, limit)
@@ -0,0 +1,374 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from recipes.archive import (
+    ARCHIVE_VERSION, MANIFEST_MEMBER, TAGS_MEMBER, add_bytes,
+    add_json_lines, open_archive, recipes_member,
+)
+from recipes.cache import ingredients_cache, tags_cache
+from recipes.models import (
+    ImportedRecipeBatch, Ingredient, PendingCartRefresh, Recipe,
+    RecipeIngredientLink, ShoppingCartItem, Tag, UserShoppingCart,
+)
+from recipes.similarity import (
+    SimilarityIndex, build_arrays, load_arrays, read_current, save_arrays,
+    update_arrays,
+)
+from users.models import User
+
+
+class ShoppingCartItemSignalsTest(TestCase):
+    """
+    Списки покупок пересчитываются и при изменении рецептов
+    в обход API: удалении рецепта и правке ингредиентов в админке.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.other = (
+            User.objects.create(email=f'{name}@test.local', username=name,
+                                first_name='Имя', last_name='Фамилия')
+            for name in ('user', 'other'))
+        cls.salt, cls.sugar, cls.flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар', 'мука'))
+        cls.pie, cls.bread = (
+            Recipe.objects.create(author=cls.user, name=name,
+                                  text='Описание.', cooking_time=10,
+                                  image='recipes/test.png')
+            for name in ('Пирог', 'Хлеб'))
+        RecipeIngredientLink.objects.bulk_create([
+            RecipeIngredientLink(recipe=cls.pie, ingredient=cls.salt,
+                                 amount=5),
+            RecipeIngredientLink(recipe=cls.pie, ingredient=cls.sugar,
+                                 amount=100),
+            RecipeIngredientLink(recipe=cls.bread, ingredient=cls.salt,
+                                 amount=10),
+        ])
+        UserShoppingCart.objects.bulk_create([
+            UserShoppingCart(user=cls.user, recipe=cls.pie),
+            UserShoppingCart(user=cls.user, recipe=cls.bread),
+            UserShoppingCart(user=cls.other, recipe=cls.pie),
+        ])
+        ShoppingCartItem.objects.refresh([cls.user.pk, cls.other.pk])
+
+    def assertCartIsFresh(self):
+        self.assertEqual(
+            set(ShoppingCartItem.objects.values_list(
+                'user', 'ingredient', 'total_amount')),
+            set(ShoppingCartItem.objects.live_totals()))
+
+    def test_recipe_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pie.delete()
+        self.assertCartIsFresh()
+        self.assertEqual(
+            list(ShoppingCartItem.objects.values_list(
+                'user', 'ingredient', 'total_amount')),
+            [(self.user.pk, self.salt.pk, 10)])
+
+    def test_refresh_of_one_user(self):
+        ShoppingCartItem.objects.refresh([self.user.pk])
+        self.assertEqual(
+            dict(ShoppingCartItem.objects.filter(
+                user=self.user).values_list('ingredient', 'total_amount')),
+            {self.salt.pk: 15, self.sugar.pk: 100})
+
+    def test_link_amount_change(self):
+        link = RecipeIngredientLink.objects.get(
+            recipe=self.pie, ingredient=self.salt)
+        link.amount = 7
+        with self.captureOnCommitCallbacks(execute=True):
+            link.save()
+        self.assertCartIsFresh()
+
+    def test_link_ingredient_change(self):
+        link = RecipeIngredientLink.objects.get(
+            recipe=self.pie, ingredient=self.sugar)
+        link.ingredient = self.flour
+        with self.captureOnCommitCallbacks(execute=True):
+            link.save()
+        self.assertCartIsFresh()
+        self.assertFalse(ShoppingCartItem.objects.filter(
+            ingredient=self.sugar).exists())
+
+    def test_link_create_and_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredientLink.objects.create(
+                recipe=self.bread, ingredient=self.flour, amount=500)
+        self.assertCartIsFresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredientLink.objects.filter(recipe=self.pie).delete()
+        self.assertCartIsFresh()
+
+    def test_cart_edit_through_orm(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cart = UserShoppingCart.objects.create(user=self.other,
+                                                   recipe=self.bread)
+        self.assertCartIsFresh()
+        # Смена владельца, как в list_editable админки.
+        cart.user = self.user
+        with self.captureOnCommitCallbacks(execute=True):
+            UserShoppingCart.objects.filter(user=self.user,
+                                            recipe=self.bread).delete()
+            cart.save()
+        self.assertCartIsFresh()
+        self.assertFalse(ShoppingCartItem.objects.filter(
+            user=self.other, ingredient=self.salt, total_amount=15).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            UserShoppingCart.objects.filter(user=self.user).delete()
+        self.assertCartIsFresh()
+        self.assertFalse(ShoppingCartItem.objects.filter(
+            user=self.user).exists())
+
+    def test_one_refresh_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            RecipeIngredientLink.objects.filter(recipe=self.pie).delete()
+            self.bread.delete()
+        self.assertEqual(len([callback for callback in callbacks
+                              if isinstance(callback, PendingCartRefresh)]),
+                         1)
+
+
+class ImportReferenceTest(TestCase):
+    """
+    Повторная загрузка справочников не создает дублей
+    и сбрасывает их кеш.
+    """
+
+    def load(self, command, *args):
+        call_command(command, *args, stdout=io.StringIO())
+
+    def test_reload_ingredients(self):
+        self.load('load_to_db')
+        count = Ingredient.objects.count()
+        self.assertGreater(count, 0)
+        version = ingredients_cache.get_version()
+        self.load('load_to_db', '--path', os.path.join(
+            os.path.dirname(__file__), 'management', 'commands', 'data',
+            'ingredients.json'))
+        self.assertEqual(Ingredient.objects.count(), count)
+        self.assertNotEqual(ingredients_cache.get_version(), version)
+
+    def test_reload_tags(self):
+        self.load('load_tags')
+        count = Tag.objects.count()
+        self.assertGreater(count, 0)
+        Tag.objects.filter(slug='Breakfast').update(color='#000000')
+        version = tags_cache.get_version()
+        self.load('load_tags')
+        self.assertEqual(Tag.objects.count(), count)
+        self.assertEqual(Tag.objects.get(slug='Breakfast').color, '#FFFF00')
+        self.assertNotEqual(tags_cache.get_version(), version)
+
+
+class ImportRecipesTest(TestCase):
+    """
+    Загрузка архива рецептов: повторный запуск пропускает
+    загруженные блоки, теги сопоставляются по названию и цвету,
+    для картинок ставится построение копий.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.path = os.path.join(self.directory, 'recipes.tar')
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), 'orange').save(buffer, 'PNG')
+        author = {'email': 'author@test.local', 'username': 'author',
+                  'first_name': 'Имя', 'last_name': 'Фамилия'}
+        with open_archive(self.path, 'w') as archive:
+            add_bytes(archive, MANIFEST_MEMBER, json.dumps(
+                {'version': ARCHIVE_VERSION, 'recipes': 2}).encode())
+            add_json_lines(archive, TAGS_MEMBER, [
+                {'name': 'Завтрак', 'color': '#E26C2D', 'slug': 'morning'},
+                {'name': 'Обед', 'color': '#49B64E', 'slug': 'lunch'},
+            ])
+            for number in (1, 2):
+                add_json_lines(archive, recipes_member(number), [{
+                    'id': number,
+                    'name': f'Рецепт {number}',
+                    'text': 'Описание.',
+                    'cooking_time': 10,
+                    'pub_date': '2026-01-0{}T10:00:00+00:00'.format(number),
+                    'image': f'images/{number}.png',
+                    'author': author,
+                    'tags': ['morning', 'lunch'],
+                    'ingredients': [{'name': 'соль', 'measurement_unit': 'г',
+                                     'amount': number}],
+                }])
+                add_bytes(archive, f'images/{number}.png', buffer.getvalue())
+
+    def import_archive(self):
+        with mock.patch('recipes.management.commands.import_recipes.'
+                        'schedule_derivatives') as schedule:
+            call_command('import_recipes', self.path, stdout=io.StringIO())
+        return schedule
+
+    def test_import(self):
+        schedule = self.import_archive()
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(ImportedRecipeBatch.objects.count(), 2)
+        self.assertEqual(
+            sorted(call.args[0].name for call in schedule.call_args_list),
+            ['Рецепт 1', 'Рецепт 2'])
+        self.assertFalse(Tag.objects.filter(slug='morning').exists())
+        for recipe in Recipe.objects.all():
+            self.assertEqual(
+                set(recipe.tags.values_list('slug', flat=True)),
+                {'breakfast', 'lunch'})
+
+    def test_resume(self):
+        self.import_archive()
+        ImportedRecipeBatch.objects.filter(
+            member=recipes_member(2)).delete()
+        Recipe.objects.filter(name='Рецепт 2').delete()
+        schedule = self.import_archive()
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('name', flat=True)),
+            ['Рецепт 1', 'Рецепт 2'])
+        self.assertEqual(schedule.call_count, 1)
+
+    def test_manifest_first(self):
+        path = os.path.join(self.directory, 'old.tar')
+        with open_archive(path, 'w') as archive:
+            add_json_lines(archive, recipes_member(1), [])
+            add_bytes(archive, MANIFEST_MEMBER, json.dumps(
+                {'version': ARCHIVE_VERSION}).encode())
+        with self.assertRaisesMessage(CommandError, MANIFEST_MEMBER):
+            call_command('import_recipes', path, stdout=io.StringIO())
+        self.assertFalse(ImportedRecipeBatch.objects.exists())
+
+    def test_export_writes_manifest_first(self):
+        self.import_archive()
+        path = os.path.join(self.directory, 'export.tar')
+        call_command('export_recipes', path, stdout=io.StringIO())
+        with open_archive(path, 'r') as archive:
+            member = archive.next()
+            self.assertEqual(member.name, MANIFEST_MEMBER)
+            self.assertEqual(json.load(archive.extractfile(member)),
+                             {'version': ARCHIVE_VERSION, 'recipes': 2})
+
+
+class SimilarityIndexTest(TestCase):
+    """
+    Индекс близости: сборка, чтение через mmap и перенос
+    новых, измененных и удаленных рецептов без полной сборки.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            email='author@test.local', username='author',
+            first_name='Имя', last_name='Фамилия')
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар', 'яйцо', 'соль', 'перец')]
+        cls.recipes = [
+            cls.create_recipe(author, number, positions)
+            for number, positions in enumerate(
+                ((0, 1, 2), (0, 1, 3), (3, 4), (4,)))]
+        # Рецепты изменены задолго до сборки индекса. Рецепты,
+        # измененные в пределах CHANGES_MARGIN от последнего
+        # изменения, векторизуются заново при каждом обновлении.
+        Recipe.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        Recipe.objects.filter(pk__in=[
+            recipe.pk for recipe in cls.recipes[2:]
+        ]).update(updated_at=timezone.now() - timedelta(days=1))
+
+    @classmethod
+    def create_recipe(cls, author, number, positions):
+        recipe = Recipe.objects.create(
+            author=author, name=f'Рецепт {number}', text='Описание.',
+            cooking_time=10, image='recipes/test.png')
+        RecipeIngredientLink.objects.bulk_create([
+            RecipeIngredientLink(recipe=recipe, amount=1,
+                                 ingredient=cls.ingredients[position])
+            for position in positions])
+        return recipe
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings = override_settings(RECIPE_SIMILARITY_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def nearest(self, recipe, limit=10):
+        return SimilarityIndex().nearest([recipe.pk], limit)
+
+    def ids(self, *positions):
+        return [self.recipes[position].pk for position in positions]
+
+    def test_in_memory(self):
+        self.assertIsNone(read_current())
+        self.assertEqual(self.nearest(self.recipes[0]), self.ids(1))
+        self.assertEqual(self.nearest(self.recipes[2]), self.ids(3, 1))
+
+    def test_build_and_mmap(self):
+        arrays = build_arrays()
+        save_arrays(arrays)
+        loaded = load_arrays(read_current())
+        self.assertIsInstance(loaded['row_weights'], np.memmap)
+        for name, values in arrays.items():
+            np.testing.assert_array_equal(loaded[name], values)
+        # Векторы рецептов нормированы.
+        norms = np.add.reduceat(
+            loaded['row_weights'] ** 2, loaded['row_indptr'][:-1])
+        np.testing.assert_allclose(norms, 1, rtol=1e-6)
+        self.assertEqual(self.nearest(self.recipes[0]), self.ids(1))
+
+    def test_incremental(self):
+        save_arrays(build_arrays())
+        author = self.recipes[0].author
+        added = self.create_recipe(author, 4, (0, 1, 2))
+        edited = self.recipes[2]
+        edited.ingredients.all().delete()
+        RecipeIngredientLink.objects.create(
+            recipe=edited, ingredient=self.ingredients[2], amount=1)
+        edited.save()
+        self.recipes[3].delete()
+        arrays, updated, deleted = update_arrays(load_arrays(read_current()))
+        self.assertEqual((updated, deleted), (2, 1))
+        self.assertEqual(arrays['recipe_ids'].tolist(),
+                         self.ids(0, 1, 2) + [added.pk])
+        save_arrays(arrays)
+        # Новый рецепт совпадает с первым, измененный рецепт
+        # получил общий с ним ингредиент.
+        nearest = self.nearest(self.recipes[0])
+        self.assertEqual(nearest[0], added.pk)
+        self.assertCountEqual(nearest[1:], self.ids(1, 2))
+        # Повторное обновление снова векторизует только рецепты,
+        # измененные в пределах CHANGES_MARGIN.
+        again, updated, deleted = update_arrays(load_arrays(read_current()))
+        self.assertEqual((updated, deleted), (2, 0))
+        np.testing.assert_array_equal(again['recipe_ids'],
+                                      arrays['recipe_ids'])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('build_similarity_index', '--incremental', stdout=out)
+        self.assertIn('Проиндексировано рецептов: 4.', out.getvalue())
+        self.recipes[3].delete()
+        out = io.StringIO()
+        call_command('build_similarity_index', '--incremental', stdout=out)
+        self.assertIn('удалено: 1.', out.getvalue())